@@ -0,0 +1,106 @@
+"""Bases sintéticas (1k, 10k e 100k empresas) para os benchmarks dos caminhos quentes."""
+import random
+from datetime import date, timedelta
+from io import BytesIO
+
+import pandas as pd
+import pytest
+import xlsxwriter
+
+import main as app
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+IMPORT_ROWS = 1_000
+
+SEGMENT_SPELLINGS = [
+    "Fornecedor de Dados", "fornecedor de dados", "Fornecedor de Soluções", "fornecedor de solucoes",
+    "Potenciais Novos Negócios", "Fornecedor de Dados; Fornecedor de Soluções",
+    "fornecedor de dados, potenciais novos negocios", "Sem Segmento", "-", "",
+]
+WORDS = ["dados", "analytics", "consultoria", "sistemas", "tecnologia", "informação", "mercado",
+         "pesquisa", "varejo", "crédito", "logística", "agro", "saúde", "energia", "digital"]
+SUFFIXES = ["Ltda", "S.A.", "ME", "EIRELI", ""]
+
+
+def _cnpj(rng: random.Random) -> str:
+    base = [rng.randint(0, 9) for _ in range(8)] + [0, 0, 0, 1]
+    for n in (12, 13):
+        w = [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2][-n:]
+        d = 11 - sum(a * b for a, b in zip(base, w)) % 11
+        base.append(0 if d >= 10 else d)
+    return "".join(map(str, base))
+
+
+def _date(rng: random.Random):
+    return date(2021, 1, 1) + timedelta(days=rng.randint(0, 2200)) if rng.random() < 0.8 else None
+
+
+def synthetic_companies(n: int, rng: random.Random, start: int = 0) -> pd.DataFrame:
+    """n empresas no esquema limpo (datas como date, demais colunas texto)."""
+    rows = []
+    now = pd.Timestamp("2024-01-01")
+    for i in range(start, start + n):
+        ass = _date(rng)
+        row = {c: "-" for c in app.EXPECTED_COLS}
+        row.update({
+            "ID": f"bench{i:08d}",
+            "NOME_EMPRESA": f"{' '.join(rng.sample(WORDS, 2)).title()} {i} {rng.choice(SUFFIXES)}".strip(),
+            "CNPJ": _cnpj(rng), "SEGMENTO": rng.choice(SEGMENT_SPELLINGS) or "-",
+            "PRIORIDADE": rng.choice(["Alta", "Média", "Baixa"]),
+            "DESCRICAO": " ".join(rng.choices(WORDS, k=30)), "OBS": " ".join(rng.choices(WORDS, k=8)),
+            "DATA_ASSINATURA": ass,
+            "INICIO_RENOV": ass + timedelta(days=300) if ass else None,
+            "VIGENCIA": ass + timedelta(days=365) if ass else None,
+            "CREATED_AT": now, "UPDATED_AT": now,
+        })
+        rows.append(row)
+    return pd.DataFrame(rows, columns=app.ALL_COLS)
+
+
+def synthetic_xlsx(df: pd.DataFrame) -> BytesIO:
+    """Planilha de importação com os cabeçalhos originais e datas DD/MM/AAAA."""
+    canon_to_orig = {v: k for k, v in app.ORIGINAL_TO_CANON.items()}
+    cols = [c for c in app.EXPECTED_COLS if c in canon_to_orig]
+    buf = BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+    ws = wb.add_worksheet("Dados")
+    ws.write_row(0, 0, [canon_to_orig[c] for c in cols])
+    for r, row in enumerate(df[cols].itertuples(index=False, name=None), start=1):
+        ws.write_row(r, 0, [v.strftime("%d/%m/%Y") if isinstance(v, date) else v for v in row])
+    wb.close()
+    buf.seek(0)
+    buf.name = "bench.xlsx"
+    return buf
+
+
+@pytest.fixture(scope="session", params=list(SIZES), ids=list(SIZES))
+def companies(request) -> pd.DataFrame:
+    """Base sintética de cada tamanho, gerada uma vez por sessão (semente fixa)."""
+    return synthetic_companies(SIZES[request.param], random.Random(42))
+
+
+@pytest.fixture
+def loaded(app, companies):
+    """Grava a base no DuckDB em memória do teste; load() volta a tabela a esse estado."""
+    def load():
+        app._ensure_ledger()
+        for fqn in (app.FQN_MAIN, app.FQN_COMMENTS, app.FQN_IMPORTS, app.FQN_IMPORT_ROWS):
+            app._write(f"DELETE FROM {fqn}")
+        app._write_df(companies, app.FQN_MAIN)
+        app._refresh_statuses()
+        app._import_checkpoints().clear()
+        app._export_cache()["items"].clear()
+        app._invalidate_snapshot()
+    load()
+    load.companies = companies
+    return load
+
+
+@pytest.fixture
+def incoming_xlsx(companies) -> BytesIO:
+    """IMPORT_ROWS linhas: metade repete empresas da base (vira atualização), metade é nova."""
+    incoming = synthetic_companies(IMPORT_ROWS, random.Random(7), start=len(companies))
+    half = IMPORT_ROWS // 2
+    for c in ("NOME_EMPRESA", "CNPJ"):
+        incoming.iloc[:half, incoming.columns.get_loc(c)] = companies[c].iloc[:half].to_numpy()
+    return synthetic_xlsx(incoming)
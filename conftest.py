@@ -0,0 +1,41 @@
+"""Fixtures comuns de tests/ e benchmarks/: o app no modo offline, num DuckDB em memória novo por teste."""
+import logging
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+import main  # noqa: E402  (importar só define as funções; a interface roda em main.main())
+
+
+@pytest.fixture(autouse=True)
+def app(monkeypatch, tmp_path):
+    """
+    O módulo main sem Snowflake: configuração trocada nos atributos do módulo (as funções leem
+    na hora da chamada), sem semente do parcerias.db e com os caches do processo e a sessão zerados.
+    """
+    monkeypatch.setattr(main, "DATA_MODE", "offline")
+    monkeypatch.setattr(main, "DUCKDB_PATH", ":memory:")
+    monkeypatch.setattr(main, "LEGACY_DB_PATH", str(tmp_path / "sem-legado.db"))
+    monkeypatch.setattr(main, "DOCS_DIR", str(tmp_path / "documentos"))
+    st.cache_resource.clear()
+    st.session_state.clear()
+    main._ensure_status_cols()
+    main._ensure_docs()
+    main._ensure_ledger()
+    yield main
+    st.cache_resource.clear()
+    st.session_state.clear()
+
+
+@pytest.fixture
+def add_companies(app):
+    """Grava empresas na tabela principal; o que não vier em cada dict fica "-" (datas vazias)."""
+    def _add(rows: list[dict]) -> pd.DataFrame:
+        blank = {c: None if c in app.DATE_COLS else "-" for c in app.EXPECTED_COLS}
+        df = pd.DataFrame([blank | r for r in rows]).reindex(columns=app.ALL_COLS)
+        df["CREATED_AT"] = df["UPDATED_AT"] = pd.Timestamp("2024-01-01")
+        app._write_df(df, app.FQN_MAIN)
+        return df
+    return _add
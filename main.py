@@ -1,11 +1,33 @@
 # app.py
 import streamlit as st
 import pandas as pd
+import numpy as np
 from uuid import uuid4
 from datetime import date, datetime
+from collections import Counter, OrderedDict, deque
+from bisect import bisect_left
+from functools import lru_cache, wraps
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 import unicodedata
+import re
+import zlib
 import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import duckdb
+import openpyxl
+import xlsxwriter
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+from pypdf import PdfReader
 from snowflake.snowpark import Session
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from io import BytesIO
 
 # =========================
@@ -13,6 +35,7 @@ from io import BytesIO
 # =========================
 st.set_page_config(page_title="Atuação de Prospecção de Dados", layout="wide")
 st.logo("logo_ibre.png")
+_log = logging.getLogger("prospec")
 
 # =========================
 # MOCK DE USUÁRIOS
@@ -22,19 +45,375 @@ USERS = {
     "spdo_admin" :{"password": "123", "name": "SPDO Admin", "role": "admin"},
 }
 
+# =========================
+# PARÂMETROS OPCIONAIS ([app] no secrets.toml ou APP_<CHAVE> no ambiente)
+# =========================
+def _app_cfg(key: str, default):
+    raw = os.environ.get(f"APP_{key.upper()}")
+    if raw is None:
+        try:
+            raw = st.secrets.get("app", {}).get(key)
+        except Exception:
+            raw = None
+    if raw is None:
+        return default
+    if isinstance(default, bool):
+        return str(raw).strip().lower() in {"1", "true", "sim", "yes"}
+    return type(default)(raw)
+
+# validade máxima do snapshot em memória (segundos)
+CACHE_TTL_S = _app_cfg("cache_ttl_s", 300)
+# "full": recarrega a tabela inteira ao vencer o TTL e filtra em memória (snapshot compartilhado)
+# "delta": busca só linhas com UPDATED_AT novo (marca d'água) e concilia IDs periodicamente
+# "query": filtro/projeção/ordem compilados no SQL; cada consulta fica em cache até o TTL
+#          (opcional: para tabelas grandes demais para manter inteiras em memória)
+SYNC_MODE = _app_cfg("sync_mode", "full")
+SYNC_INTERVAL_S = _app_cfg("sync_interval_s", 30)
+SYNC_RECONCILE_S = _app_cfg("sync_reconcile_s", 3600)
+SYNC_OVERLAP_S = _app_cfg("sync_overlap_s", 120)
+# "snowflake": lê e grava no Snowflake
+# "mirror": lê de uma réplica DuckDB local (atualizada em segundo plano) e grava no Snowflake
+# "offline": lê e grava só no DuckDB local, sem Snowflake (desenvolvimento/testes)
+DATA_MODE = _app_cfg("data_mode", "snowflake")
+# réplica/base local fica fora do repositório; o parcerias.db versionado só é lido (semente do offline)
+DUCKDB_PATH = _app_cfg("duckdb_path", os.path.join(tempfile.gettempdir(), "prospec", "local.duckdb"))
+LEGACY_DB_PATH = "parcerias.db"
+MIRROR_REFRESH_S = _app_cfg("mirror_refresh_s", 60)
+# cards por página na lista (a consulta traz só a página visível)
+PAGE_SIZE = _app_cfg("page_size", 24)
+PAGE_SIZE_OPTIONS = sorted({12, 24, 48, 96, PAGE_SIZE})
+
+# =========================
+# MEDIÇÃO (tempo por etapa, por execução da página)
+# =========================
+# cada etapa medida vira um evento {etapa, ms, linhas, bytes, id da consulta, ...} ligado à
+# execução (rerun) da sessão que o gerou, inclusive quando roda no pool de segundo plano.
+# "depth" indica o aninhamento (uma etapa "sql" dentro de "fetch.df" tem depth 1).
+# Administradores veem o detalhamento na barra lateral e podem baixar os eventos em JSON;
+# com perf_log_json cada evento também sai no log "prospec.perf" como uma linha JSON.
+# perf: "admin" (padrão) mede só sessões de administrador, "all" mede todas, "off" desliga.
+PERF_MODE = _app_cfg("perf", "admin")
+PERF_LOG_JSON = _app_cfg("perf_log_json", False)
+PERF_RUNS_KEPT = 20          # execuções guardadas por sessão
+PERF_SESSIONS_KEPT = 50      # sessões com execuções guardadas (LRU: a menos recente sai)
+PERF_EVENTS_MAX = 5000       # eventos guardados no processo (todas as sessões)
+PERF_BYTES_SAMPLE = 2000     # acima disso o tamanho do resultado é estimado por amostra
+_perf_log = logging.getLogger("prospec.perf")
+_perf_local = threading.local()
+
+@st.cache_resource
+def _perf_state() -> dict:
+    return {"lock": threading.Lock(), "runs": OrderedDict(), "events": deque(maxlen=PERF_EVENTS_MAX)}
+
+def _perf_session() -> str | None:
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+def _perf_active() -> bool:
+    """Mede nesta thread? Com perf="admin", só se a sessão abriu execução em _perf_begin_run."""
+    if PERF_MODE == "all":
+        return True
+    return PERF_MODE == "admin" and _perf_session() in _perf_state()["runs"]
+
+def _perf_begin_run(admin: bool = False):
+    """Abre o registro desta execução do script (chamado no topo da página)."""
+    sid = _perf_session()
+    if PERF_MODE == "off" or sid is None:
+        return
+    state = _perf_state()
+    with state["lock"]:
+        if PERF_MODE == "admin" and not admin:
+            state["runs"].pop(sid, None)  # saiu da conta de administrador: para de medir
+            return
+        runs = state["runs"].get(sid)
+        if runs is None:
+            runs = state["runs"][sid] = deque(maxlen=PERF_RUNS_KEPT)
+            while len(state["runs"]) > PERF_SESSIONS_KEPT:
+                state["runs"].popitem(last=False)
+        state["runs"].move_to_end(sid)
+        runs.append({"run": runs[-1]["run"] + 1 if runs else 1, "started_at": datetime.now().isoformat(timespec="seconds"),
+                     "t0": time.perf_counter(), "ms": None, "events": []})
+
+def _perf_end_run():
+    """Fecha a execução (só chega aqui quem não parou antes com st.stop/st.rerun)."""
+    sid = _perf_session()
+    if PERF_MODE == "off" or sid is None:
+        return
+    state = _perf_state()
+    with state["lock"]:
+        runs = state["runs"].get(sid)
+        if runs and runs[-1]["ms"] is None:
+            runs[-1]["ms"] = round((time.perf_counter() - runs[-1]["t0"]) * 1000, 1)
+
+def _perf_record(ev: dict, seconds: float):
+    ev["ms"] = round(seconds * 1000, 2)
+    ev["ts"] = datetime.now().isoformat(timespec="milliseconds")
+    ev["thread"] = threading.current_thread().name
+    sid = _perf_session()
+    state = _perf_state()
+    with state["lock"]:
+        runs = state["runs"].get(sid)
+        if runs:
+            ev["run"] = runs[-1]["run"]
+            ev["at_ms"] = round((time.perf_counter() - runs[-1]["t0"] - seconds) * 1000, 1)
+            runs[-1]["events"].append(ev)
+        state["events"].append({**ev, "session": (sid or "-")[:8]})
+    if PERF_LOG_JSON:
+        _perf_log.info(json.dumps(ev, default=str, ensure_ascii=False))
+
+@contextmanager
+def _timed(stage: str, **info):
+    """Mede o bloco; quem chama pode completar o evento devolvido (rows, bytes, query_id...)."""
+    if not _perf_active():
+        yield {}
+        return
+    depth = getattr(_perf_local, "depth", 0)
+    ev = {"stage": stage, "depth": depth, **info, "ok": False}
+    _perf_local.depth = depth + 1
+    t0 = time.perf_counter()
+    try:
+        yield ev
+        ev["ok"] = True
+    finally:
+        _perf_local.depth = depth
+        _perf_record(ev, time.perf_counter() - t0)
+
+def _timed_iter(stage: str, batches, **info):
+    """Como _timed para geradores de lotes: conta só o tempo gasto produzindo cada lote."""
+    if not _perf_active():
+        yield from batches
+        return
+    ev = {"stage": stage, "depth": getattr(_perf_local, "depth", 0), **info,
+          "rows": 0, "bytes": 0, "batches": 0, "ok": False}
+    it, spent = iter(batches), 0.0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            finally:
+                spent += time.perf_counter() - t0
+            pdf = item[0] if isinstance(item, tuple) else item
+            ev["rows"] += len(pdf)
+            ev["bytes"] += _df_bytes(pdf)
+            ev["batches"] += 1
+            yield item
+    except StopIteration:
+        ev["ok"] = True
+    finally:
+        _perf_record(ev, spent)
+
+def _result_size(ev: dict, out):
+    """Preenche linhas/bytes do evento quando o resultado é (ou começa com) um DataFrame ou lista."""
+    pdf = out[0] if isinstance(out, tuple) and out else out
+    if isinstance(pdf, pd.DataFrame):
+        ev["rows"] = len(pdf)
+        ev["bytes"] = _df_bytes(pdf)
+    elif isinstance(pdf, list):
+        ev["rows"] = len(pdf)
+
+def _timed_fn(stage: str):
+    """Decorador: mede cada chamada da função como a etapa `stage`."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _timed(stage) as ev:
+                out = fn(*args, **kwargs)
+                _result_size(ev, out)
+                return out
+        return wrapper
+    return deco
+
+def _df_bytes(pdf: pd.DataFrame) -> int:
+    """Tamanho do resultado em memória (amostrado em tabelas grandes)."""
+    n = len(pdf)
+    if n <= PERF_BYTES_SAMPLE:
+        return int(pdf.memory_usage(index=False, deep=True).sum())
+    sample = pdf.head(PERF_BYTES_SAMPLE).memory_usage(index=False, deep=True).sum()
+    return int(sample * n / PERF_BYTES_SAMPLE)
+
+def _sql_label(q: str) -> str:
+    return " ".join(str(q).split())[:200]
+
+def _perf_runs() -> list[dict]:
+    """Execuções guardadas da sessão atual, da mais recente para a mais antiga."""
+    state = _perf_state()
+    with state["lock"]:
+        return [dict(r, events=list(r["events"])) for r in reversed(state["runs"].get(_perf_session(), []))]
+
+def _perf_export() -> bytes:
+    """Eventos do processo (todas as sessões) em JSON, para comparar entre deploys."""
+    state = _perf_state()
+    with state["lock"]:
+        events = list(state["events"])
+    doc = {"exported_at": datetime.now().isoformat(timespec="seconds"), "data_mode": DATA_MODE,
+           "sync_mode": SYNC_MODE, "events": events}
+    return json.dumps(doc, default=str, ensure_ascii=False, indent=1).encode("utf-8")
+
 # =========================
 # SNOWFLAKE (TABELAS ALVO)
 # =========================
 FQN_MAIN     = 'BASES_SPDO.DB_APP_PROSPEC_DATA.TB_EMPRESAS'
 FQN_COMMENTS = 'BASES_SPDO.DB_APP_PROSPEC_DATA.TB_EMPRESAS_COMENTARIOS'
+FQN_IMPORTS  = 'BASES_SPDO.DB_APP_PROSPEC_DATA.TB_EMPRESAS_IMPORTACOES'
+FQN_IMPORT_ROWS = 'BASES_SPDO.DB_APP_PROSPEC_DATA.TB_EMPRESAS_IMPORTACOES_LINHAS'
+FQN_DOCS     = 'BASES_SPDO.DB_APP_PROSPEC_DATA.TB_EMPRESAS_DOCUMENTOS'
+
+# pool de sessões por processo: nada conecta no import nem na home pública;
+# a primeira consulta abre a sessão, que volta ao pool para o próximo usuário
+SF_POOL_SIZE = _app_cfg("sf_pool_size", 4)          # sessões simultâneas no máximo
+SF_POOL_WAIT_S = _app_cfg("sf_pool_wait_s", 30)      # espera por uma sessão livre
+SF_HEALTH_S = _app_cfg("sf_health_s", 300)           # ociosa há mais que isso: testa antes de usar
+SF_KEEPALIVE_S = _app_cfg("sf_keepalive_s", 900)     # ping periódico nas sessões ociosas
+# erros de sessão expirada/derrubada: a sessão é descartada e a consulta refeita numa nova
+_SF_SESSION_GONE = ("390111", "390112", "390114", "Authentication token has expired",
+                    "Session no longer exists", "Connection is closed", "connection is closed")
+# só refaz leituras: escritas podem ter sido aplicadas antes de a sessão cair (e o MERGE da
+# importação usa tabelas temporárias da sessão, que não existem numa sessão nova)
+_SF_RETRY_SAFE = ("SELECT", "WITH", "SHOW", "DESCRIBE")
 
 def get_session() -> Session:
-    return Session.builder.configs(st.secrets["snowflake"]).create()
+    cfg = {"client_session_keep_alive": True, **st.secrets["snowflake"]}
+    return Session.builder.configs(cfg).create()
+
+@st.cache_resource
+def _sf_pool() -> dict:
+    return {
+        "lock": threading.Lock(),
+        "slots": threading.BoundedSemaphore(SF_POOL_SIZE),
+        "idle": [],            # [(sessão, último uso em time.time())]
+        "keepalive": None,
+    }
+
+def _session_gone(e: Exception) -> bool:
+    return any(k in str(e) for k in _SF_SESSION_GONE)
+
+def _close_quietly(sess: Session):
+    try:
+        sess.close()
+    except Exception:
+        pass
+
+def _ping(sess: Session) -> bool:
+    try:
+        sess.sql("SELECT 1").collect()
+        return True
+    except Exception:
+        _close_quietly(sess)
+        return False
 
-sf_session = get_session()
+def _sf_keepalive(pool: dict):
+    """
+    Thread única que pinga as sessões ociosas e descarta as que morreram. Cada sessão pingada
+    ocupa uma vaga do semáforo, como um empréstimo normal, para o pool não passar de SF_POOL_SIZE.
+    """
+    def _loop():
+        while True:
+            time.sleep(SF_KEEPALIVE_S)
+            with pool["lock"]:
+                n = len(pool["idle"])
+            for _ in range(n):
+                if not pool["slots"].acquire(timeout=SF_POOL_WAIT_S):
+                    break  # pool todo em uso: as sessões estão vivas de qualquer jeito
+                try:
+                    with pool["lock"]:
+                        item = pool["idle"].pop(0) if pool["idle"] else None
+                    if item is None:
+                        break
+                    if _ping(item[0]):
+                        with pool["lock"]:
+                            pool["idle"].append((item[0], time.time()))
+                finally:
+                    pool["slots"].release()
+
+    with pool["lock"]:
+        if pool["keepalive"] is None:
+            pool["keepalive"] = threading.Thread(target=_loop, name="snowflake-keepalive", daemon=True)
+            pool["keepalive"].start()
+
+@contextmanager
+def _sf_session():
+    """Empresta uma sessão do pool (criando sob demanda) e devolve ao sair do bloco."""
+    pool = _sf_pool()
+    if not pool["slots"].acquire(timeout=SF_POOL_WAIT_S):
+        raise TimeoutError(f"Nenhuma sessão Snowflake livre após {SF_POOL_WAIT_S}s.")
+    sess = None
+    try:
+        while sess is None:
+            with pool["lock"]:
+                item = pool["idle"].pop() if pool["idle"] else None
+            if item is None:
+                sess = get_session()
+            elif time.time() - item[1] < SF_HEALTH_S or _ping(item[0]):
+                sess = item[0]
+        _sf_keepalive(pool)
+        try:
+            yield sess
+        except Exception as e:
+            if _session_gone(e):
+                _close_quietly(sess)
+                sess = None
+            raise
+    finally:
+        if sess is not None:
+            with pool["lock"]:
+                pool["idle"].append((sess, time.time()))
+        pool["slots"].release()
+
+def _retry_safe(q: str) -> bool:
+    words = str(q).lstrip(" \t\r\n(").split(None, 1)
+    return bool(words) and words[0].upper() in _SF_RETRY_SAFE
+
+def _sf_run(fn, retry: bool = False):
+    """
+    Executa fn(sessão). Com retry, se a sessão tiver expirado, reconecta e tenta mais uma vez
+    (só para o que pode repetir sem duplicar nada; ver _retry_safe).
+    """
+    try:
+        with _sf_session() as sess:
+            return fn(sess)
+    except Exception as e:
+        if not retry or not _session_gone(e):
+            raise
+    with _sf_session() as sess:
+        return fn(sess)
+
+def _sf_traced(sess: Session, ev: dict, run):
+    """run(sessão); anota no evento os IDs das consultas que o Snowflake executou."""
+    if not _perf_active():
+        return run(sess)
+    with sess.query_history() as qh:
+        try:
+            return run(sess)
+        finally:
+            ev["query_id"] = ",".join(r.query_id for r in qh.queries) or None
+
+class _SfQuery:
+    """Mesma interface do DataFrame do Snowpark; a sessão só é tomada do pool na execução."""
+    def __init__(self, q: str, params: list | None = None):
+        self.q = q
+        self.params = params
+
+    def collect(self):
+        with _timed("sql", backend="snowflake", sql=_sql_label(self.q)) as ev:
+            rows = _sf_run(lambda s: _sf_traced(s, ev, lambda s: s.sql(self.q, params=self.params).collect()),
+                           retry=_retry_safe(self.q))
+            ev["rows"] = len(rows)
+        return rows
+
+    def to_pandas(self) -> pd.DataFrame:
+        with _timed("sql", backend="snowflake", sql=_sql_label(self.q)) as ev:
+            pdf = _sf_run(lambda s: _sf_traced(s, ev, lambda s: s.sql(self.q, params=self.params).to_pandas()),
+                          retry=_retry_safe(self.q))
+            _result_size(ev, pdf)
+        return pdf
 
-def _sf(q: str):
-    return sf_session.sql(q)
+    def to_pandas_batches(self):
+        # a sessão fica emprestada até o último lote ser lido
+        with _sf_session() as s:
+            with _timed("sql", backend="snowflake", sql=_sql_label(self.q)) as ev:
+                batches = _sf_traced(s, ev, lambda s: s.sql(self.q, params=self.params).to_pandas_batches())
+            yield from _timed_iter("sql.fetch", batches, backend="snowflake", query_id=ev.get("query_id"))
 
 def _sf_escape(v: str) -> str:
     return str(v).replace("'", "''")
@@ -49,6 +428,13 @@ EXPECTED_COLS = [
     "RELACIONAMENTO","AUTOMACAO","OBS","PONTOS_FORTES","PONTOS_FRACOS","CONCORRENTES","STATUS_ATUAL"
 ]
 DATE_COLS = ["DATA_ASSINATURA","INICIO_RENOV","VIGENCIA"]
+ALL_COLS = ["ID", *EXPECTED_COLS, "CREATED_AT", "UPDATED_AT"]
+# o que a importação envia; CREATED_AT/UPDATED_AT vêm do relógio do banco (CURRENT_TIMESTAMP),
+# o mesmo das edições, para a marca d'água do modo delta nunca comparar dois relógios
+IMPORT_COLS = ["ID", *EXPECTED_COLS]
+COMMENT_COLS = ["ID", "EMPRESA_ID", "USERNAME", "NAME", "MESSAGE", "CREATED_AT"]
+# o que o card da listagem mostra; o registro completo é lido ao abrir o modal
+CARD_COLS = ["ID", "NOME_EMPRESA", "SEGMENTO", "STATUS", "VIGENCIA", "PRIORIDADE"]
 
 # mapeia cabeçalhos antigos (planilha) -> nomes limpos da tabela
 ORIGINAL_TO_CANON = {
@@ -138,30 +524,40 @@ def _deaccent_lower(s: str) -> str:
 
 SEG_ORDER = {seg: i for i, seg in enumerate(SEGMENT_OPTIONS)}
 
+# chaves sem acento aceitas para cada segmento canônico (usadas no filtro SQL)
+SEG_SQL_KEYS = {
+    opt: sorted({_deaccent_lower(opt)} | {_deaccent_lower(k) for k, v in SEG_CANON_MAP.items() if v == opt})
+    for opt in SEGMENT_OPTIONS
+}
+
+# chave sem acento -> segmento canônico (calculado uma vez)
+_SEG_LOOKUP = {
+    **{_deaccent_lower(opt): opt for opt in SEGMENT_OPTIONS},
+    **{_deaccent_lower(k): v for k, v in SEG_CANON_MAP.items()},
+}
+# um bit por segmento: filtro vira E binário em vez de busca em lista
+SEG_BITS = {seg: 1 << i for i, seg in enumerate(SEGMENT_OPTIONS)}
+_SEG_EMPTY = {"", "-", "nan", "NaN"}
+_SEG_SPLIT_RE = re.compile(r"[,;]")   # mesmos separadores do filtro SQL (_segment_tokens_sql)
+
+@lru_cache(maxsize=4096)
+def _segments_of(s: str) -> tuple[str, ...]:
+    """Segmentos canônicos de um texto de SEGMENTO (memo por valor distinto)."""
+    s = s.strip()
+    if s in _SEG_EMPTY:
+        return ("Sem Segmento",)
+    found = {_SEG_LOOKUP.get(_deaccent_lower(t)) for t in _SEG_SPLIT_RE.split(s) if t.strip()}
+    found.discard(None)
+    return tuple(sorted(found, key=SEG_ORDER.get)) or ("Sem Segmento",)
+
 def normalize_segments(val) -> list[str]:
     if val is None:
         return ["Sem Segmento"]
-    s = str(val).strip()
-    if s == "" or s in {"-", "nan", "NaN"}:
-        return ["Sem Segmento"]
-    toks = [t.strip() for t in s.split(",")]
-    out = []
-    for t in toks:
-        if not t:
-            continue
-        key = _deaccent_lower(t)
-        canon = SEG_CANON_MAP.get(key)
-        if canon:
-            out.append(canon)
-        else:
-            for opt in SEGMENT_OPTIONS:
-                if _deaccent_lower(opt) == key:
-                    canon = opt
-                    break
-            if canon:
-                out.append(canon)
-    out = sorted(set(out), key=lambda x: SEG_ORDER.get(x, 999))
-    return out or ["Sem Segmento"]
+    return list(_segments_of(str(val)))
+
+def segments_mask(val) -> int:
+    """SEGMENTO -> máscara de bits (SEG_BITS)."""
+    return sum(SEG_BITS[seg] for seg in _segments_of("" if val is None else str(val)))
 
 def segments_to_str(segments: list[str]) -> str:
     segs = sorted(set(segments), key=lambda x: SEG_ORDER.get(x, 999))
@@ -179,13 +575,24 @@ def ensure_state():
         st.session_state.upload_info = None
     if "segment_view" not in st.session_state:
         st.session_state.segment_view = "select"
+    if "card_page" not in st.session_state:
+        st.session_state.card_page = 0
+    if "page_size" not in st.session_state:
+        st.session_state.page_size = PAGE_SIZE
+    if "search_q" not in st.session_state:
+        st.session_state.search_q = ""
     # NOVO: controle do uploader e arquivos já processados
     if "upload_key" not in st.session_state:
         st.session_state.upload_key = 0
     if "processed_hashes" not in st.session_state:
         st.session_state.processed_hashes = set()
+    # relatório de duplicatas do arquivo carregado: {"digest", "report", "stats"}
+    if "dedup" not in st.session_state:
+        st.session_state.dedup = {}
+    # fila de gravação da sessão: {"updates": {ID: {coluna: valor}}, "comments": [linha, ...]}
+    if "pending_writes" not in st.session_state:
+        st.session_state.pending_writes = {"updates": {}, "comments": []}
 
-ensure_state()
 
 def render_public_home():
     st.title("🏗️ Atuação de Prospecção de Dados — FGV IBRE")
@@ -203,6 +610,110 @@ def render_public_home():
     )
     st.divider()
 
+# =========================
+# DATAS (normalização)
+# =========================
+# um único parser para todo o app: DD/MM/AAAA explícito (nunca mês primeiro), ISO e
+# número de série do Excel. Colunas são resolvidas por valor distinto, cada formato num
+# to_datetime vetorizado; valores soltos passam pelo mesmo caminho com memo (lru_cache).
+_DATE_PATTERNS = [
+    (r"\d{1,2}/\d{1,2}/\d{4}", "%d/%m/%Y"),
+    (r"\d{1,2}-\d{1,2}-\d{4}", "%d-%m-%Y"),
+    (r"\d{1,2}\.\d{1,2}\.\d{4}", "%d.%m.%Y"),
+    (r"\d{4}-\d{1,2}-\d{1,2}(?:[ T].*)?", "ISO8601"),
+    (r"\d{4}/\d{1,2}/\d{1,2}", "%Y/%m/%d"),
+]
+_EXCEL_SERIAL = r"\d{5}(?:\.\d+)?"
+_EXCEL_SERIAL_RANGE = (20000, 80000)   # 1954..2119: evita ler anos/contagens soltas como data
+_EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+_BLANK_DATES = {"", "-", "nan", "nat", "none"}
+
+def _parse_date_texts(texts: pd.Series) -> pd.Series:
+    """Textos -> datetime64 (NaT se vazio/inválido), um to_datetime por formato detectado."""
+    t = texts.astype("string").str.strip()
+    out = pd.Series(pd.NaT, index=t.index, dtype="datetime64[ns]")
+    todo = t.notna() & ~t.str.lower().isin(_BLANK_DATES)
+    for pattern, fmt in _DATE_PATTERNS:
+        m = todo & t.str.fullmatch(pattern).fillna(False).astype(bool)
+        if m.any():
+            out[m] = pd.to_datetime(t[m], format=fmt, errors="coerce")
+            todo &= ~m
+    m = todo & t.str.fullmatch(_EXCEL_SERIAL).fillna(False).astype(bool)
+    if m.any():
+        n = pd.to_numeric(t[m], errors="coerce")
+        n = n.where(n.between(*_EXCEL_SERIAL_RANGE))
+        out[m] = _EXCEL_EPOCH + pd.to_timedelta(n.floordiv(1), unit="D")
+    return out
+
+def _parse_date_col(values) -> pd.Series:
+    """Coluna inteira -> Series de datetime.date (None se vazio/inválido); parse por valor distinto."""
+    s = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.dt.date.astype(object).where(s.notna(), None)
+
+    uniq = pd.Index(pd.unique(s))
+    texts, fixed = {}, {}
+    for i, v in enumerate(uniq):
+        if v is None or (isinstance(v, float) and np.isnan(v)) or v is pd.NaT:
+            fixed[i] = None
+        elif isinstance(v, datetime):
+            fixed[i] = None if pd.isna(v) else v.date()
+        elif isinstance(v, date):
+            fixed[i] = v
+        elif isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool):
+            texts[i] = f"{float(v):.6f}".rstrip("0").rstrip(".")
+        else:
+            texts[i] = str(v)
+
+    parsed = [None] * len(uniq)
+    for i, d in fixed.items():
+        parsed[i] = d
+    if texts:
+        ts = _parse_date_texts(pd.Series(texts))
+        for i, d in ts.items():
+            parsed[i] = None if pd.isna(d) else d.date()
+
+    lut = np.array(parsed + [None], dtype=object)   # última posição: valor não encontrado
+    pos = uniq.get_indexer(s)
+    return pd.Series(lut[pos], index=s.index, dtype=object)
+
+def _as_ts(values) -> pd.Series:
+    """Como _parse_date_col, mas em datetime64 (para comparar colunas)."""
+    s = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    return pd.to_datetime(_parse_date_col(s))
+
+@lru_cache(maxsize=8192)
+def _parse_date_text(text: str) -> date | None:
+    d = _parse_date_texts(pd.Series([text])).iloc[0]
+    return None if pd.isna(d) else d.date()
+
+def _parse_date(val) -> date | None:
+    """Valor solto (texto da UI, date, Timestamp, série do Excel) -> datetime.date ou None."""
+    if val is None or val is pd.NaT:
+        return None
+    if isinstance(val, datetime):
+        return None if pd.isna(val) else val.date()
+    if isinstance(val, date):
+        return val
+    if isinstance(val, float) and np.isnan(val):
+        return None
+    if isinstance(val, (int, float, np.integer, np.floating)) and not isinstance(val, bool):
+        val = f"{float(val):.6f}".rstrip("0").rstrip(".")
+    return _parse_date_text(str(val))
+
+def _fmt_date_col(values: pd.Series) -> pd.Series:
+    """Coluna -> texto DD/MM/AAAA; o que não for data segue as regras de _fmt_date."""
+    d = _parse_date_col(values)
+    ok = d.notna()
+    out = pd.Series("-", index=values.index, dtype=object)
+    if ok.any():
+        out[ok] = pd.to_datetime(d[ok]).dt.strftime("%d/%m/%Y")
+    if (~ok).any():
+        out[~ok] = _map_unique(values[~ok], _fmt_date)
+    return out
+
 # =========================
 # HELPERS DE FORMATAÇÃO
 # =========================
@@ -226,31 +737,16 @@ def _fmt_bool(val):
     return _s(val)
 
 def _fmt_date(val):
-    if val is None:
+    d = _parse_date(val)
+    if d is not None:
+        return d.strftime("%d/%m/%Y")
+    if val is None or str(val).strip().lower() in _BLANK_DATES:
         return "-"
-    s = str(val).strip()
-    if s == "" or s.lower() in {"nan", "nat", "-"}:
-        return "-"
-    try:
-        if isinstance(val, (datetime, date)):
-            return val.strftime("%d/%m/%Y")
-        d = pd.to_datetime(s, errors="coerce", dayfirst=False)
-        if pd.notna(d):
-            return d.strftime("%d/%m/%Y")
-    except Exception:
-        pass
     return _s(val)
 
 def _to_datetime(val):
-    if val is None:
-        return pd.NaT
-    s = str(val).strip()
-    if s == "" or s.lower() in {"nan", "nat", "-"}:
-        return pd.NaT
-    try:
-        return pd.to_datetime(s, errors="coerce", dayfirst=True)
-    except Exception:
-        return pd.NaT
+    d = _parse_date(val)
+    return pd.NaT if d is None else pd.Timestamp(d)
 
 def _calc_status_like_excel(data_ass, inicio_renov, vigencia):
     today = pd.to_datetime(date.today())
@@ -278,163 +774,1427 @@ def _build_export_df(pdf: pd.DataFrame) -> pd.DataFrame:
 
     # Normaliza segmento e formata datas para DD/MM/AAAA
     if "SEGMENTO" in out.columns:
-        out["SEGMENTO"] = out["SEGMENTO"].apply(lambda v: segments_to_str(normalize_segments(v)))
+        out["SEGMENTO"] = _map_unique(out["SEGMENTO"].fillna("-"), lambda v: segments_to_str(normalize_segments(v)))
     for dc in DATE_COLS:
         if dc in out.columns:
-            out[dc] = out[dc].apply(_fmt_date)
+            out[dc] = _fmt_date_col(out[dc])
 
     # Renomeia para rótulos amigáveis
     out.rename(columns=LABEL, inplace=True)
     return out
 
-def _df_to_xlsx_bytes(df: pd.DataFrame) -> bytes:
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="Empresas")
-        # Ajuste simples de largura de coluna
-        ws = writer.sheets["Empresas"]
-        for i, col in enumerate(df.columns):
-            try:
-                w = int(min(40, max(12, df[col].astype(str).str.len().quantile(0.9) + 2)))
-            except Exception:
-                w = 18
-            ws.set_column(i, i, w)
-    buf.seek(0)
-    return buf.getvalue()
+# =========================
+# RÉPLICA LOCAL (DuckDB)
+# =========================
+LOCAL_MAIN     = FQN_MAIN.split(".")[-1]
+LOCAL_COMMENTS = FQN_COMMENTS.split(".")[-1]
+LEGACY_MAIN    = "PROSPECCAO"  # tabela antiga do parcerias.db, com os cabeçalhos da planilha
+LEGACY_COMMENTS = "PROSPECCAO_COMENTARIOS"
+
+_FQN_PREFIX = FQN_MAIN.rsplit(".", 1)[0] + "."
+
+def _local_sql(q: str) -> str:
+    # no DuckDB as tabelas ficam no schema padrão, só com o nome final
+    return q.replace(_FQN_PREFIX, "")
+
+def _duck_tables(con, catalog: str | None = None) -> set[str]:
+    q = "SELECT table_name FROM information_schema.tables"
+    if catalog is None:
+        return {r[0] for r in con.execute(q).fetchall()}
+    return {r[0] for r in con.execute(f"{q} WHERE table_catalog = ?", [catalog]).fetchall()}
+
+def _seed_from_legacy(con, tables: set[str]):
+    """
+    Popula TB_EMPRESAS e TB_EMPRESAS_COMENTARIOS a partir das tabelas antigas (cabeçalhos originais,
+    datas DD/MM/AAAA), no próprio banco ou no parcerias.db do repositório, anexado só para leitura.
+    """
+    prefix, attached = "", False
+    if LEGACY_MAIN not in tables:
+        if not os.path.exists(LEGACY_DB_PATH) or os.path.abspath(LEGACY_DB_PATH) == os.path.abspath(DUCKDB_PATH):
+            return
+        con.execute(f"ATTACH '{_sf_escape(LEGACY_DB_PATH)}' AS legacy (READ_ONLY)")
+        prefix, attached = "legacy.", True
+        tables = _duck_tables(con, "legacy")
+    canon_to_orig = {v: k for k, v in ORIGINAL_TO_CANON.items()}
+    sel = []
+    for c in EXPECTED_COLS:
+        src = f'"{canon_to_orig.get(c, c)}"'
+        if c in DATE_COLS:
+            sel.append(f"TRY_STRPTIME(NULLIF(TRIM({src}), '-'), '%d/%m/%Y')::DATE AS {c}")
+        else:
+            sel.append(f"{src} AS {c}")
+    try:
+        con.execute(
+            f"INSERT INTO {LOCAL_MAIN} BY NAME SELECT ID, {', '.join(sel)}, "
+            f"TRY_CAST(CREATED_AT AS TIMESTAMP) AS CREATED_AT, TRY_CAST(UPDATED_AT AS TIMESTAMP) AS UPDATED_AT "
+            f"FROM {prefix}{LEGACY_MAIN}"
+        )
+        if LEGACY_COMMENTS in tables:
+            con.execute(
+                f"INSERT INTO {LOCAL_COMMENTS} SELECT ID, EMPRESA_ID, USERNAME, NAME, MESSAGE, "
+                f"TRY_CAST(CREATED_AT AS TIMESTAMP) FROM {prefix}{LEGACY_COMMENTS}"
+            )
+    finally:
+        if attached:
+            con.execute("DETACH legacy")
+
+@st.cache_resource
+def _duck() -> dict:
+    """Conexão DuckDB do processo; cria as tabelas espelho se ainda não existirem."""
+    if DUCKDB_PATH != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(DUCKDB_PATH)), exist_ok=True)
+    con = duckdb.connect(DUCKDB_PATH)
+    tables = _duck_tables(con)
+    if LOCAL_COMMENTS not in tables:
+        con.execute(f"""CREATE TABLE {LOCAL_COMMENTS} (
+            ID VARCHAR, EMPRESA_ID VARCHAR, USERNAME VARCHAR, NAME VARCHAR, MESSAGE VARCHAR, CREATED_AT TIMESTAMP)""")
+    if _local_sql(FQN_DOCS) not in tables:
+        con.execute(f"""CREATE TABLE {_local_sql(FQN_DOCS)} (
+            ID VARCHAR, EMPRESA_ID VARCHAR, SHA256 VARCHAR, FILE_NAME VARCHAR, MIME VARCHAR,
+            SIZE_BYTES INTEGER, USERNAME VARCHAR, CREATED_AT TIMESTAMP)""")
+    if LOCAL_MAIN not in tables:
+        cols = ", ".join(["ID VARCHAR", *(f"{c} {'DATE' if c in DATE_COLS else 'VARCHAR'}" for c in EXPECTED_COLS),
+                          "CREATED_AT TIMESTAMP", "UPDATED_AT TIMESTAMP", *(f"{c} DATE" for c in DERIVED_COLS)])
+        con.execute(f"CREATE TABLE {LOCAL_MAIN} ({cols})")
+        if DATA_MODE == "offline":
+            _seed_from_legacy(con, tables)
+    # marcas d'água da réplica: tabela -> maior UPDATED_AT/CREATED_AT já copiado (relógio do Snowflake)
+    return {"con": con, "lock": threading.Lock(), "refreshed_at": None, "watermarks": {}, "reconciled_at": 0.0}
+
+def _duck_dates(pdf: pd.DataFrame) -> pd.DataFrame:
+    # DATE do DuckDB chega como datetime64; o Snowflake devolve datetime.date
+    for dc in (*DATE_COLS, *DERIVED_COLS):
+        if dc in pdf.columns:
+            pdf[dc] = pdf[dc].dt.date.astype(object).where(pdf[dc].notna(), None)
+    return pdf
+
+def _duck_df(q: str, params: list | None = None) -> pd.DataFrame:
+    with _timed("sql", backend="duckdb", sql=_sql_label(q)) as ev:
+        cur = _duck()["con"].cursor()
+        try:
+            pdf = cur.execute(_local_sql(q), params).df()
+        finally:
+            cur.close()
+        _result_size(ev, pdf)
+    return _duck_dates(pdf)
+
+def _duck_batches(q: str, params: list | None = None, batch_rows: int = 100_000):
+    """Resultado em lotes de ~batch_rows linhas, sem materializar a consulta inteira."""
+    return _timed_iter("sql", _duck_batches_raw(q, params, batch_rows), backend="duckdb", sql=_sql_label(q))
+
+def _duck_batches_raw(q: str, params: list | None, batch_rows: int):
+    cur = _duck()["con"].cursor()
+    try:
+        cur.execute(_local_sql(q), params)
+        while True:
+            pdf = cur.fetch_df_chunk(max(1, batch_rows // 2048))  # 2048 linhas por vetor
+            if pdf.empty:
+                break
+            yield _duck_dates(pdf)
+    finally:
+        cur.close()
+
+def _duck_exec(q: str, params: list | None = None):
+    with _timed("sql", backend="duckdb", sql=_sql_label(q)):
+        cur = _duck()["con"].cursor()
+        try:
+            cur.execute(_local_sql(q), params)
+        finally:
+            cur.close()
+
+def _duck_append(table: str, df: pd.DataFrame):
+    cur = _duck()["con"].cursor()
+    try:
+        cur.register("_src", df)
+        cur.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _src")
+    finally:
+        cur.close()
+
+# tabelas copiadas para a réplica e a coluna de tempo que guia o delta de cada uma
+MIRROR_TABLES = {FQN_MAIN: "UPDATED_AT", FQN_COMMENTS: "CREATED_AT", FQN_DOCS: "CREATED_AT"}
+
+def _mirror_fetch(fqn: str, ts_col: str, since) -> pd.DataFrame:
+    cols = ", ".join(READ_COLS) if fqn == FQN_MAIN else "*"
+    q = f"SELECT {cols} FROM {fqn}"
+    if since is not None:
+        since = (since - pd.Timedelta(seconds=SYNC_OVERLAP_S)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        q += f" WHERE {ts_col} >= CAST('{since}' AS TIMESTAMP)"
+    return _STORES["snowflake"].query(q)
+
+def _refresh_mirror(duck: dict, stt: dict):
+    """
+    Traz do Snowflake só as linhas com UPDATED_AT/CREATED_AT a partir da marca d'água (com a folga
+    SYNC_OVERLAP_S) e grava na réplica as que mudaram. A cada SYNC_RECONCILE_S copia as tabelas
+    inteiras, o que leva as exclusões. O cache só é invalidado quando algo mudou.
+    """
+    full = not duck["watermarks"] or time.monotonic() - duck["reconciled_at"] >= SYNC_RECONCILE_S
+    frames = {fqn: _mirror_fetch(fqn, ts, None if full else duck["watermarks"].get(fqn))
+              for fqn, ts in MIRROR_TABLES.items()}
+    changed = {}
+    with duck["lock"]:
+        cur = duck["con"].cursor()
+        try:
+            cur.execute("BEGIN TRANSACTION")
+            for fqn, df in frames.items():
+                table, ts = _local_sql(fqn), MIRROR_TABLES[fqn]
+                if not full and df.empty:
+                    changed[fqn] = set()
+                    continue
+                cur.register("_src", df)
+                if full:
+                    cur.execute(f"DELETE FROM {table}")
+                    cur.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _src")
+                else:
+                    # a folga traz de novo linhas já copiadas: só grava as novas ou com outro timestamp
+                    cur.execute(f"""CREATE OR REPLACE TEMP TABLE _mirror_chg AS SELECT s.* FROM _src s
+                        LEFT JOIN {table} t ON t.ID = s.ID AND t.{ts} = s.{ts} WHERE t.ID IS NULL""")
+                    cur.execute(f"DELETE FROM {table} WHERE ID IN (SELECT ID FROM _mirror_chg)")
+                    cur.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _mirror_chg")
+                    key = "ID" if fqn == FQN_MAIN else "EMPRESA_ID"
+                    changed[fqn] = {r[0] for r in cur.execute(f"SELECT {key} FROM _mirror_chg").fetchall()}
+                    cur.execute("DROP TABLE _mirror_chg")
+                cur.unregister("_src")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            cur.close()
+        for fqn, df in frames.items():
+            wm = _max_ts(df, MIRROR_TABLES[fqn])
+            if wm is not None and (duck["watermarks"].get(fqn) is None or wm > duck["watermarks"][fqn]):
+                duck["watermarks"][fqn] = wm
+        if full:
+            duck["reconciled_at"] = time.monotonic()
+        duck["refreshed_at"] = time.time()
+
+    with stt["lock"]:
+        if full or changed[FQN_MAIN]:
+            # no modo delta o snapshot se atualiza sozinho pela marca d'água; nos outros é relido
+            if full or SYNC_MODE != "delta":
+                stt["df"] = None
+            stt["views"].clear()
+            stt["version"] += 1
+        for fqn, cache in ((FQN_COMMENTS, stt["comments"]), (FQN_DOCS, stt["docs"])):
+            if full:
+                cache.clear()
+            else:
+                for eid in changed[fqn]:
+                    cache.pop(eid, None)
+        if full or changed[FQN_COMMENTS]:
+            stt["comments_gen"] += 1
+
+@st.cache_resource
+def _mirror_worker() -> threading.Thread:
+    """Thread única por processo que mantém a réplica atualizada."""
+    duck, stt = _duck(), _table_state()
+
+    def _loop():
+        while True:
+            last = duck["refreshed_at"]
+            if last is None or time.time() - last >= MIRROR_REFRESH_S:
+                try:
+                    _refresh_mirror(duck, stt)
+                except Exception:
+                    _log.exception("falha ao atualizar a réplica DuckDB")
+            time.sleep(MIRROR_REFRESH_S)
+
+    t = threading.Thread(target=_loop, name="duckdb-mirror", daemon=True)
+    t.start()
+    return t
+
+def _ensure_mirror():
+    duck = _duck()
+    if duck["refreshed_at"] is None and _duck_df(f"SELECT COUNT(*) AS N FROM {FQN_MAIN}")["N"].iloc[0] == 0:
+        _refresh_mirror(duck, _table_state())  # réplica vazia: primeira carga é síncrona
+    _mirror_worker()
 
 # =========================
-# HELPERS (SNOWFLAKE)
+# ARMAZENAMENTO (Snowflake ou DuckDB atrás da mesma interface)
+# =========================
+# o resto do app só fala com _read_df/_read_batches/_write/_write_df/_store_insert/_store_merge; data_mode decide
+# qual armazenamento é a fonte (onde as escritas valem), de onde vêm as leituras e se há réplica:
+#   snowflake -> fonte e leitura no Snowflake
+#   mirror    -> fonte no Snowflake, leitura e cópia das escritas no DuckDB local
+#   offline   -> tudo no DuckDB (duckdb_path=":memory:" dá um banco só em memória, p/ benchmarks)
+class _SnowflakeStore:
+    """Tabelas no Snowflake, via pool de sessões."""
+    name = "snowflake"
+
+    def query(self, q: str, params: list | None = None) -> pd.DataFrame:
+        return _SfQuery(q, params).to_pandas()
+
+    def batches(self, q: str, params: list | None = None):
+        return _SfQuery(q, params).to_pandas_batches()
+
+    def execute(self, q: str, params: list | None = None):
+        _SfQuery(q, params).collect()
+
+    @staticmethod
+    def regexp_replace_all(expr: str, pattern: str, repl: str) -> str:
+        # no Snowflake REGEXP_REPLACE troca todas as ocorrências por padrão
+        return f"REGEXP_REPLACE({expr}, '{pattern}', '{repl}')"
+
+    def append(self, df: pd.DataFrame, fqn: str):
+        db, schema, table = fqn.split(".")
+        _sf_run(lambda s: s.write_pandas(
+            df,
+            table_name=table,
+            database=db,
+            schema=schema,
+            overwrite=False,           # nunca sobrescreve
+            auto_create_table=False,   # tabela já existe
+            quote_identifiers=True
+        ))
+
+    def insert(self, df2: pd.DataFrame):
+        _insert_snowflake(df2)
+
+    def merge(self, df2: pd.DataFrame, update_cols: list[str]) -> tuple[int, int, list[str]]:
+        return _merge_snowflake(df2, update_cols)
+
+class _DuckStore:
+    """Tabelas no DuckDB local (arquivo DUCKDB_PATH ou ':memory:'), nomes sem banco/schema."""
+    name = "duckdb"
+
+    def query(self, q: str, params: list | None = None) -> pd.DataFrame:
+        return _duck_df(q, params)
+
+    def batches(self, q: str, params: list | None = None):
+        return _duck_batches(q, params)
+
+    def execute(self, q: str, params: list | None = None):
+        _duck_exec(q, params)
+
+    @staticmethod
+    def regexp_replace_all(expr: str, pattern: str, repl: str) -> str:
+        # no DuckDB só a primeira, sem a opção 'g'
+        return f"REGEXP_REPLACE({expr}, '{pattern}', '{repl}', 'g')"
+
+    def append(self, df: pd.DataFrame, fqn: str):
+        _duck_append(_local_sql(fqn), df)
+
+    def insert(self, df2: pd.DataFrame):
+        _insert_duck(df2)
+
+    def merge(self, df2: pd.DataFrame, update_cols: list[str]) -> tuple[int, int, list[str]]:
+        return _merge_duck(df2, update_cols)
+
+_STORES = {"snowflake": _SnowflakeStore(), "duckdb": _DuckStore()}
+
+def _source_store():
+    """Onde as escritas valem."""
+    return _STORES["duckdb" if DATA_MODE == "offline" else "snowflake"]
+
+def _read_backend() -> str:
+    """Nome do armazenamento das leituras, sem efeito colateral (para montar SQL do dialeto certo)."""
+    return "snowflake" if DATA_MODE == "snowflake" else "duckdb"
+
+def _read_store():
+    """De onde vêm as leituras (no modo mirror, garante a réplica carregada)."""
+    if DATA_MODE == "mirror":
+        _ensure_mirror()
+    return _STORES[_read_backend()]
+
+def _replica_store():
+    """Cópia local que recebe as escritas junto com a fonte (só no modo mirror)."""
+    return _STORES["duckdb"] if DATA_MODE == "mirror" else None
+
+def _read_df(q: str, params: list | None = None) -> pd.DataFrame:
+    """Leituras: Snowflake direto, ou DuckDB nos modos mirror/offline."""
+    return _read_store().query(q, params)
+
+def _read_batches(q: str):
+    """Como _read_df, mas em lotes (exportações grandes)."""
+    yield from _read_store().batches(q)
+
+def _write(q: str, params: list | None = None):
+    """Escritas: sempre na fonte; no modo mirror também na réplica, para a UI não esperar o refresh."""
+    _source_store().execute(q, params)
+    if (replica := _replica_store()) is not None:
+        replica.execute(q, params)
+
+def _write_df(df: pd.DataFrame, fqn: str, mirror: bool = True):
+    with _timed("write.df", table=fqn.split(".")[-1], rows=len(df), bytes=_df_bytes(df)):
+        _source_store().append(df, fqn)
+        if mirror and (replica := _replica_store()) is not None:
+            replica.append(df, fqn)
+
+def _store_insert(df2: pd.DataFrame):
+    """Acrescenta linhas importadas (IMPORT_COLS) na tabela principal, com timestamps do banco."""
+    with _timed("write.df", table=LOCAL_MAIN, rows=len(df2), bytes=_df_bytes(df2)):
+        _source_store().insert(df2)
+        if (replica := _replica_store()) is not None:
+            replica.insert(df2)
+
+def _store_merge(df2: pd.DataFrame, update_cols: list[str]) -> tuple[int, int, list[str]]:
+    """Upsert do lote na tabela principal (e na réplica); devolve (inseridas, atualizadas, IDs) da fonte."""
+    inserted, updated, ids = _source_store().merge(df2, update_cols)
+    if (replica := _replica_store()) is not None:
+        replica.merge(df2, update_cols)
+    return inserted, updated, ids
+
+# =========================
+# CACHE COMPARTILHADO (snapshot de TB_EMPRESAS)
+# =========================
+@st.cache_resource
+def _table_state() -> dict:
+    """Snapshot da tabela principal + versão, compartilhados por todas as sessões do processo."""
+    return {
+        "lock": threading.RLock(), "version": 0, "df": None, "loaded_at": 0.0,
+        "watermark": None, "reconciled_at": 0.0,
+        "views": OrderedDict(),  # SQL compilado -> (DataFrame, carregado_em)
+        "comments": {},          # EMPRESA_ID -> (DataFrame, carregado_em)
+        "comments_gen": 0,       # sobe a cada invalidação de comentários (leitura no meio não é guardada)
+        "docs": {},              # EMPRESA_ID -> (DataFrame de TB_EMPRESAS_DOCUMENTOS, carregado_em)
+    }
+
+@_timed_fn("snapshot.prepare")
+def _prepare_snapshot(pdf: pd.DataFrame) -> pd.DataFrame:
+    if "SEGMENTO" not in pdf.columns:
+        pdf["SEGMENTO"] = "-"
+    pdf["_seg_mask"] = _map_unique(pdf["SEGMENTO"].fillna("-"), segments_mask).astype("uint8")
+    if "NOME_EMPRESA" in pdf.columns:
+        pdf = pdf.sort_values("NOME_EMPRESA", kind="stable")
+    return pdf.reset_index(drop=True)
+
+def _max_ts(pdf: pd.DataFrame, col: str):
+    if col not in pdf.columns:
+        return None
+    wm = pd.to_datetime(pdf[col], errors="coerce").max()
+    return None if pd.isna(wm) else wm
+
+def _max_updated_at(pdf: pd.DataFrame):
+    return _max_ts(pdf, "UPDATED_AT")
+
+@_timed_fn("snapshot.load")
+def _full_load(stt: dict):
+    pdf = _read_df(f'SELECT * FROM {FQN_MAIN}')
+    stt["df"] = _prepare_snapshot(pdf)
+    stt["watermark"] = _max_updated_at(pdf)
+    stt["loaded_at"] = stt["reconciled_at"] = time.monotonic()
+    stt["version"] += 1
+
+@_timed_fn("snapshot.delta")
+def _delta_sync(stt: dict):
+    """
+    Busca só as linhas com UPDATED_AT >= marca d'água (menos uma folga) e mescla por ID.
+    A cada SYNC_RECONCILE_S confere a lista de IDs para remover excluídos.
+    """
+    if stt["watermark"] is None:
+        return _full_load(stt)
+    since = (stt["watermark"] - pd.Timedelta(seconds=SYNC_OVERLAP_S)).strftime("%Y-%m-%d %H:%M:%S.%f")
+    delta = _read_df(f"SELECT * FROM {FQN_MAIN} WHERE UPDATED_AT >= CAST('{since}' AS TIMESTAMP)")
+    pdf = stt["df"].drop(columns=["_seg_mask"])
+    n_before = len(pdf)
+
+    if time.monotonic() - stt["reconciled_at"] >= SYNC_RECONCILE_S:
+        ids = set(_read_df(f'SELECT ID FROM {FQN_MAIN}')["ID"])
+        if ids - set(pdf["ID"]) - set(delta["ID"]):
+            # linhas que escaparam da marca d'água (UPDATED_AT nulo/antigo): recarrega tudo
+            return _full_load(stt)
+        pdf = pdf[pdf["ID"].isin(ids)]
+        stt["reconciled_at"] = time.monotonic()
+
+    if not delta.empty:
+        # descarta o que já está no snapshot com o mesmo UPDATED_AT (folga da marca d'água)
+        known = pdf[["ID", "UPDATED_AT"]].drop_duplicates("ID").rename(columns={"UPDATED_AT": "_known"})
+        cmp = delta[["ID", "UPDATED_AT"]].merge(known, on="ID", how="left")
+        delta = delta[(cmp["_known"] != cmp["UPDATED_AT"]).to_numpy()]
+
+    if not delta.empty or len(pdf) != n_before:
+        pdf = pd.concat([pdf[~pdf["ID"].isin(delta["ID"])], delta], ignore_index=True)
+        stt["df"] = _prepare_snapshot(pdf)
+        stt["version"] += 1
+    wm = _max_updated_at(delta)
+    if wm is not None and wm > stt["watermark"]:
+        stt["watermark"] = wm
+    stt["loaded_at"] = time.monotonic()
+
+def _main_snapshot() -> pd.DataFrame:
+    """Tabela inteira em memória; só vai ao Snowflake se vazia, vencida (TTL) ou no intervalo do delta."""
+    stt = _table_state()
+    with stt["lock"]:
+        age = time.monotonic() - stt["loaded_at"]
+        if stt["df"] is None:
+            _full_load(stt)
+        elif SYNC_MODE == "delta":
+            if age >= SYNC_INTERVAL_S:
+                _delta_sync(stt)
+        elif age >= CACHE_TTL_S:
+            _full_load(stt)
+        return stt["df"]
+
+VIEW_CACHE_MAX = 64
+
+def _query_view(sql: str) -> pd.DataFrame:
+    """Resultado de uma consulta compilada, em cache até o TTL ou até a próxima escrita."""
+    stt = _table_state()
+    with stt["lock"]:
+        hit = stt["views"].get(sql)
+        if hit is not None and (time.monotonic() - hit[1]) < CACHE_TTL_S:
+            stt["views"].move_to_end(sql)
+            return hit[0]
+        version = stt["version"]
+    # consulta fora do lock, para views diferentes carregarem em paralelo;
+    # se houve escrita no meio, devolve o resultado mas não o guarda
+    pdf = _read_df(sql)
+    with stt["lock"]:
+        if stt["version"] == version:
+            stt["views"][sql] = (pdf, time.monotonic())
+            stt["views"].move_to_end(sql)
+            while len(stt["views"]) > VIEW_CACHE_MAX:
+                stt["views"].popitem(last=False)
+    return pdf
+
+def _table_version() -> int:
+    return _table_state()["version"]
+
+def _invalidate_snapshot():
+    stt = _table_state()
+    with stt["lock"]:
+        stt["df"] = None
+        stt["views"].clear()
+        stt["version"] += 1
+
+def _utc_now() -> pd.Timestamp:
+    # TIMESTAMP_NTZ volta do Snowflake sem fuso; mantém o snapshot homogêneo
+    return pd.Timestamp.now(tz="UTC").tz_localize(None)
+
+def _snapshot_value(col: str, v):
+    # converte o valor vindo da UI para o tipo que o Snowflake devolveria
+    if col in DATE_COLS:
+        return _parse_date(v)
+    return v
+
+def _patch_snapshot(rec_id: str, updates: dict):
+    """Aplica um UPDATE já confirmado no snapshot (copy-on-write), sem refetch."""
+    _patch_snapshot_many({rec_id: updates})
+
+def _patch_snapshot_many(updates_by_id: dict[str, dict]):
+    """Igual a _patch_snapshot para vários registros, com uma única cópia do snapshot."""
+    stt = _table_state()
+    with stt["lock"]:
+        stt["views"].clear()
+        stt["version"] += 1
+        if stt["df"] is None or not updates_by_id:
+            return
+        pdf = stt["df"].drop(columns=["_seg_mask"]).copy()
+        for rec_id, updates in updates_by_id.items():
+            mask = pdf["ID"] == rec_id
+            if not mask.any():
+                stt["df"] = None
+                return
+            for k, v in updates.items():
+                if k in (*DATE_COLS, *DERIVED_COLS) and k in pdf.columns:
+                    pdf[k] = pdf[k].astype(object)
+                pdf.loc[mask, k] = _utc_now() if k in {"CREATED_AT", "UPDATED_AT"} else _snapshot_value(k, v)
+        stt["df"] = _prepare_snapshot(pdf)
+
+def _append_snapshot(record: dict):
+    """Acrescenta um INSERT já confirmado no snapshot, sem refetch."""
+    stt = _table_state()
+    with stt["lock"]:
+        stt["views"].clear()
+        stt["version"] += 1
+        if stt["df"] is None:
+            return
+        now_ts = _utc_now()
+        row = {k: _snapshot_value(k, v) for k, v in record.items()}
+        row.update({"CREATED_AT": now_ts, "UPDATED_AT": now_ts})
+        pdf = pd.concat([stt["df"].drop(columns=["_seg_mask"]), pd.DataFrame([row])], ignore_index=True)
+        stt["df"] = _prepare_snapshot(pdf)
+
+# =========================
+# CONSULTAS COMPILADAS (filtro, projeção e ordem no SQL)
 # =========================
-def import_to_sf_append(df: pd.DataFrame) -> int:
+_SQL_ACCENTS_FROM = "áàâãäéèêëíìîïóòôõöúùûüç"
+_SQL_ACCENTS_TO   = "aaaaaeeeeiiiiooooouuuuc"
+
+def _segment_tokens_sql(col: str = "SEGMENTO") -> str:
     """
-    Sempre adiciona (APPEND) as linhas da planilha em {FQN_MAIN}.
-    Não cria tabela, não trunca, não sobrescreve.
+    Expressão ',tok1,tok2,' (minúscula, sem acento) para casar com LIKE '%,chave,%'. Separadores
+    ',' ou ';' com qualquer espaço em volta viram ',' e as pontas perdem todo espaço (tab incluso),
+    como o split/strip de _segments_of.
     """
-    df2 = df.copy()
+    re_all = _STORES[_read_backend()].regexp_replace_all
+    norm = re_all(f"LOWER(COALESCE({col}, ''))", "[[:space:]]*[,;][[:space:]]*", ",")
+    norm = re_all(norm, "^[[:space:]]+|[[:space:]]+$", "")
+    norm = f"TRANSLATE({norm}, '{_SQL_ACCENTS_FROM}', '{_SQL_ACCENTS_TO}')"
+    return f"(',' || {norm} || ',')"
+
+def _segment_predicate_sql(segmento: str) -> str:
+    """Mesma regra de normalize_segments, em SQL (vale para Snowflake e DuckDB)."""
+    toks = _segment_tokens_sql()
+
+    def _any(keys):
+        return "(" + " OR ".join(f"{toks} LIKE '%,{_sf_escape(k)},%'" for k in keys) + ")"
+
+    if segmento == "Sem Segmento":
+        # explícito, ou nenhum token reconhecido
+        others = [k for opt, keys in SEG_SQL_KEYS.items() if opt != "Sem Segmento" for k in keys]
+        return f"({_any(SEG_SQL_KEYS['Sem Segmento'])} OR NOT {_any(others)})"
+    return _any(SEG_SQL_KEYS[segmento])
+
+def _company_where(segmento: str | None) -> str:
+    if segmento and segmento != "Todos":
+        return f" WHERE {_segment_predicate_sql(segmento)}"
+    return ""
 
+def _company_query(segmento: str | None, cols: list[str], limit: int | None = None, offset: int = 0) -> str:
+    page = f" LIMIT {int(limit)} OFFSET {int(offset)}" if limit else ""
+    return f"SELECT {', '.join(cols)} FROM {FQN_MAIN}{_company_where(segmento)} ORDER BY NOME_EMPRESA, ID{page}"
+
+def _company_count_query(segmento: str | None) -> str:
+    return f"SELECT COUNT(*) AS N FROM {FQN_MAIN}{_company_where(segmento)}"
+
+# =========================
+# HELPERS (SNOWFLAKE)
+# =========================
+def _calc_status_vec(data_ass: pd.Series, inicio_renov: pd.Series, vigencia: pd.Series, today=None) -> np.ndarray:
+    """
+    Mesma regra de _calc_status_like_excel, para colunas inteiras (datetime64).
+    today: data de referência (padrão hoje); aceita uma Series para avaliar cada linha numa data.
+    """
+    today = pd.Timestamp(date.today()) if today is None else today
+    da, ir, vg = (_as_ts(x) for x in (data_ass, inicio_renov, vigencia))
+    conds = [
+        da.isna(),
+        ir.notna() & (ir > today),
+        ir.notna() & (ir < today) & vg.notna() & (vg > today),
+        vg.notna() & (vg < today),
+    ]
+    choices = ["EM NEGOCIAÇÃO", "EM VIGÊNCIA", "SOLICITAR RENOVAÇÃO", "ATRASADO"]
+    return np.select(conds, choices, default="-")
+
+def _map_unique(s: pd.Series, fn) -> pd.Series:
+    """Aplica fn uma vez por valor distinto (planilhas repetem muito os mesmos valores)."""
+    lut = {v: fn(v) for v in pd.unique(s)}
+    return s.map(lut)
+
+def _clean_text_col(s: pd.Series) -> pd.Series:
+    v = s.astype("string").str.strip()
+    blank = v.isna() | v.isin(["", "nan", "NaN", "NaT"])
+    return v.where(~blank, "-").astype(object)
+
+@_timed_fn("import.normalize")
+def _normalize_import_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Etapa única de normalização da planilha, coluna a coluna:
+    cabeçalhos, datas, STATUS, limpeza de texto, SEGMENTO canônico, ID e timestamps.
+    """
     # 1) headers da planilha -> nomes limpos (MAIÚSCULO)
-    rename_map = {c: ORIGINAL_TO_CANON.get(c, c) for c in df2.columns}
-    df2.rename(columns=rename_map, inplace=True)
+    df2 = df.rename(columns=lambda c: ORIGINAL_TO_CANON.get(str(c).strip(), str(c).strip()))
 
     # 2) garante todas as colunas esperadas
     for c in EXPECTED_COLS:
         if c not in df2.columns:
             df2[c] = None if c in DATE_COLS else "-"
 
-    # 3) datas -> datetime.date (None se inválido)
+    # 3) datas -> datetime.date (None se inválido); parse uma vez por valor distinto
+    parsed = {}
     for dc in DATE_COLS:
-        s = pd.to_datetime(df2[dc].apply(_fmt_date), format="%d/%m/%Y", errors="coerce")
-        df2[dc] = s.dt.date
-        df2.loc[s.isna(), dc] = None
+        df2[dc] = _parse_date_col(df2[dc])
+        parsed[dc] = pd.to_datetime(df2[dc])
 
     # 4) STATUS calculado
-    df2["STATUS"] = df2.apply(
-        lambda r: _calc_status_like_excel(r.get("DATA_ASSINATURA"), r.get("INICIO_RENOV"), r.get("VIGENCIA")),
-        axis=1
-    )
+    df2["STATUS"] = _calc_status_vec(parsed["DATA_ASSINATURA"], parsed["INICIO_RENOV"], parsed["VIGENCIA"])
 
-    # 5) SEGMENTO canônico
-    df2["SEGMENTO"] = df2["SEGMENTO"].apply(lambda v: segments_to_str(normalize_segments(v)))
-
-    # 6) limpar apenas NÃO-data
+    # 5) limpar apenas NÃO-data
     for c in [c for c in EXPECTED_COLS if c not in DATE_COLS]:
-        df2[c] = df2[c].apply(lambda v: "-" if (v is None or str(v).strip() in {"", "nan", "NaN", "NaT"}) else str(v).strip())
+        df2[c] = _clean_text_col(df2[c])
+
+    # 6) SEGMENTO canônico
+    df2["SEGMENTO"] = _map_unique(df2["SEGMENTO"], lambda v: segments_to_str(normalize_segments(v)))
 
-    # 7) ID e timestamps (se não vierem do Excel)
-    now_ts = pd.Timestamp.utcnow()
-    if "ID" not in df2.columns:
-        df2["ID"] = [uuid4().hex for _ in range(len(df2))]
-    df2["CREATED_AT"] = now_ts
-    df2["UPDATED_AT"] = now_ts
+    # 7) ID (se não vier do Excel ou vier vazio); timestamps ficam para o banco
+    no_id = df2["ID"].isna() if "ID" in df2.columns else pd.Series(True, index=df2.index)
+    df2.loc[no_id, "ID"] = [uuid4().hex for _ in range(int(no_id.sum()))]
 
     # 8) ordena colunas como na tabela
-    cols_order = ["ID", *EXPECTED_COLS, "CREATED_AT", "UPDATED_AT"]
-    df2 = df2.reindex(columns=cols_order)
+    return df2.reindex(columns=IMPORT_COLS)
+
+def import_to_sf_append(df: pd.DataFrame) -> dict:
+    """
+    Sempre adiciona (APPEND) as linhas da planilha em {FQN_MAIN}.
+    Não cria tabela, não trunca, não sobrescreve. Devolve contagens e os IDs gravados.
+    """
+    df2 = _normalize_import_df(df)
 
     # 9) APPEND (nada de TRUNCATE, nada de CSV_PARSER_FEATURES)
-    res = sf_session.write_pandas(
-        df2,
-        table_name=FQN_MAIN.split('.')[-1],
-        database=FQN_MAIN.split('.')[0],
-        schema=FQN_MAIN.split('.')[1],
-        overwrite=False,           # nunca sobrescreve
-        auto_create_table=False,   # tabela já existe
-        quote_identifiers=True
+    _store_insert(df2)
+    _invalidate_snapshot()
+    return {"rows": len(df2), "inserted": len(df2), "updated": 0, "unchanged": 0, "ids": df2["ID"].tolist()}
+
+# =========================
+# MOTOR DE STATUS (recalculo em lote + próxima mudança)
+# =========================
+# STATUS depende da data de hoje, então envelhece sozinho; STATUS_PROX_MUDANCA guarda o dia em que
+# ele vai mudar (NULL = só muda se as datas forem editadas). Uma thread por processo recalcula a
+# tabela inteira num único UPDATE uma vez por dia; edições e importações recalculam só as linhas tocadas.
+STATUS_CHECK_S = _app_cfg("status_check_s", 600)
+STATUS_IN_CHUNK = 1000   # IDs por UPDATE no recálculo restrito (edições, inclusões, importações)
+DERIVED_COLS = ["STATUS_PROX_MUDANCA"]
+READ_COLS = [*ALL_COLS, *DERIVED_COLS]
+_NO_DATE = "CAST('9999-12-31' AS DATE)"
+# datas em que a regra pode virar: o próprio dia ou o dia seguinte a INICIO_RENOV / VIGENCIA
+_STATUS_BREAKS = ["INICIO_RENOV", "INICIO_RENOV + 1", "VIGENCIA", "VIGENCIA + 1"]
+
+def _status_case_sql(d: str = "CURRENT_DATE") -> str:
+    """Regra de _calc_status_like_excel em SQL, avaliada na data `d` (Snowflake e DuckDB)."""
+    return (
+        "CASE WHEN DATA_ASSINATURA IS NULL THEN 'EM NEGOCIAÇÃO' "
+        f"WHEN INICIO_RENOV > {d} THEN 'EM VIGÊNCIA' "
+        f"WHEN INICIO_RENOV < {d} AND VIGENCIA > {d} THEN 'SOLICITAR RENOVAÇÃO' "
+        f"WHEN VIGENCIA < {d} THEN 'ATRASADO' "
+        "ELSE '-' END"
     )
-    return len(df2)
 
+def _next_change_sql() -> str:
+    """Menor data de virada futura em que o STATUS fica diferente do de hoje (NULL se nenhuma)."""
+    now = _status_case_sql()
+    cands = [
+        f"COALESCE(CASE WHEN {b} > CURRENT_DATE AND {_status_case_sql(b)} <> {now} THEN {b} END, {_NO_DATE})"
+        for b in _STATUS_BREAKS
+    ]
+    # LEAST do Snowflake devolve NULL se algum argumento for NULL: por isso o COALESCE/NULLIF
+    return f"NULLIF(LEAST({', '.join(cands)}), {_NO_DATE})"
+
+def _next_status_change_vec(data_ass: pd.Series, inicio_renov: pd.Series, vigencia: pd.Series,
+                            today=None) -> pd.Series:
+    """Mesma conta de _next_change_sql, em pandas (para atualizar o snapshot sem reler)."""
+    today = pd.Timestamp(date.today()) if today is None else today
+    da, ir, vg = (_as_ts(x) for x in (data_ass, inicio_renov, vigencia))
+    now = _calc_status_vec(da, ir, vg, today)
+    one = pd.Timedelta(days=1)
+    out = pd.Series(pd.NaT, index=da.index, dtype="datetime64[ns]")
+    for b in (ir, ir + one, vg, vg + one):
+        hit = b.notna() & (b > today) & (_calc_status_vec(da, ir, vg, b) != now)
+        out = out.where(~hit | (out.notna() & (out <= b)), b)
+    return out
 
-def _fetch_df(segmento: str | None = None) -> pd.DataFrame:
-    pdf = _sf(f'SELECT * FROM {FQN_MAIN}').to_pandas()
-    if pdf.empty:
-        return pdf
-    if "SEGMENTO" not in pdf.columns:
-        pdf["SEGMENTO"] = "-"
+@_timed_fn("status.refresh")
+def _refresh_statuses(ids=None):
+    """
+    Recalcula STATUS e STATUS_PROX_MUDANCA no banco num UPDATE só, gravando apenas linhas que
+    mudaram. ids: restringe aos registros informados (edição de datas, inclusão, importação).
+    UPDATED_AT fica como está: o status é derivado das datas e cada processo/réplica o recalcula,
+    então a virada de dia não pode mover a marca d'água do delta e do espelho.
+    """
+    case, nxt = _status_case_sql(), _next_change_sql()
+    base = (
+        f"UPDATE {FQN_MAIN} SET STATUS = {case}, STATUS_PROX_MUDANCA = {nxt} "
+        f"WHERE (STATUS IS DISTINCT FROM {case} OR STATUS_PROX_MUDANCA IS DISTINCT FROM {nxt})"
+    )
+    if ids is None:
+        _write(base)
+        _invalidate_snapshot()
+        return
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    for k in range(0, len(ids), STATUS_IN_CHUNK):
+        chunk = ids[k:k + STATUS_IN_CHUNK]
+        _write(f"{base} AND ID IN ({', '.join('?' for _ in chunk)})", chunk)
+    _restatus_snapshot(ids)
+
+def _restatus_snapshot(ids: list[str]):
+    """Aplica no snapshot o mesmo recálculo, a partir das datas que ele já tem."""
+    stt = _table_state()
+    with stt["lock"]:
+        pdf = stt["df"]
+    if pdf is None:
+        with stt["lock"]:
+            stt["views"].clear()
+            stt["version"] += 1
+        return
+    rows = pdf[pdf["ID"].isin(ids)]
+    status = _calc_status_vec(rows["DATA_ASSINATURA"], rows["INICIO_RENOV"], rows["VIGENCIA"])
+    nxt = _next_status_change_vec(rows["DATA_ASSINATURA"], rows["INICIO_RENOV"], rows["VIGENCIA"])
+    _patch_snapshot_many({
+        rec_id: {"STATUS": s, "STATUS_PROX_MUDANCA": None if pd.isna(n) else n.date()}
+        for rec_id, s, n in zip(rows["ID"], status, nxt)
+    })
+
+@st.cache_resource
+def _ensure_status_cols() -> bool:
+    # migração: leituras usam READ_COLS, então roda na inicialização (main, logo após o login)
+    # antes da 1ª consulta, e nunca no caminho de leitura
+    for c in DERIVED_COLS:
+        _write(f"ALTER TABLE {FQN_MAIN} ADD COLUMN IF NOT EXISTS {c} DATE")
+    return True
+
+@st.cache_resource
+def _status_worker() -> dict:
+    """Recalcula os status uma vez por dia (thread única por processo)."""
+    state = {"ran_on": None}
+
+    def _loop():
+        while True:
+            if state["ran_on"] != date.today():
+                try:
+                    _refresh_statuses()
+                    state["ran_on"] = date.today()
+                except Exception:
+                    _log.exception("falha ao recalcular os status")
+            time.sleep(STATUS_CHECK_S)
 
-    pdf["_segments"] = pdf["SEGMENTO"].apply(normalize_segments)
-    if segmento and segmento != "Todos":
-        pdf = pdf[pdf["_segments"].apply(lambda lst: segmento in lst)]
-    if "NOME_EMPRESA" in pdf.columns:
-        pdf = pdf.sort_values("NOME_EMPRESA", kind="stable")
-    return pdf.drop(columns=["_segments"], errors="ignore")
+    threading.Thread(target=_loop, name="status-diario", daemon=True).start()
+    return state
+
+# =========================
+# IMPORTAÇÃO IDEMPOTENTE (MERGE por CNPJ / ID / nome)
+# =========================
+# "merge": atualiza quem já existe (CNPJ normalizado, ID ou nome normalizado) e insere o resto
+# "append": sempre adiciona, como antes
+IMPORT_WRITE = _app_cfg("import_write", "merge")
+_CNPJ_PUNCT = "./- "
+_ACCENT_TRANS = str.maketrans(_SQL_ACCENTS_FROM, _SQL_ACCENTS_TO)
+
+def _match_keys(df: pd.DataFrame) -> pd.Series:
+    """Chave de casamento: 'cnpj:<14 dígitos>' ou, sem CNPJ válido, 'nome:<nome sem acento>'."""
+    cnpj = df["CNPJ"].astype("string").str.translate(str.maketrans("", "", _CNPJ_PUNCT))
+    name = df["NOME_EMPRESA"].astype("string").str.strip().str.lower().str.translate(_ACCENT_TRANS)
+    key = pd.Series(None, index=df.index, dtype=object)
+    has_name = (name.notna() & ~name.isin(["", "-"])).fillna(False).astype(bool)
+    key[has_name] = "nome:" + name[has_name]
+    valid = cnpj.str.fullmatch(r"\d{14}").fillna(False).astype(bool)
+    key[valid] = "cnpj:" + cnpj[valid]
+    return key
+
+def _match_key_sql(alias: str) -> str:
+    """Mesma chave de _match_keys, calculada sobre a tabela (Snowflake e DuckDB)."""
+    cnpj = f"TRANSLATE(COALESCE({alias}.CNPJ, ''), '{_CNPJ_PUNCT}', '')"
+    name = f"TRIM(COALESCE({alias}.NOME_EMPRESA, ''))"
+    # só dígitos: TRANSLATE sem alfabeto de destino apaga os caracteres listados
+    return (
+        f"CASE WHEN LENGTH({cnpj}) = 14 AND TRANSLATE({cnpj}, '0123456789', '') = '' THEN 'cnpj:' || {cnpj} "
+        f"WHEN {name} NOT IN ('', '-') THEN 'nome:' || TRANSLATE(LOWER({name}), '{_SQL_ACCENTS_FROM}', '{_SQL_ACCENTS_TO}') "
+        f"END"
+    )
 
-def _update_record(rec_id: str, updates: dict):
+def _merge_update_cols(raw_cols) -> list[str]:
+    """Só sobrescreve colunas que vieram na planilha; STATUS só se as três datas vieram."""
+    present = {ORIGINAL_TO_CANON.get(str(c).strip(), str(c).strip()) for c in raw_cols}
+    cols = [c for c in EXPECTED_COLS if c in present and c != "STATUS"]
+    if set(DATE_COLS) <= present:
+        cols.append("STATUS")
+    return cols
+
+def _resolve_sql(stage: str) -> str:
     """
-    updates: dicionário com chaves dos nomes limpos em MAIÚSCULO.
+    Lote com o ID de destino já resolvido: o próprio ID se existe na tabela, senão o do registro
+    com a mesma chave (CNPJ/nome; havendo vários, o menor ID), senão o ID novo do lote.
+    Só junções por igualdade (hash join); a chave da tabela é calculada uma vez por lote.
+    Linhas que caem no mesmo ID: fica a última da planilha (SEQ).
     """
-    if not rec_id:
-        raise ValueError("ID obrigatório.")
-    if not updates:
+    return f"""
+        SELECT * FROM (
+            SELECT s.* REPLACE (COALESCE(t.ID, k.KEY_ID, s.ID) AS ID)
+            FROM {stage} s
+            LEFT JOIN {FQN_MAIN} t ON t.ID = s.ID
+            LEFT JOIN (
+                SELECT MATCH_KEY, MIN(ID) AS KEY_ID
+                FROM (SELECT ID, {_match_key_sql('t')} AS MATCH_KEY FROM {FQN_MAIN} t) x
+                WHERE MATCH_KEY IN (SELECT MATCH_KEY FROM {stage})
+                GROUP BY MATCH_KEY
+            ) k ON k.MATCH_KEY = s.MATCH_KEY
+        ) r
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY r.ID ORDER BY r.SEQ DESC) = 1
+    """
+
+def _merge_sql(update_cols: list[str]) -> tuple[str, str, str]:
+    """(condição de casamento, condição de mudança, SET) entre a tabela t e o lote resolvido s."""
+    on = "t.ID = s.ID"
+    changed = " OR ".join(f"t.{c} IS DISTINCT FROM s.{c}" for c in update_cols) or "FALSE"
+    set_clause = ", ".join([*(f"{c} = s.{c}" for c in update_cols), "UPDATED_AT = CURRENT_TIMESTAMP"])
+    return on, changed, set_clause
+
+_INSERT_IMPORT_COLS = f"{', '.join(IMPORT_COLS)}, CREATED_AT, UPDATED_AT"
+
+def _insert_import_values(alias: str) -> str:
+    return f"{', '.join(f'{alias}.{c}' for c in IMPORT_COLS)}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP"
+
+@contextmanager
+def _sf_stage(sess: Session, df2: pd.DataFrame, extra: dict[str, str] | None = None):
+    """Tabela temporária com o lote (mesmas colunas da principal + extra); só existe nesta sessão."""
+    db, schema, table = FQN_MAIN.split(".")
+    stage = f"{table}_STG_{uuid4().hex[:8].upper()}"
+    fqn_stage = f"{db}.{schema}.{stage}"
+    sess.sql(f"CREATE TEMPORARY TABLE {fqn_stage} LIKE {FQN_MAIN}").collect()
+    try:
+        for col, typ in (extra or {}).items():
+            sess.sql(f"ALTER TABLE {fqn_stage} ADD COLUMN {col} {typ}").collect()
+        sess.write_pandas(df2, table_name=stage, database=db, schema=schema,
+                          overwrite=False, auto_create_table=False, quote_identifiers=True)
+        yield fqn_stage
+    finally:
+        sess.sql(f"DROP TABLE IF EXISTS {fqn_stage}").collect()
+
+def _insert_snowflake(df2: pd.DataFrame):
+    with _sf_session() as sess, _sf_stage(sess, df2) as fqn_stage:
+        sess.sql(f"INSERT INTO {FQN_MAIN} ({_INSERT_IMPORT_COLS}) "
+                 f"SELECT {_insert_import_values('s')} FROM {fqn_stage} s").collect()
+
+def _merge_snowflake(df2: pd.DataFrame, update_cols: list[str]) -> tuple[int, int, list[str]]:
+    # tabela temporária só existe na sessão que a criou: todo o MERGE usa a mesma sessão do pool
+    with _sf_session() as sess:
+        return _merge_snowflake_in(sess, df2, update_cols)
+
+def _merge_snowflake_in(sess: Session, df2: pd.DataFrame, update_cols: list[str]) -> tuple[int, int, list[str]]:
+    with _sf_stage(sess, df2, _MERGE_STAGE_COLS) as fqn_stage:
+        resolved = f"{fqn_stage}_R"
+        sess.sql(f"CREATE TEMPORARY TABLE {resolved} AS {_resolve_sql(fqn_stage)}").collect()
+        try:
+            ids = [r[0] for r in sess.sql(f"SELECT ID FROM {resolved}").collect()]
+            on, changed, set_clause = _merge_sql(update_cols)
+            res = sess.sql(f"""
+                MERGE INTO {FQN_MAIN} t USING {resolved} s
+                ON {on}
+                WHEN MATCHED AND ({changed}) THEN UPDATE SET {set_clause}
+                WHEN NOT MATCHED THEN INSERT ({_INSERT_IMPORT_COLS}) VALUES ({_insert_import_values('s')})
+            """).collect()
+            return int(res[0][0]), int(res[0][1]), ids
+        finally:
+            sess.sql(f"DROP TABLE IF EXISTS {resolved}").collect()
+
+# colunas do lote que não existem na tabela: chave de casamento e posição na planilha
+_MERGE_STAGE_COLS = {"MATCH_KEY": "VARCHAR", "SEQ": "INTEGER"}
+
+def _insert_duck(df2: pd.DataFrame):
+    cur = _duck()["con"].cursor()
+    try:
+        cur.register("_stage", df2)
+        cur.execute(f"INSERT INTO {LOCAL_MAIN} ({_INSERT_IMPORT_COLS}) SELECT {_insert_import_values('s')} FROM _stage s")
+    finally:
+        cur.close()
+
+def _merge_duck(df2: pd.DataFrame, update_cols: list[str]) -> tuple[int, int, list[str]]:
+    # DuckDB 1.3 não tem MERGE: UPDATE ... FROM + INSERT ... WHERE NOT EXISTS na mesma transação
+    on, changed, set_clause = _merge_sql(update_cols)
+    cur = _duck()["con"].cursor()
+    try:
+        cur.register("_stage", df2)
+        cur.execute("BEGIN TRANSACTION")
+        cur.execute(f"CREATE OR REPLACE TEMP TABLE _resolved AS {_local_sql(_resolve_sql('_stage'))}")
+        ids = [r[0] for r in cur.execute("SELECT ID FROM _resolved").fetchall()]
+        updated = cur.execute(f"""
+            UPDATE {LOCAL_MAIN} AS t SET {set_clause}
+            FROM _resolved s WHERE {on} AND ({changed})
+        """).fetchone()[0]
+        inserted = cur.execute(f"""
+            INSERT INTO {LOCAL_MAIN} ({_INSERT_IMPORT_COLS})
+            SELECT {_insert_import_values('s')} FROM _resolved s
+            WHERE NOT EXISTS (SELECT 1 FROM {LOCAL_MAIN} t WHERE {on})
+        """).fetchone()[0]
+        cur.execute("DROP TABLE _resolved")
+        cur.execute("COMMIT")
+        return int(inserted), int(updated), ids
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    finally:
+        cur.close()
+
+def import_to_sf_merge(df: pd.DataFrame) -> dict:
+    """
+    Upsert da planilha em {FQN_MAIN}: cada linha tem o ID de destino resolvido (ID, CNPJ
+    normalizado ou nome normalizado) e um MERGE por lote casa só por ID. Devolve contagens
+    inseridas/atualizadas/inalteradas e os IDs de destino.
+    """
+    df2 = _normalize_import_df(df)
+    df2["MATCH_KEY"] = _match_keys(df2)
+    df2["SEQ"] = np.arange(len(df2))
+    # chaves repetidas no mesmo lote: fica a última ocorrência (MERGE exige origem única)
+    keyed = df2["MATCH_KEY"].notna()
+    df2 = pd.concat([df2[keyed].drop_duplicates("MATCH_KEY", keep="last"), df2[~keyed]])
+    df2 = df2.drop_duplicates("ID", keep="last")  # duas linhas mescladas no mesmo registro
+    update_cols = _merge_update_cols(df.columns)
+
+    inserted, updated, ids = _store_merge(df2, update_cols)
+    _invalidate_snapshot()
+    return {"rows": len(df), "inserted": inserted, "updated": updated,
+            "unchanged": max(len(df) - inserted - updated, 0), "ids": ids}
+
+def _import_chunk(df: pd.DataFrame, merge_into: pd.Series | None = None) -> dict:
+    """merge_into: ID existente por linha (escolhido no relatório de duplicatas) ou NaN."""
+    with _timed("import.write", rows=len(df), mode=IMPORT_WRITE):
+        return _import_chunk_raw(df, merge_into)
+
+def _import_chunk_raw(df: pd.DataFrame, merge_into: pd.Series | None) -> dict:
+    if merge_into is not None and merge_into.notna().any():
+        # linhas mescladas sempre viram upsert no registro escolhido, qualquer que seja IMPORT_WRITE
+        hit = merge_into.notna()
+        res = import_to_sf_merge(df[hit].assign(ID=merge_into[hit]))
+        if (~hit).any():
+            rest = _import_chunk_raw(df[~hit], None)
+            res = {k: res[k] + rest[k] for k in res}
+        return res
+    if IMPORT_WRITE == "append":
+        return import_to_sf_append(df)
+    return import_to_sf_merge(df)
+
+# =========================
+# DUPLICATAS (CNPJ validado + nome canônico + MinHash)
+# =========================
+# antes de gravar, cada linha da planilha é comparada com a tabela: CNPJ igual (dígitos
+# verificadores conferidos), mesmo nome canônico (sem acento, pontuação e sufixo societário)
+# ou nome parecido. Os candidatos vêm de chaves de bloqueio (CNPJ, raiz do CNPJ, nome canônico
+# e faixas LSH do MinHash de trigramas), então o custo é quase linear; só os pares candidatos
+# têm o Jaccard calculado.
+DEDUP_THRESHOLD = _app_cfg("dedup_threshold", 0.8)
+DEDUP_PERMS, DEDUP_BANDS = 32, 8   # 8 faixas de 4: par com Jaccard 0,8 vira candidato em ~98% dos casos
+_NAME_NOISE = {
+    "ltda", "limitada", "sa", "me", "epp", "eireli", "mei", "ss", "cia", "companhia",
+    "e", "de", "da", "do", "das", "dos",
+}
+_MINHASH_PRIME = (1 << 31) - 1     # a*h+b cabe em uint64 (h é crc32)
+_MINHASH_A = np.random.default_rng(7).integers(1, _MINHASH_PRIME, DEDUP_PERMS).astype(np.uint64)
+_MINHASH_B = np.random.default_rng(11).integers(0, _MINHASH_PRIME, DEDUP_PERMS).astype(np.uint64)
+
+def _cnpj_canon(v) -> str | None:
+    """14 dígitos (zeros à esquerda repostos, o Excel costuma perdê-los) se os verificadores conferem."""
+    d = re.sub(r"\D", "", _s(_cell_str(v)))
+    if not 12 <= len(d) <= 14:
+        return None
+    d = d.zfill(14)
+    if len(set(d)) == 1:
+        return None
+    nums = [int(c) for c in d]
+    for n in (12, 13):
+        r = sum(x * ((n - 1 - i) % 8 + 2) for i, x in enumerate(nums[:n])) % 11
+        if nums[n] != (0 if r < 2 else 11 - r):
+            return None
+    return d
+
+def _canon_name(v) -> str:
+    """'Empresa X Ltda.' e 'EMPRESA X LTDA' -> 'empresa x'."""
+    s = _s(v)
+    if s == "-":
+        return ""
+    s = _deaccent_lower(s).replace(".", "").replace("/", "")
+    return " ".join(t for t in _TOKEN_RE.findall(s) if t not in _NAME_NOISE)
+
+def _name_grams(name: str) -> frozenset:
+    padded = f" {name} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+DEDUP_SIG_BLOCK = 4000   # nomes por passada do MinHash (matriz PERMS x trigramas do bloco)
+
+def _minhash_bands(gram_sets: list[frozenset]) -> list[list[bytes]]:
+    """Faixas LSH de vários conjuntos (não vazios) de uma vez: um min por conjunto via reduceat."""
+    out = []
+    for k in range(0, len(gram_sets), DEDUP_SIG_BLOCK):
+        block = gram_sets[k:k + DEDUP_SIG_BLOCK]
+        sizes = np.fromiter(map(len, block), dtype=np.int64, count=len(block))
+        h = np.fromiter((zlib.crc32(g.encode()) for gs in block for g in gs), dtype=np.uint64, count=int(sizes.sum()))
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        sig = np.minimum.reduceat((_MINHASH_A[:, None] * h[None, :] + _MINHASH_B[:, None]) % _MINHASH_PRIME,
+                                  starts, axis=1)
+        out.extend([band.tobytes() for band in row] for row in sig.T.reshape(len(block), DEDUP_BANDS, -1))
+    return out
+
+def _dedup_keys(names, cnpjs) -> list[dict]:
+    """Forma canônica + chaves de bloqueio de cada linha (valores repetidos calculados uma vez)."""
+    names, cnpjs = list(names), list(cnpjs)
+    canons = [_canon_name(n) for n in names]
+    distinct = [c for c in dict.fromkeys(canons) if c]
+    grams = {c: _name_grams(c) for c in distinct}
+    bands = dict(zip(distinct, _minhash_bands([grams[c] for c in distinct])))
+    cnpj_memo: dict = {}
+    out = []
+    for name, canon, cnpj in zip(names, canons, cnpjs):
+        keys = [("nome", canon), *(("lsh", b, k) for b, k in enumerate(bands[canon]))] if canon else []
+        if cnpj not in cnpj_memo:
+            cnpj_memo[cnpj] = _cnpj_canon(cnpj)
+        cnpj = cnpj_memo[cnpj]
+        if cnpj:
+            keys += [("cnpj", cnpj), ("raiz", cnpj[:8])]
+        out.append({"name": name, "canon": canon, "cnpj": cnpj, "grams": grams.get(canon, frozenset()), "keys": keys})
+    return out
+
+def _dedup_score(a: dict, b: dict) -> tuple[float, str] | None:
+    if a["cnpj"] and a["cnpj"] == b["cnpj"]:
+        return 1.0, "CNPJ igual"
+    sim = len(a["grams"] & b["grams"]) / len(a["grams"] | b["grams"]) if a["grams"] and b["grams"] else 0.0
+    if a["cnpj"] and b["cnpj"]:
+        # CNPJs válidos e diferentes: outra empresa, salvo filial (mesma raiz) com nome parecido
+        if a["cnpj"][:8] == b["cnpj"][:8] and sim >= DEDUP_THRESHOLD:
+            return sim, "mesma raiz de CNPJ (filial?)"
+        return None
+    if a["canon"] and a["canon"] == b["canon"]:
+        return 1.0, "nome igual"
+    if sim >= DEDUP_THRESHOLD:
+        return sim, "nome parecido"
+    return None
+
+def _dedup_matches(incoming: pd.DataFrame, existing: pd.DataFrame) -> pd.DataFrame:
+    """
+    Melhor registro existente para cada linha da planilha que tenha algum.
+    incoming: NOME_EMPRESA, CNPJ (índice = posição na planilha); existing: ID, NOME_EMPRESA, CNPJ.
+    """
+    ex = _dedup_keys(existing["NOME_EMPRESA"], existing["CNPJ"])
+    blocks: dict[tuple, list[int]] = {}
+    for j, rec in enumerate(ex):
+        for k in rec["keys"]:
+            blocks.setdefault(k, []).append(j)
+    ex_ids = existing["ID"].tolist()
+    rows = []
+    for pos, rec in zip(incoming.index, _dedup_keys(incoming["NOME_EMPRESA"], incoming["CNPJ"])):
+        best = None
+        for j in {j for k in rec["keys"] for j in blocks.get(k, ())}:
+            hit = _dedup_score(rec, ex[j])
+            if hit is not None and (best is None or hit[0] > best[0]):
+                best = (*hit, j)
+        if best is not None:
+            sim, motivo, j = best
+            rows.append({
+                "POS": pos, "NOME": _s(rec["name"]), "CNPJ": _s(incoming.at[pos, "CNPJ"]),
+                "ID_EXISTENTE": ex_ids[j], "NOME_EXISTENTE": _s(ex[j]["name"]),
+                "CNPJ_EXISTENTE": _s(existing["CNPJ"].iat[j]), "MOTIVO": motivo, "SIMILARIDADE": round(sim, 2),
+                "MESCLAR": motivo in ("CNPJ igual", "nome igual"),
+            })
+    return pd.DataFrame(rows, columns=["POS", "NOME", "CNPJ", "ID_EXISTENTE", "NOME_EXISTENTE",
+                                       "CNPJ_EXISTENTE", "MOTIVO", "SIMILARIDADE", "MESCLAR"])
+
+@_timed_fn("import.dedup")
+def dedup_report(fileobj, sheet: str) -> tuple[pd.DataFrame, dict]:
+    """
+    Relatório de possíveis duplicatas da planilha contra a tabela, antes de importar.
+    Lê só nome e CNPJ (planilha e tabela em lotes). Devolve (correspondências, resumo).
+    """
+    parts = []
+    for chunk, _ in _timed_iter("import.read", _iter_xlsx_chunks(fileobj, sheet, IMPORT_CHUNK_ROWS)):
+        chunk = chunk.rename(columns=lambda c: ORIGINAL_TO_CANON.get(str(c).strip(), str(c).strip()))
+        parts.append(chunk.reindex(columns=["NOME_EMPRESA", "CNPJ"]))
+    incoming = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["NOME_EMPRESA", "CNPJ"])
+    batches = list(_read_batches(f"SELECT ID, NOME_EMPRESA, CNPJ FROM {FQN_MAIN}"))
+    existing = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=["ID", "NOME_EMPRESA", "CNPJ"])
+    report = _dedup_matches(incoming, existing)
+    typed = incoming["CNPJ"].map(_s) != "-"
+    stats = {
+        "rows": len(incoming),
+        "matches": len(report),
+        "cnpj_invalid": int((typed & incoming["CNPJ"].map(_cnpj_canon).isna()).sum()),
+    }
+    return report, stats
+
+# =========================
+# LEDGER DE IMPORTAÇÕES (arquivos e linhas já importados, entre sessões)
+# =========================
+LEDGER_IN_CHUNK = 1000
+
+# o ledger vale só na fonte (não vai para a réplica): a consulta "já importado?" tem de ver
+# o que outras instâncias gravaram
+@st.cache_resource
+def _ensure_ledger() -> bool:
+    # migração: roda na inicialização (main, logo após o login)
+    _source_store().execute(f"""CREATE TABLE IF NOT EXISTS {FQN_IMPORTS} (
+        FILE_HASH VARCHAR, FILE_NAME VARCHAR, SHEET VARCHAR, ROW_COUNT INTEGER, ROWS_SENT INTEGER,
+        INSERTED INTEGER, UPDATED INTEGER, UNCHANGED INTEGER, USERNAME VARCHAR, DURATION_S DOUBLE,
+        CREATED_AT TIMESTAMP)""")
+    _source_store().execute(f"""CREATE TABLE IF NOT EXISTS {FQN_IMPORT_ROWS} (
+        ROW_HASH VARCHAR, FILE_HASH VARCHAR, CREATED_AT TIMESTAMP)""")
+    return True
+
+def _ledger_file(digest: str) -> dict | None:
+    """
+    Importação anterior do mesmo arquivo (qualquer sessão/usuário), se houver. Fica na sessão
+    por hash: o arquivo parado no uploader não consulta o banco a cada execução da página.
+    """
+    seen = st.session_state.setdefault("ledger_files", {})
+    if digest not in seen:
+        pdf = _source_store().query(
+            f"SELECT FILE_NAME, USERNAME, CREATED_AT, ROW_COUNT FROM {FQN_IMPORTS} "
+            "WHERE FILE_HASH = ? ORDER BY CREATED_AT DESC LIMIT 1",
+            [digest],
+        )
+        seen[digest] = None if pdf.empty else pdf.iloc[0].to_dict()
+    return seen[digest]
+
+def _row_hashes(chunk: pd.DataFrame) -> pd.Series:
+    """SHA-256 do conteúdo bruto de cada linha (coluna=valor, colunas em ordem fixa)."""
+    cols = sorted(chunk.columns)
+    text = chunk[cols].astype(object).where(chunk[cols].notna(), "")
+    joined = [
+        "\x1f".join(f"{c}={v}" for c, v in zip(cols, row))
+        for row in text.itertuples(index=False, name=None)
+    ]
+    return pd.Series([hashlib.sha256(j.encode("utf-8")).hexdigest() for j in joined], index=chunk.index)
+
+@_timed_fn("import.ledger")
+def _known_row_hashes(hashes) -> set[str]:
+    hashes = list(dict.fromkeys(hashes))
+    known = set()
+    for k in range(0, len(hashes), LEDGER_IN_CHUNK):
+        chunk = hashes[k:k + LEDGER_IN_CHUNK]
+        pdf = _source_store().query(
+            f"SELECT ROW_HASH FROM {FQN_IMPORT_ROWS} WHERE ROW_HASH IN ({', '.join('?' for _ in chunk)})", chunk)
+        known.update(pdf["ROW_HASH"])
+    return known
+
+@_timed_fn("import.ledger")
+def _ledger_add_rows(hashes, digest: str):
+    if len(hashes) == 0:
         return
+    _write_df(pd.DataFrame({"ROW_HASH": list(hashes), "FILE_HASH": digest, "CREATED_AT": _utc_now()}),
+              FQN_IMPORT_ROWS, mirror=False)
+
+def _ledger_add_file(digest: str, file_name: str, sheet: str, res: dict, username: str, duration_s: float):
+    _source_store().execute(
+        f"INSERT INTO {FQN_IMPORTS} (FILE_HASH, FILE_NAME, SHEET, ROW_COUNT, ROWS_SENT, INSERTED, UPDATED, "
+        "UNCHANGED, USERNAME, DURATION_S, CREATED_AT) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+        # ROW_COUNT é o arquivo inteiro: numa retomada, soma as linhas gravadas antes da falha
+        [digest, str(file_name), str(sheet), int(res["rows"] + res.get("resumed", 0)), int(res["sent"]), int(res["inserted"]),
+         int(res["updated"]), int(res["unchanged"]), str(username), float(duration_s)],
+    )
+    st.session_state.setdefault("ledger_files", {}).pop(digest, None)
 
-    # filtra apenas colunas válidas
-    updates = {k: v for k, v in updates.items() if k in EXPECTED_COLS or k in {"CREATED_AT","UPDATED_AT"}}
-    updates["UPDATED_AT"] = pd.Timestamp.utcnow()
+# =========================
+# IMPORTAÇÃO EM LOTES (openpyxl read-only, memória constante)
+# =========================
+IMPORT_CHUNK_ROWS = _app_cfg("import_chunk_rows", 5000)
+HASH_BLOCK_BYTES = 1 << 20
+
+def _hash_upload(fileobj) -> str:
+    """SHA-256 lendo o arquivo em blocos, sem getvalue()."""
+    h = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(HASH_BLOCK_BYTES), b""):
+        h.update(block)
+    fileobj.seek(0)
+    return h.hexdigest()
+
+@st.cache_resource
+def _import_checkpoints() -> dict:
+    """hash do arquivo -> linhas já gravadas; permite retomar uma importação interrompida."""
+    return {}
+
+def _xlsx_sheet_names(fileobj) -> list[str]:
+    fileobj.seek(0)
+    wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+def _cell_str(v):
+    # mesmo texto que o read_excel(dtype=str) produziria
+    if v is None:
+        return None
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+def _iter_xlsx_chunks(fileobj, sheet: str, chunk_rows: int):
+    """
+    Gera (DataFrame, total_estimado) com até chunk_rows linhas, tudo como texto
+    (equivalente ao read_excel(dtype=str)). Linhas totalmente vazias são ignoradas.
+    """
+    fileobj.seek(0)
+    wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet]
+        total = max((ws.max_row or 1) - 1, 0)
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h).strip() if h is not None else f"COL_{i}" for i, h in enumerate(header)]
+        width = len(header)
+        buf = []
+        for r in rows:
+            if all(v is None for v in r):
+                continue
+            vals = [_cell_str(v) for v in r[:width]]
+            buf.append(vals + [None] * (width - len(vals)))
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=header), total
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=header), total
+    finally:
+        wb.close()
+
+def import_xlsx_streaming(fileobj, sheet: str, digest: str, on_progress=None,
+                          merge_into: dict[int, str] | None = None) -> dict:
+    """
+    Lê a aba em lotes e grava cada lote (normalizado) assim que fica pronto.
+    Linhas cujo hash de conteúdo já está no ledger não são reenviadas.
+    O ponto de retomada é atualizado após cada lote gravado; reenviar o mesmo arquivo
+    depois de uma falha pula as linhas que já foram gravadas.
+    merge_into: posição da linha na planilha -> ID existente (mesclas do relatório de duplicatas).
+    Devolve contagens desta execução; "resumed" = linhas já gravadas antes da retomada.
+    """
+    ckpt = _import_checkpoints()
+    skip = ckpt.get(digest, 0)
+    seen = 0
+    totals = {"rows": 0, "sent": 0, "inserted": 0, "updated": 0, "unchanged": 0, "resumed": skip}
+    for chunk, total in _timed_iter("import.read", _iter_xlsx_chunks(fileobj, sheet, IMPORT_CHUNK_ROWS)):
+        start = seen
+        seen += len(chunk)
+        if seen <= skip:
+            continue
+        if start < skip:
+            chunk = chunk.iloc[skip - start:]
+        # só envia linhas cujo conteúdo ainda não passou por nenhuma importação
+        hashes = _row_hashes(chunk)
+        fresh = ~hashes.isin(_known_row_hashes(hashes))
+        totals["rows"] += len(chunk)
+        totals["unchanged"] += int((~fresh).sum())
+        if fresh.any():
+            pos = pd.Series(np.arange(seen - len(chunk), seen), index=chunk.index)
+            res = _import_chunk(chunk[fresh], pos[fresh].map(merge_into) if merge_into else None)
+            totals["sent"] += int(fresh.sum())
+            for k in ("inserted", "updated", "unchanged"):
+                totals[k] += res[k]
+            # STATUS só das linhas que este lote gravou (o recálculo da tabela inteira é diário)
+            _refresh_statuses(res["ids"])
+            _ledger_add_rows(hashes[fresh].drop_duplicates(), digest)
+        ckpt[digest] = seen
+        if on_progress:
+            on_progress(seen, max(total, seen))
+    ckpt.pop(digest, None)
+    if totals["sent"]:
+        _search_invalidate()
+    return totals
+
+
+@_timed_fn("fetch.df")
+def _fetch_df(segmento: str | None = None, cols: list[str] | None = None) -> pd.DataFrame:
+    cols = cols or READ_COLS
+    if SYNC_MODE == "query":
+        return _query_view(_company_query(segmento, cols))
+
+    pdf = _main_snapshot()
+    if not pdf.empty and segmento and segmento != "Todos":
+        pdf = pdf[(pdf["_seg_mask"] & SEG_BITS[segmento]) != 0]
+    return pdf[[c for c in cols if c in pdf.columns]]
+
+@_timed_fn("fetch.page")
+def _fetch_page(segmento: str | None, cols: list[str], page: int, page_size: int) -> tuple[pd.DataFrame, int]:
+    """Só a página pedida da lista (ordem NOME_EMPRESA, ID) e o total do filtro."""
+    if SYNC_MODE == "query":
+        total = int(_query_view(_company_count_query(segmento))["N"].iloc[0])
+        return _query_view(_company_query(segmento, cols, limit=page_size, offset=page * page_size)), total
+    pdf = _fetch_df(segmento, cols)
+    return pdf.iloc[page * page_size:(page + 1) * page_size], len(pdf)
+
+@_timed_fn("fetch.record")
+def _fetch_record(rec_id: str) -> dict | None:
+    """Registro completo (todas as colunas) de uma empresa."""
+    if SYNC_MODE == "query":
+        pdf = _query_view(f"SELECT {', '.join(READ_COLS)} FROM {FQN_MAIN} WHERE ID = '{_sf_escape(rec_id)}'")
+    else:
+        pdf = _main_snapshot()
+        pdf = pdf[pdf["ID"] == rec_id].drop(columns=["_seg_mask"], errors="ignore")
+    return None if pdf.empty else pdf.iloc[0].to_dict()
 
-    set_parts = []
+def _date_param(v):
+    """Texto da UI (DD/MM/AAAA) ou date -> datetime.date para bind; None se vazio/inválido."""
+    return _parse_date(v)
+
+def _changed_fields(original: dict, updates: dict) -> dict:
+    """Só o que difere do registro aberto no modal (datas comparadas como data)."""
+    out = {}
     for k, v in updates.items():
         if k in DATE_COLS:
-            if v in (None, "-", "", "nan", "NaN", "NaT"):
-                set_parts.append(f'{k} = NULL')
-            else:
-                try:
-                    d = pd.to_datetime(str(v), dayfirst=True, errors="coerce")
-                    set_parts.append(f"{k} = TO_DATE('{d.strftime('%Y-%m-%d')}')" if pd.notna(d) else f"{k} = NULL")
-                except Exception:
-                    set_parts.append(f'{k} = NULL')
-        elif k in {"CREATED_AT", "UPDATED_AT"}:
-            set_parts.append(f'{k} = CURRENT_TIMESTAMP()')
-        else:
-            set_parts.append(f"{k} = '{_sf_escape(v)}'")
+            if _date_param(v) != _date_param(original.get(k)):
+                out[k] = v
+        elif _s(v) != _s(original.get(k)):
+            out[k] = v
+    return out
 
-    set_clause = ", ".join(set_parts)
-    _sf(f"""UPDATE {FQN_MAIN}
-            SET {set_clause}
-            WHERE ID = '{_sf_escape(rec_id)}'""").collect()
+@_timed_fn("write.update")
+def _update_record(rec_id: str, updates: dict, original: dict | None = None) -> dict:
+    """
+    updates: dicionário com chaves dos nomes limpos em MAIÚSCULO.
+    original: registro como foi lido; se vier, só as colunas alteradas são gravadas.
+    Devolve as colunas efetivamente gravadas.
+    """
+    if not rec_id:
+        raise ValueError("ID obrigatório.")
 
+    # filtra apenas colunas válidas
+    updates = {k: v for k, v in updates.items() if k in EXPECTED_COLS}
+    if original is not None:
+        updates = _changed_fields(original, updates)
+    if not updates:
+        return {}
+
+    # texto fixo por conjunto de colunas; valores sempre via bind
+    cols = list(updates)
+    set_clause = ", ".join([*(f"{k} = ?" for k in cols), "UPDATED_AT = CURRENT_TIMESTAMP"])
+    params = [_date_param(updates[k]) if k in DATE_COLS else str(updates[k]) for k in cols]
+    _write(f"UPDATE {FQN_MAIN} SET {set_clause} WHERE ID = ?", [*params, rec_id])
+    _patch_snapshot(rec_id, {**updates, "UPDATED_AT": None})
+    _search_record(rec_id, updates)
+    if set(updates) & set(DATE_COLS):
+        _refresh_statuses([rec_id])
+    return updates
+
+@_timed_fn("write.comment")
 def _insert_comment(empresa_id: str, username: str, name: str, message: str):
     if not str(message).strip():
         return
-    _sf(f"""
-        INSERT INTO {FQN_COMMENTS}
-        ("ID","EMPRESA_ID","USERNAME","NAME","MESSAGE","CREATED_AT")
-        VALUES (
-          '{uuid4().hex}',
-          '{_sf_escape(empresa_id)}',
-          '{_sf_escape(username)}',
-          '{_sf_escape(name)}',
-          '{_sf_escape(message.strip())}',
-          CURRENT_TIMESTAMP()
-        )
-    """).collect()
+    comment_id = uuid4().hex
+    _write(
+        f'INSERT INTO {FQN_COMMENTS} ("ID","EMPRESA_ID","USERNAME","NAME","MESSAGE","CREATED_AT") '
+        'VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)',
+        [comment_id, str(empresa_id), str(username), str(name), message.strip()],
+    )
+    _drop_comments([empresa_id])
+    _search_comment(empresa_id, comment_id, message.strip())
+
+COMMENTS_IN_CHUNK = 1000
+
+def _drop_comments(empresa_ids):
+    """Tira as empresas do cache de comentários e invalida leituras em andamento."""
+    stt = _table_state()
+    with stt["lock"]:
+        for eid in empresa_ids:
+            stt["comments"].pop(eid, None)
+        stt["comments_gen"] += 1
+
+@_timed_fn("fetch.comments")
+def _fetch_comments_bulk(empresa_ids) -> dict[str, pd.DataFrame]:
+    """
+    Comentários de várias empresas numa consulta só (agrupados/ordenados no SQL),
+    guardados por empresa. IDs já em cache e dentro do TTL não vão ao banco.
+    """
+    stt = _table_state()
+    ids = list(dict.fromkeys(str(i) for i in empresa_ids))
+    with stt["lock"]:
+        now = time.monotonic()
+        cache = stt["comments"]
+        out = {i: cache[i][0] for i in ids if i in cache and (now - cache[i][1]) < CACHE_TTL_S}
+        gen = stt["comments_gen"]
+    missing = [i for i in ids if i not in out]
+    # consultas fora do lock (podem rodar em segundo plano junto com outras); se um comentário
+    # foi gravado no meio, devolve o resultado mas não o guarda (como _query_view)
+    for k in range(0, len(missing), COMMENTS_IN_CHUNK):
+        chunk = missing[k:k + COMMENTS_IN_CHUNK]
+        pdf = _read_df(f"""
+            SELECT {', '.join(f'"{c}"' for c in COMMENT_COLS)} FROM {FQN_COMMENTS}
+            WHERE "EMPRESA_ID" IN ({', '.join('?' for _ in chunk)})
+            ORDER BY "EMPRESA_ID", "CREATED_AT" DESC
+        """, chunk)
+        groups = {eid: g.reset_index(drop=True) for eid, g in pdf.groupby("EMPRESA_ID", sort=False)}
+        with stt["lock"]:
+            keep = stt["comments_gen"] == gen
+            for i in chunk:
+                out[i] = groups.get(i, pdf.iloc[0:0])
+                if keep:
+                    cache[i] = (out[i], now)
+    return {i: out[i] for i in ids}
 
 def _fetch_comments(empresa_id: str) -> pd.DataFrame:
-    return _sf(f"""
-        SELECT * FROM {FQN_COMMENTS}
-        WHERE "EMPRESA_ID" = '{_sf_escape(empresa_id)}'
-        ORDER BY "CREATED_AT" DESC
-    """).to_pandas()
+    return _fetch_comments_bulk([empresa_id])[empresa_id]
+
+_INSERT_MAIN_SQL = (
+    f"INSERT INTO {FQN_MAIN} ({', '.join(ALL_COLS)}) "
+    f"VALUES ({', '.join('?' for _ in ['ID', *EXPECTED_COLS])}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"
+)
 
+@_timed_fn("write.insert")
 def _insert_record_main(record: dict) -> str:
     """
     record deve usar as CHAVES LIMPA (MAIÚSCULO) conforme EXPECTED_COLS.
@@ -458,30 +2218,768 @@ def _insert_record_main(record: dict) -> str:
             row[c] = "-" if (v is None or str(v).strip() in {"", "nan", "NaN", "NaT"}) else str(v).strip()
 
     rec_id = uuid4().hex
+    params = [rec_id, *(_date_param(row[c]) if c in DATE_COLS else row[c] for c in EXPECTED_COLS)]
+    _write(_INSERT_MAIN_SQL, params)
+    _append_snapshot({"ID": rec_id, **row})
+    _search_record(rec_id, row)
+    _refresh_statuses([rec_id])
+    return rec_id
+
+# =========================
+# FILA DE GRAVAÇÃO (edições e comentários aplicados em lote)
+# =========================
+# com a fila ligada, salvar/comentar só guarda na sessão (a tela já mostra o valor novo)
+# e "Aplicar" grava tudo de uma vez: um UPDATE por conjunto de colunas e um INSERT multi-linha
+WRITE_BEHIND = _app_cfg("write_behind", False)
+WRITE_BATCH_ROWS = 500
+
+def _write_behind_on() -> bool:
+    return bool(st.session_state.get("write_behind", WRITE_BEHIND))
+
+def _pending_count() -> int:
+    p = st.session_state.pending_writes
+    return len(p["updates"]) + len(p["comments"])
+
+def _queue_update(rec_id: str, updates: dict, original: dict | None = None) -> dict:
+    """Como _update_record, mas só enfileira; edições seguidas do mesmo registro se acumulam."""
+    if not rec_id:
+        raise ValueError("ID obrigatório.")
+    updates = {k: v for k, v in updates.items() if k in EXPECTED_COLS}
+    if original is not None:
+        updates = _changed_fields(original, updates)
+    if updates:
+        st.session_state.pending_writes["updates"].setdefault(str(rec_id), {}).update(updates)
+    return updates
+
+def _queue_comment(empresa_id: str, username: str, name: str, message: str):
+    if not str(message).strip():
+        return
+    st.session_state.pending_writes["comments"].append({
+        "ID": uuid4().hex, "EMPRESA_ID": str(empresa_id),
+        "USERNAME": str(username), "NAME": str(name), "MESSAGE": message.strip(),
+    })
+
+def _pending_comments(empresa_id: str) -> list[dict]:
+    return [c for c in st.session_state.pending_writes["comments"] if c["EMPRESA_ID"] == str(empresa_id)]
+
+def _overlay_pending(pdf: pd.DataFrame) -> pd.DataFrame:
+    """Mostra as edições ainda na fila por cima do que veio do banco (atualização otimista)."""
+    ups = st.session_state.pending_writes["updates"]
+    if not ups or pdf.empty or "ID" not in pdf.columns:
+        return pdf
+    hit = pdf["ID"].isin(list(ups))
+    if not hit.any():
+        return pdf
+    pdf = pdf.copy()
+    for k in DATE_COLS:
+        if k in pdf.columns:
+            pdf[k] = pdf[k].astype(object)
+    for idx in pdf.index[hit]:
+        for k, v in ups[pdf.at[idx, "ID"]].items():
+            if k in pdf.columns:
+                pdf.at[idx, k] = _snapshot_value(k, v)
+    return pdf
+
+def _overlay_record(rec: dict | None) -> dict | None:
+    if rec is None:
+        return None
+    upd = st.session_state.pending_writes["updates"].get(str(rec.get("ID")), {})
+    return {**rec, **{k: _snapshot_value(k, v) for k, v in upd.items()}}
+
+def _update_many(cols: list[str], rows: dict[str, dict]):
+    """Um UPDATE ... FROM (VALUES ...) para vários registros com as mesmas colunas alteradas."""
+    set_clause = ", ".join(
+        [*(f"{c} = CAST(s.{c} AS {'DATE' if c in DATE_COLS else 'VARCHAR'})" for c in cols),
+         "UPDATED_AT = CURRENT_TIMESTAMP"]
+    )
+    values = ", ".join(f"({', '.join('?' for _ in range(len(cols) + 1))})" for _ in rows)
+    params = [
+        v for rec_id, upd in rows.items()
+        for v in (rec_id, *(_date_param(upd[c]) if c in DATE_COLS else str(upd[c]) for c in cols))
+    ]
+    _write(
+        f"UPDATE {FQN_MAIN} AS t SET {set_clause} "
+        f"FROM (VALUES {values}) AS s(ID, {', '.join(cols)}) WHERE t.ID = s.ID",
+        params,
+    )
+
+def _insert_comments_many(rows: list[dict]):
+    values = ", ".join("(?, ?, ?, ?, ?, CURRENT_TIMESTAMP)" for _ in rows)
+    params = [r[c] for r in rows for c in ("ID", "EMPRESA_ID", "USERNAME", "NAME", "MESSAGE")]
+    _write(
+        f'INSERT INTO {FQN_COMMENTS} ("ID","EMPRESA_ID","USERNAME","NAME","MESSAGE","CREATED_AT") VALUES {values}',
+        params,
+    )
+
+@_timed_fn("write.flush")
+def _flush_pending() -> int:
+    """
+    Grava a fila da sessão. Cada lote confirmado sai da fila na hora, então uma falha
+    no meio deixa pendente só o que ainda não foi gravado. Devolve quantos itens foram aplicados.
+    """
+    p = st.session_state.pending_writes
+    done = 0
+    dated = [i for i, upd in p["updates"].items() if set(upd) & set(DATE_COLS)]
+
+    groups: dict[tuple, list[str]] = {}
+    for rec_id, upd in p["updates"].items():
+        groups.setdefault(tuple(sorted(upd)), []).append(rec_id)
+    for cols, ids in groups.items():
+        for k in range(0, len(ids), WRITE_BATCH_ROWS):
+            batch = {i: p["updates"][i] for i in ids[k:k + WRITE_BATCH_ROWS]}
+            _update_many(list(cols), batch)
+            _patch_snapshot_many({i: {**u, "UPDATED_AT": None} for i, u in batch.items()})
+            for i in batch:
+                _search_record(i, p["updates"].pop(i))
+            done += len(batch)
+    if dated:
+        _refresh_statuses(dated)
+
+    while p["comments"]:
+        batch = p["comments"][:WRITE_BATCH_ROWS]
+        _insert_comments_many(batch)
+        del p["comments"][:len(batch)]
+        _drop_comments(c["EMPRESA_ID"] for c in batch)
+        for c in batch:
+            _search_comment(c["EMPRESA_ID"], c["ID"], c["MESSAGE"])
+        done += len(batch)
+    return done
 
-    def _date_sql(v: str) -> str:
-        if v in ("-", "", None):
-            return "NULL"
-        d = pd.to_datetime(v, dayfirst=True, errors="coerce")
-        return f"TO_DATE('{d.strftime('%Y-%m-%d')}')" if pd.notna(d) else "NULL"
-
-    cols_order = ["ID", *EXPECTED_COLS, "CREATED_AT", "UPDATED_AT"]
-    col_list = ", ".join(cols_order)
-
-    vals = []
-    for c in cols_order:
-        if c == "ID":
-            vals.append(f"'{rec_id}'")
-        elif c in {"CREATED_AT", "UPDATED_AT"}:
-            vals.append("CURRENT_TIMESTAMP()")
-        elif c in DATE_COLS:
-            vals.append(_date_sql(row[c]))
+# =========================
+# BUSCA (índice invertido em memória, ranking BM25)
+# =========================
+# o índice cobre os campos de texto livre e os comentários; é montado uma vez por processo
+# (em segundo plano, logo após o login) e atualizado a cada edição/inclusão/comentário feito
+# aqui. Mudanças de fora (outra réplica, SQL direto) entram na reconstrução a cada SEARCH_REBUILD_S.
+SEARCH_FIELDS = ["NOME_EMPRESA", "DESCRICAO", "RESUMO", "METODOLOGIA", "COBERTURA", "CONCORRENTES"]
+SEARCH_WEIGHTS = {"NOME_EMPRESA": 3}   # termo no nome pesa como 3 ocorrências; demais campos, 1
+SEARCH_REBUILD_S = _app_cfg("search_rebuild_s", 3600)
+SEARCH_PREFIX_MAX = 50                 # expansões do último termo (busca enquanto digita)
+SEARCH_CACHE_MAX = 32
+BM25_K1, BM25_B = 1.2, 0.75
+_SEARCH_STOPWORDS = {
+    "a", "o", "e", "as", "os", "ao", "da", "de", "do", "das", "dos", "em", "na", "no", "nas", "nos",
+    "um", "uma", "para", "por", "com", "que", "se",
+}
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _search_terms(text) -> list[str]:
+    """Termos sem acento e em minúscula (mesma regra de _deaccent_lower), sem stopwords."""
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return []
+    return [t for t in _TOKEN_RE.findall(_deaccent_lower(text)) if t not in _SEARCH_STOPWORDS]
+
+@st.cache_resource
+def _search_index() -> dict:
+    return {
+        "lock": threading.RLock(),
+        "built_at": None, "building": False, "replay": [], "future": None,
+        "docs": {},       # ID -> {campo: Counter}; "_comments" junta os comentários
+        "masks": {},      # ID -> máscara de segmentos (SEG_BITS)
+        "postings": {},   # termo -> {ID: frequência ponderada}
+        "lens": {}, "total_len": 0,
+        "comment_ids": set(),  # comentários já somados em "_comments" (a reaplicação não conta duas vezes)
+        "vocab": None,    # termos ordenados (para prefixo), refeito quando surge termo novo
+        "gen": 0, "hits": OrderedDict(),
+    }
+
+def _index_drop(idx: dict, rec_id: str):
+    fields = idx["docs"].pop(rec_id, None)
+    if fields is None:
+        return
+    for term in set().union(*fields.values()):
+        post = idx["postings"].get(term)
+        if post is not None:
+            post.pop(rec_id, None)
+            if not post:
+                del idx["postings"][term]
+    idx["total_len"] -= idx["lens"].pop(rec_id, 0)
+    idx["masks"].pop(rec_id, None)
+
+def _index_put(idx: dict, rec_id: str, fields: dict, mask: int):
+    _index_drop(idx, rec_id)
+    tf = {}
+    for f, counts in fields.items():
+        w = SEARCH_WEIGHTS.get(f, 1)
+        for term, n in counts.items():
+            tf[term] = tf.get(term, 0) + w * n
+    for term, n in tf.items():
+        post = idx["postings"].get(term)
+        if post is None:
+            post = idx["postings"][term] = {}
+            idx["vocab"] = None
+        post[rec_id] = n
+    idx["docs"][rec_id] = fields
+    idx["masks"][rec_id] = mask
+    idx["lens"][rec_id] = sum(tf.values())
+    idx["total_len"] += idx["lens"][rec_id]
+
+def _index_apply(idx: dict, op):
+    """Aplica uma mudança incremental; durante a reconstrução ela é repetida no índice novo."""
+    with idx["lock"]:
+        if idx["built_at"] is None and not idx["building"]:
+            return  # ainda não montado: a montagem já vai ler o valor gravado
+        op(idx)
+        if idx["building"]:
+            idx["replay"].append(op)
+        idx["gen"] += 1
+        idx["hits"].clear()
+
+def _search_record(rec_id: str, values: dict):
+    """Inclusão/edição: reindexa só os campos de busca (e o segmento) presentes em values."""
+    rec_id = str(rec_id)
+
+    def _op(idx):
+        fields = dict(idx["docs"].get(rec_id, {}))
+        for f in SEARCH_FIELDS:
+            if f in values:
+                fields[f] = Counter(_search_terms(values[f]))
+        mask = segments_mask(values["SEGMENTO"]) if "SEGMENTO" in values else idx["masks"].get(rec_id, segments_mask(None))
+        _index_put(idx, rec_id, fields, mask)
+
+    if set(values) & {*SEARCH_FIELDS, "SEGMENTO"}:
+        _index_apply(_search_index(), _op)
+
+def _search_comment(empresa_id: str, comment_id: str, message: str):
+    rec_id = str(empresa_id)
+
+    def _op(idx):
+        # a montagem pode já ter lido este comentário do banco: reaplicar não soma de novo
+        if rec_id not in idx["docs"] or comment_id in idx["comment_ids"]:
+            return
+        idx["comment_ids"].add(comment_id)
+        fields = dict(idx["docs"][rec_id])
+        fields["_comments"] = fields.get("_comments", Counter()) + Counter(_search_terms(message))
+        _index_put(idx, rec_id, fields, idx["masks"][rec_id])
+
+    _index_apply(_search_index(), _op)
+
+@_timed_fn("search.build")
+def _search_build():
+    """Monta o índice do zero (fora do lock) e troca de uma vez; edições no meio são reaplicadas."""
+    idx = _search_index()
+    try:
+        new = {"docs": {}, "masks": {}, "postings": {}, "lens": {}, "total_len": 0, "comment_ids": set()}
+        comments: dict[str, Counter] = {}
+        for batch in _read_batches(f'SELECT "ID", "EMPRESA_ID", "MESSAGE" FROM {FQN_COMMENTS}'):
+            new["comment_ids"].update(batch["ID"].astype(str))
+            for eid, msg in zip(batch["EMPRESA_ID"].astype(str), batch["MESSAGE"]):
+                comments.setdefault(eid, Counter()).update(_search_terms(msg))
+        for batch in _read_batches(f"SELECT ID, SEGMENTO, {', '.join(SEARCH_FIELDS)} FROM {FQN_MAIN}"):
+            masks = _map_unique(batch["SEGMENTO"].fillna("-"), segments_mask)
+            for rec, mask in zip(batch.to_dict("records"), masks):
+                rec_id = str(rec["ID"])
+                fields = {f: Counter(_search_terms(rec[f])) for f in SEARCH_FIELDS}
+                if rec_id in comments:
+                    fields["_comments"] = comments[rec_id]
+                _index_put(new, rec_id, fields, int(mask))
+    except Exception:
+        with idx["lock"]:
+            idx["building"], idx["replay"] = False, []
+        raise
+    with idx["lock"]:
+        for op in idx["replay"]:
+            op(new)
+        idx.update(new, vocab=None, built_at=time.monotonic(), building=False, replay=[])
+        idx["gen"] += 1
+        idx["hits"].clear()
+
+def _search_invalidate():
+    """Depois de uma importação: reconstrói em segundo plano (as buscas seguem no índice atual)."""
+    with _search_index()["lock"]:
+        if _search_index()["built_at"] is not None:
+            _search_index()["built_at"] = 0.0
+
+def _search_warmup() -> Future:
+    """Dispara a (re)construção em segundo plano se o índice não existe ou venceu."""
+    idx = _search_index()
+    with idx["lock"]:
+        stale = idx["built_at"] is None or (time.monotonic() - idx["built_at"]) >= SEARCH_REBUILD_S
+        if stale and not idx["building"]:
+            idx["building"], idx["replay"] = True, []
+            idx["future"] = _submit(("search-index",), _search_build)
+        return idx["future"]
+
+def _prefix_terms(idx: dict, prefix: str) -> list[str]:
+    if idx["vocab"] is None:
+        idx["vocab"] = sorted(idx["postings"])
+    vocab = idx["vocab"]
+    out = []
+    for term in vocab[bisect_left(vocab, prefix):]:
+        if not term.startswith(prefix) or len(out) >= SEARCH_PREFIX_MAX:
+            break
+        out.append(term)
+    return out
+
+@_timed_fn("search")
+def _search(query: str, segmento: str | None = None) -> list[str]:
+    """
+    IDs que contêm todos os termos da busca (o último também como prefixo),
+    do mais para o menos relevante (BM25). Não consulta o banco.
+    """
+    terms = list(dict.fromkeys(_search_terms(query)))
+    if not terms:
+        return []
+    fut = _search_warmup()
+    idx = _search_index()
+    if idx["built_at"] is None:
+        fut.result()  # primeira busca do processo: espera a montagem
+    bit = SEG_BITS.get(segmento, 0)
+    key = (tuple(terms), bit)
+    with idx["lock"]:
+        hit = idx["hits"].get(key)
+        if hit is not None:
+            idx["hits"].move_to_end(key)
+            return hit
+        n_docs = len(idx["lens"])
+        avg_len = (idx["total_len"] / n_docs) if n_docs else 1.0
+        scores: dict[str, float] = {}
+        for i, term in enumerate(terms):
+            expanded = _prefix_terms(idx, term) if i == len(terms) - 1 else [term]
+            term_scores: dict[str, float] = {}
+            for t in expanded:
+                post = idx["postings"].get(t, {})
+                idf = np.log(1.0 + (n_docs - len(post) + 0.5) / (len(post) + 0.5))
+                for rec_id, tf in post.items():
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * idx["lens"][rec_id] / avg_len)
+                    term_scores[rec_id] = term_scores.get(rec_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+            if i == 0:
+                scores = term_scores
+            else:
+                scores = {r: s + term_scores[r] for r, s in scores.items() if r in term_scores}
+            if not scores:
+                break
+        if bit:
+            scores = {r: s for r, s in scores.items() if idx["masks"].get(r, 0) & bit}
+        out = sorted(scores, key=lambda r: (-scores[r], r))
+        idx["hits"][key] = out
+        while len(idx["hits"]) > SEARCH_CACHE_MAX:
+            idx["hits"].popitem(last=False)
+        return out
+
+@_timed_fn("fetch.ids")
+def _fetch_ids(ids: list[str], cols: list[str]) -> pd.DataFrame:
+    """Linhas dos IDs pedidos, na ordem dada."""
+    if not ids:
+        return pd.DataFrame(columns=cols)
+    if SYNC_MODE == "query":
+        in_list = ", ".join(f"'{_sf_escape(i)}'" for i in ids)
+        pdf = _query_view(f"SELECT {', '.join(cols)} FROM {FQN_MAIN} WHERE ID IN ({in_list})")
+    else:
+        pdf = _main_snapshot()
+        pdf = pdf.loc[pdf["ID"].isin(ids), [c for c in cols if c in pdf.columns]]
+    pdf = pdf.drop_duplicates("ID").set_index("ID", drop=False)
+    return pdf.loc[[i for i in ids if i in pdf.index]].reset_index(drop=True)
+
+def _search_page(query: str, segmento: str | None, cols: list[str],
+                 page: int, page_size: int) -> tuple[pd.DataFrame, int]:
+    """Como _fetch_page, mas para o resultado da busca: ranking em memória, só a página vai ao banco."""
+    ids = _search(query, segmento)
+    return _fetch_ids(ids[page * page_size:(page + 1) * page_size], cols), len(ids)
+
+# =========================
+# EXECUÇÃO EM SEGUNDO PLANO (consultas da página em paralelo)
+# =========================
+# as consultas independentes de uma execução (cards e comentários) são disparadas
+# juntas num pool de threads; a página espera cada uma até QUERY_WAIT_S e, se demorar,
+# mostra o último resultado bom daquela consulta enquanto a atual termina em segundo plano
+QUERY_WORKERS = _app_cfg("query_workers", 4)
+QUERY_WAIT_S = _app_cfg("query_wait_s", 8.0)
+
+@st.cache_resource
+def _query_pool() -> dict:
+    return {
+        "executor": ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="consulta"),
+        "lock": threading.Lock(),
+        "running": {},           # (chave, versão) -> Future, para não repetir consulta em andamento
+        "last": OrderedDict(),   # chave -> último resultado bom (fallback)
+    }
+
+def _submit(key: tuple, fn, *args) -> Future:
+    """Dispara fn(*args) no pool; a mesma chave na mesma versão da tabela reaproveita o Future."""
+    pool = _query_pool()
+    run_key = (key, _table_version())
+    ctx = get_script_run_ctx()
+
+    def _task():
+        # só para os st.cache_resource reconhecerem a thread; nada de st.* de interface aqui
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            res = fn(*args)
+        finally:
+            add_script_run_ctx(threading.current_thread(), None)
+            with pool["lock"]:
+                pool["running"].pop(run_key, None)
+        with pool["lock"]:
+            pool["last"][key] = res
+            pool["last"].move_to_end(key)
+            while len(pool["last"]) > VIEW_CACHE_MAX:
+                pool["last"].popitem(last=False)
+        return res
+
+    with pool["lock"]:
+        fut = pool["running"].get(run_key)
+        if fut is None:
+            fut = pool["executor"].submit(_task)
+            pool["running"][run_key] = fut
+        return fut
+
+def _await(key: tuple, fut: Future, timeout: float | None = None):
+    """
+    Resultado do Future em até `timeout` s. Passado o prazo (ou em erro), devolve o último
+    resultado bom da chave, se houver. Retorna (resultado, atualizado?).
+    """
+    try:
+        return fut.result(timeout=QUERY_WAIT_S if timeout is None else timeout), True
+    except Exception:
+        with _query_pool()["lock"]:
+            last = _query_pool()["last"].get(key)
+        if last is None:
+            return fut.result(), True   # sem fallback: espera (ou propaga o erro)
+        return last, False
+
+def _prefetch_page(segmento: str, with_cards: bool, page: int = 0,
+                   page_size: int = PAGE_SIZE, query: str = "") -> dict[str, tuple[tuple, Future]]:
+    """Dispara as consultas da página de uma vez: {nome: (chave, Future)}."""
+    jobs = {}
+    if with_cards:
+        key = ("cards", segmento, page, page_size, query)
+        if query.strip():
+            cards = _submit(key, _search_page, query, segmento, CARD_COLS, page, page_size)
         else:
-            vals.append(f"'{_sf_escape(row.get(c, '-'))}'")
+            cards = _submit(key, _fetch_page, segmento, CARD_COLS, page, page_size)
+        jobs["cards"] = (key, cards)
+        # comentários dos cards visíveis assim que a página chegar; o modal lê do cache
+        key = ("comments", segmento, page, page_size, query)
+        jobs["comments"] = (key, _submit(key, lambda: _fetch_comments_bulk(cards.result()[0]["ID"].tolist())))
+    return jobs
 
-    values_sql = ", ".join(vals)
-    _sf(f'INSERT INTO {FQN_MAIN} ({col_list}) VALUES ({values_sql})').collect()
-    return rec_id
+# =========================
+# EXPORTAÇÃO SOB DEMANDA (em cache por filtro + versão da tabela + formato)
+# =========================
+# o arquivo é escrito lote a lote direto do cursor: memória limitada a um lote
+# (+ o arquivo final, que o download_button precisa em bytes)
+EXPORT_CACHE_MAX = _app_cfg("export_cache_max", 8)
+EXPORT_BATCH_ROWS = _app_cfg("export_batch_rows", 20000)
+EXPORT_WIDTH_SAMPLE = 1000  # linhas do 1º lote usadas para estimar a largura das colunas
+EXPORT_FORMATS = {
+    "xlsx": ("Planilha (XLSX)", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "text/csv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+}
+
+@st.cache_resource
+def _export_cache() -> dict:
+    return {"lock": threading.Lock(), "items": OrderedDict()}  # (segmento, versão, formato) -> bytes
+
+def _export_batches(segmento: str):
+    """Lotes já no formato de exportação (rótulos amigáveis, datas DD/MM/AAAA, só texto/None)."""
+    if SYNC_MODE == "query":
+        raw = _read_batches(_company_query(segmento, EXPECTED_COLS))
+    else:
+        pdf = _fetch_df(segmento, cols=EXPECTED_COLS)
+        raw = (pdf.iloc[k:k + EXPORT_BATCH_ROWS] for k in range(0, len(pdf), EXPORT_BATCH_ROWS))
+    for batch in raw:
+        out = _build_export_df(batch)
+        if not out.empty:
+            yield out.astype(object).where(out.notna(), None)
+
+def _xlsx_widths(sample: pd.DataFrame) -> list[int]:
+    return [
+        int(min(40, max(12, sample[c].fillna("").astype(str).str.len().quantile(0.9) + 2)))
+        for c in sample.columns
+    ]
+
+def _export_xlsx(batches) -> bytes:
+    buf = BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"constant_memory": True})  # linhas vão para disco conforme escritas
+    ws = wb.add_worksheet("Empresas")
+    header = wb.add_format({"bold": True})
+    r = 0
+    for batch in batches:
+        if r == 0:
+            for i, w in enumerate(_xlsx_widths(batch.head(EXPORT_WIDTH_SAMPLE))):
+                ws.set_column(i, i, w)
+            ws.write_row(0, 0, list(batch.columns), header)
+            r = 1
+        for row in batch.itertuples(index=False, name=None):
+            ws.write_row(r, 0, row)
+            r += 1
+    wb.close()
+    return buf.getvalue() if r else b""
+
+def _export_csv(batches) -> bytes:
+    buf = BytesIO()
+    for batch in batches:
+        first = buf.tell() == 0
+        buf.write(batch.to_csv(index=False, header=first).encode("utf-8-sig" if first else "utf-8"))
+    return buf.getvalue()
+
+def _export_parquet(batches) -> bytes:
+    buf, writer = BytesIO(), None
+    for batch in batches:
+        if writer is None:
+            schema = pa.schema([(c, pa.string()) for c in batch.columns])
+            writer = pq.ParquetWriter(buf, schema)
+        writer.write_table(pa.Table.from_pandas(batch.astype("string"), schema=schema, preserve_index=False))
+    if writer is None:
+        return b""
+    writer.close()
+    return buf.getvalue()
+
+_EXPORT_WRITERS = {"xlsx": _export_xlsx, "csv": _export_csv, "parquet": _export_parquet}
+
+def _export_artifact(segmento: str, fmt: str, build: bool = True) -> bytes | None:
+    """
+    Arquivo exportado do filtro atual. Downloads repetidos sem escrita no meio saem da memória;
+    com build=False só consulta o cache (None se ainda não foi gerado). b"" = nada a exportar.
+    """
+    cache = _export_cache()
+    key = (segmento, _table_version(), fmt)
+    with cache["lock"]:
+        if key in cache["items"]:
+            cache["items"].move_to_end(key)
+            return cache["items"][key]
+    if not build:
+        return None
+
+    with _timed(f"export.{fmt}", segmento=segmento) as ev:
+        data = _EXPORT_WRITERS[fmt](_export_batches(segmento))
+        ev["bytes"] = len(data)
+
+    key = (segmento, _table_version(), fmt)  # a leitura pode ter recarregado o snapshot
+    with cache["lock"]:
+        cache["items"][key] = data
+        while len(cache["items"]) > EXPORT_CACHE_MAX:
+            cache["items"].popitem(last=False)
+    return data
+
+# =========================
+# DOCUMENTOS (armazenamento por conteúdo em DOCS_DIR)
+# =========================
+# cada arquivo é gravado uma vez, com o SHA-256 do conteúdo como nome (DOCS_DIR/ab/abcd...);
+# TB_EMPRESAS_DOCUMENTOS liga o hash ao ID da empresa (o mesmo arquivo em duas empresas ocupa
+# disco uma vez só). Miniatura e texto extraído são gerados em segundo plano e guardados ao lado
+# do arquivo; o modal só mostra o que já estiver pronto. Anexar, remover e gravar os derivados de
+# um mesmo hash passam por um lock (o arquivo não some entre o INSERT e a contagem de vínculos).
+# docs_dir fica fora do controle de versão (.gitignore); em produção aponte para um volume persistente
+DOCS_DIR = _app_cfg("docs_dir", "documentos")
+DOC_LOCK_STRIPES = 64
+DOC_TYPES = {"pdf": "application/pdf", "png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg",
+             "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+             "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+DOC_THUMB_PX = 320
+DOC_TEXT_MAX = 200_000       # caracteres guardados do texto extraído
+DOC_TEXT_PREVIEW = 3000
+
+@st.cache_resource
+def _ensure_docs() -> bool:
+    # migração: roda na inicialização (main, logo após o login), nunca no caminho de leitura
+    _write(f"""CREATE TABLE IF NOT EXISTS {FQN_DOCS} (
+        ID VARCHAR, EMPRESA_ID VARCHAR, SHA256 VARCHAR, FILE_NAME VARCHAR, MIME VARCHAR,
+        SIZE_BYTES INTEGER, USERNAME VARCHAR, CREATED_AT TIMESTAMP)""")
+    return True
+
+@st.cache_resource
+def _doc_locks() -> list[threading.Lock]:
+    return [threading.Lock() for _ in range(DOC_LOCK_STRIPES)]
+
+def _doc_lock(sha: str) -> threading.Lock:
+    """Lock do hash (faixas fixas: a memória não cresce com o número de arquivos)."""
+    return _doc_locks()[int(sha[:8], 16) % DOC_LOCK_STRIPES]
+
+def _doc_path(sha: str, suffix: str = "") -> str:
+    return os.path.join(DOCS_DIR, sha[:2], sha + suffix)
+
+def _stage_blob(fileobj) -> tuple[str, str, int]:
+    """Copia o arquivo em blocos para um .part em DOCS_DIR calculando o SHA-256; devolve (tmp, sha, tamanho)."""
+    os.makedirs(DOCS_DIR, exist_ok=True)
+    h, size = hashlib.sha256(), 0
+    fd, tmp = tempfile.mkstemp(dir=DOCS_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            fileobj.seek(0)
+            for block in iter(lambda: fileobj.read(HASH_BLOCK_BYTES), b""):
+                h.update(block)
+                out.write(block)
+                size += len(block)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp, h.hexdigest(), size
+
+def _place_blob(tmp: str, sha: str):
+    """Move o .part para o lugar definitivo (com _doc_lock(sha)); conteúdo já guardado não é regravado."""
+    if os.path.exists(_doc_path(sha)):
+        os.remove(tmp)
+    else:
+        os.makedirs(os.path.dirname(_doc_path(sha)), exist_ok=True)
+        os.replace(tmp, _doc_path(sha))
+
+def _fetch_documents(empresa_id: str) -> pd.DataFrame:
+    """Documentos da empresa (mais recentes primeiro), em cache até o TTL ou até anexar/remover."""
+    stt = _table_state()
+    with stt["lock"]:
+        hit = stt["docs"].get(empresa_id)
+        if hit is not None and (time.monotonic() - hit[1]) < CACHE_TTL_S:
+            return hit[0]
+    pdf = _read_df(
+        f"SELECT ID, SHA256, FILE_NAME, MIME, SIZE_BYTES, USERNAME, CREATED_AT FROM {FQN_DOCS} "
+        "WHERE EMPRESA_ID = ? ORDER BY CREATED_AT DESC",
+        [str(empresa_id)],
+    )
+    with stt["lock"]:
+        stt["docs"][empresa_id] = (pdf, time.monotonic())
+    return pdf
+
+def attach_document(empresa_id: str, fileobj, file_name: str, username: str) -> bool:
+    """Guarda o arquivo e liga à empresa. False se esse conteúdo já estava anexado a ela."""
+    tmp, sha, size = _stage_blob(fileobj)
+    ext = os.path.splitext(str(file_name))[1].lower().lstrip(".")
+    # arquivo no lugar + vínculo gravado sob o mesmo lock: um detach do mesmo hash não apaga no meio
+    with _doc_lock(sha):
+        _place_blob(tmp, sha)
+        if (_fetch_documents(empresa_id)["SHA256"] == sha).any():
+            return False
+        _write(
+            f"INSERT INTO {FQN_DOCS} (ID, EMPRESA_ID, SHA256, FILE_NAME, MIME, SIZE_BYTES, USERNAME, CREATED_AT) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            [uuid4().hex, str(empresa_id), sha, str(file_name), DOC_TYPES.get(ext, "application/octet-stream"),
+             int(size), str(username)],
+        )
+    stt = _table_state()
+    with stt["lock"]:
+        stt["docs"].pop(empresa_id, None)
+    _doc_preview(sha, DOC_TYPES.get(ext, ""))  # já começa a miniatura/texto
+    return True
+
+def detach_document(empresa_id: str, doc_id: str, sha: str):
+    """Remove o vínculo; o arquivo (e derivados) só sai do disco se nenhuma empresa o usa mais."""
+    with _doc_lock(sha):
+        _write(f"DELETE FROM {FQN_DOCS} WHERE ID = ?", [str(doc_id)])
+        # contagem na fonte (a réplica pode não ter ainda o vínculo de outra instância)
+        left = _source_store().query(f"SELECT COUNT(*) AS N FROM {FQN_DOCS} WHERE SHA256 = ?", [sha])
+        if int(left["N"].iloc[0]) == 0:
+            for suffix in ("", ".thumb.png", ".txt"):
+                if os.path.exists(_doc_path(sha, suffix)):
+                    os.remove(_doc_path(sha, suffix))
+    stt = _table_state()
+    with stt["lock"]:
+        stt["docs"].pop(empresa_id, None)
+
+def _thumbnail_png(img) -> bytes:
+    img = img.convert("RGB")
+    img.thumbnail((DOC_THUMB_PX, DOC_THUMB_PX))
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def _doc_derive(sha: str, mime: str):
+    """Gera miniatura (.thumb.png) e texto (.txt) ao lado do arquivo; vazio quando não se aplica."""
+    if not os.path.exists(_doc_path(sha)):
+        return
+    thumb, text = b"", ""
+    try:
+        if mime.startswith("image/"):
+            with Image.open(_doc_path(sha)) as img:
+                thumb = _thumbnail_png(img)
+        elif mime == "application/pdf":
+            reader = PdfReader(_doc_path(sha))
+            if reader.pages:
+                # sem rasterizar a página: a maior imagem da 1ª página (o scan, num contrato digitalizado)
+                images = [im.image for im in reader.pages[0].images]
+                if images:
+                    thumb = _thumbnail_png(max(images, key=lambda im: im.size[0] * im.size[1]))
+            parts, n = [], 0
+            for page in reader.pages:
+                if n >= DOC_TEXT_MAX:
+                    break
+                chunk = page.extract_text() or ""
+                parts.append(chunk)
+                n += len(chunk)
+            text = "\n".join(parts)[:DOC_TEXT_MAX]
+    except Exception:
+        pass  # arquivo corrompido/protegido: fica sem prévia
+    with _doc_lock(sha):
+        if not os.path.exists(_doc_path(sha)):
+            return  # removido enquanto a prévia era gerada: não deixa derivados órfãos
+        os.makedirs(os.path.dirname(_doc_path(sha)), exist_ok=True)
+        for suffix, data in ((".thumb.png", thumb), (".txt", text.encode("utf-8"))):
+            tmp = _doc_path(sha, suffix + ".part")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, _doc_path(sha, suffix))
+
+def _doc_preview(sha: str, mime: str) -> dict | None:
+    """
+    {'thumb': caminho|None, 'text': str, 'missing': bool} se já gerados; senão dispara em segundo plano
+    e devolve None. Sem o arquivo no disco não há o que gerar (e nada é redisparado a cada execução).
+    """
+    if not os.path.exists(_doc_path(sha)):
+        return {"thumb": None, "text": "", "missing": True}
+    txt = _doc_path(sha, ".txt")
+    if not os.path.exists(txt):
+        _submit(("doc-preview", sha), _doc_derive, sha, mime)
+        return None
+    thumb = _doc_path(sha, ".thumb.png")
+    with open(txt, encoding="utf-8") as f:
+        text = f.read(DOC_TEXT_PREVIEW)
+    return {"thumb": thumb if os.path.getsize(thumb) else None, "text": text, "missing": False}
+
+def _fmt_size(n) -> str:
+    n = float(n or 0)
+    for unit in ("B", "KB", "MB"):
+        if n < 1024 or unit == "MB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+def _render_documents(rec: dict, can_edit: bool, current_user: dict):
+    """Lista de anexos do modal: miniatura/texto quando prontos, download sob demanda e upload (admin)."""
+    st.markdown("**📎 Documentos:**")
+    docs = _fetch_documents(rec["ID"])
+    if docs.empty:
+        st.caption("Nenhum documento anexado.")
+    ready = st.session_state.setdefault("docs_ready", set())
+    for _, d in docs.iterrows():
+        c_img, c_info = st.columns([1, 3])
+        prev = _doc_preview(d["SHA256"], _s(d["MIME"]))
+        with c_img:
+            if prev is None:
+                st.caption("⏳ gerando prévia…")
+            elif prev["missing"]:
+                st.caption("⚠️ arquivo indisponível")
+            elif prev["thumb"]:
+                st.image(prev["thumb"], width="stretch")
+        with c_info:
+            st.markdown(f"**{_s(d['FILE_NAME'])}** · {_fmt_size(d['SIZE_BYTES'])}")
+            st.caption(f"{_s(d['USERNAME'])} · {_s(d['CREATED_AT'])}")
+            c_dl, c_rm = st.columns(2)
+            with c_dl:
+                # o arquivo só é lido quando o usuário pede o download (o modal não carrega anexos)
+                if d["ID"] not in ready and st.button("Preparar download", key=f"doc-prep-{d['ID']}",
+                                                      use_container_width=True):
+                    ready.add(d["ID"])
+                if d["ID"] in ready and os.path.exists(_doc_path(d["SHA256"])):
+                    with open(_doc_path(d["SHA256"]), "rb") as f:
+                        st.download_button("⬇️ Baixar", data=f, file_name=_s(d["FILE_NAME"]), mime=_s(d["MIME"]),
+                                           key=f"doc-dl-{d['ID']}", use_container_width=True)
+            with c_rm:
+                if can_edit and st.button("🗑️ Remover", key=f"doc-rm-{d['ID']}", use_container_width=True):
+                    detach_document(rec["ID"], d["ID"], d["SHA256"])
+                    st.rerun(scope="fragment")
+            if prev is not None and prev["text"].strip():
+                with st.expander("Texto extraído"):
+                    st.text(prev["text"])
+    if can_edit:
+        up = st.file_uploader("Anexar documento", type=list(DOC_TYPES), key=f"doc-up-{rec['ID']}")
+        if up is not None and st.button("📎 Anexar", key=f"doc-add-{rec['ID']}"):
+            try:
+                if attach_document(rec["ID"], up, up.name, current_user["username"]):
+                    st.success("Documento anexado.")
+                else:
+                    st.info("Este arquivo já está anexado a esta empresa.")
+            except Exception as e:
+                st.error(f"Erro ao anexar: {e}")
 
 # =========================
 # MODAL DE DETALHES (com abas + edição por role)
@@ -496,6 +2994,9 @@ def open_company_dialog(rec: dict, is_admin: bool, current_user: dict):
             f"CNPJ: **{_s(rec.get('CNPJ'))}** • "
             f"Prioridade: **{_s(rec.get('PRIORIDADE'))}**"
         )
+        prox = rec.get("STATUS_PROX_MUDANCA")
+        if prox is not None and not pd.isna(prox):
+            st.caption(f"Status **{_s(rec.get('STATUS'))}** até {_fmt_date(pd.Timestamp(prox) - pd.Timedelta(days=1))}.")
         st.divider()
 
         if is_admin:
@@ -568,7 +3069,12 @@ def open_company_dialog(rec: dict, is_admin: bool, current_user: dict):
                 with tab_status:
                     st.markdown("**Comentários:**")
                     com_df = _fetch_comments(rec["ID"])
-                    if com_df.empty:
+                    pend = _pending_comments(rec["ID"])
+                    for c in reversed(pend):
+                        st.markdown(f"🗨️ **{_s(c['NAME'])}** · _pendente_")
+                        st.markdown(f"> {c['MESSAGE']}")
+                        st.markdown("---")
+                    if com_df.empty and not pend:
                         st.caption("Sem comentários ainda.")
                     else:
                         for _, crow in com_df.iterrows():
@@ -621,7 +3127,15 @@ def open_company_dialog(rec: dict, is_admin: bool, current_user: dict):
                         st.error("Selecione pelo menos **um Segmento**.")
                         return
                     try:
-                        _update_record(rec["ID"], updates)
+                        if _write_behind_on():
+                            if not _queue_update(rec["ID"], updates, original=rec):
+                                st.info("Nenhuma alteração para salvar.")
+                                return
+                            st.success("Alteração na fila — use **Aplicar** na barra lateral para gravar.")
+                            st.rerun()
+                        if not _update_record(rec["ID"], updates, original=rec):
+                            st.info("Nenhuma alteração para salvar.")
+                            return
                         st.success("Registro atualizado com sucesso!")
                         st.rerun()
                     except Exception as e:
@@ -635,7 +3149,7 @@ def open_company_dialog(rec: dict, is_admin: bool, current_user: dict):
                 key = f"novo_coment_{rec['ID']}"
                 txt = st.session_state.get(key, "").strip()
                 if txt:
-                    _insert_comment(
+                    (_queue_comment if _write_behind_on() else _insert_comment)(
                         empresa_id=rec["ID"],
                         username=current_user["username"],
                         name=current_user["name"],
@@ -652,6 +3166,9 @@ def open_company_dialog(rec: dict, is_admin: bool, current_user: dict):
                 on_change=_submit_comment,
             )
 
+            st.markdown("---")
+            _render_documents(rec, can_edit=True, current_user=current_user)
+
         else:
             tab_geral, tab_datas, tab_prod, tab_contatos, tab_obs, tab_status = st.tabs(
                 ["📌 Geral", "📅 Datas", "🧪 Produto/Cobertura",
@@ -707,307 +3224,480 @@ def open_company_dialog(rec: dict, is_admin: bool, current_user: dict):
                         st.markdown(f"> {msg}")
                         st.markdown("---")
 
+            st.markdown("---")
+            _render_documents(rec, can_edit=False, current_user=current_user)
+
     _dialog()
 
 # =========================
-# SIDEBAR (LOGIN + UPLOAD)
+# PÁGINA (importar o módulo só define as funções; a interface roda em main())
 # =========================
-with st.sidebar:
-    st.subheader("🔐 Acesso")
-    if not st.session_state.auth["is_auth"]:
-        with st.form("login_form"):
-            username = st.text_input("Usuário", placeholder="ex: spdo_nome")
-            password = st.text_input("Senha", type="password")
-            ok = st.form_submit_button("Entrar", use_container_width=True)
-            if ok:
-                u = USERS.get(username)
-                if u and password == u["password"]:
-                    st.session_state.auth = {"is_auth": True, "user": {"username": username, **u}}
-                    st.success(f"Bem-vindo, {u['name']}!")
-                    st.rerun()
-                else:
-                    st.error("Usuário ou senha inválidos.")
-    else:
-        user = st.session_state.auth["user"]
-        st.success(f"Logado como **{user['name']}** ({user['role']})")
-        if st.button("Sair", use_container_width=True):
-            st.session_state.clear()
-            ensure_state()
-            st.rerun()
+def main():
+    ensure_state()
+    _perf_begin_run(st.session_state.auth["is_auth"] and st.session_state.auth["user"]["role"] == "admin")
 
+    # =========================
+    # SIDEBAR (LOGIN + UPLOAD)
+    # =========================
     if st.session_state.auth["is_auth"]:
-        st.markdown("---")
-        st.markdown("### 📄 Importar Dados")
-
-        # usar key dinâmica para resetar o componente após importação
-        uploader_key = f"uploader_xlsx_sidebar_{st.session_state.upload_key}"
-        uploaded = st.file_uploader("Selecione um .xlsx", type=["xlsx"], key=uploader_key)
-
-        if uploaded is not None:
-            # hash do conteúdo p/ idempotência
-            digest = hashlib.sha256(uploaded.getvalue()).hexdigest()
+        _ensure_status_cols()  # esquema antes de qualquer leitura (só depois do login: a home não conecta)
+        _ensure_docs()
+        _ensure_ledger()
+        _status_worker()  # recálculo diário
+        _search_warmup()  # índice de busca montado em segundo plano
+
+    page_jobs = (
+        _prefetch_page(st.session_state.filter_segmento, st.session_state.segment_view == "list",
+                       st.session_state.card_page, st.session_state.page_size, st.session_state.search_q)
+        if st.session_state.auth["is_auth"] else {}
+    )
 
-            if digest in st.session_state.processed_hashes:
-                st.info("Este arquivo já foi importado nesta sessão. Selecione outro arquivo.")
-            else:
-                try:
-                    xls = pd.ExcelFile(uploaded, engine="openpyxl")
-                    sheet_names = xls.sheet_names
-                    chosen_sheet = "Dados" if "Dados" in sheet_names else sheet_names[0]
-
-                    df_view = pd.read_excel(xls, sheet_name=chosen_sheet, dtype=str)
-                    df_view.columns = df_view.columns.map(lambda c: str(c).strip())
-
-                    # Mapeia colunas antigas -> limpas
-                    rename_map = {c: ORIGINAL_TO_CANON.get(c, c) for c in df_view.columns}
-                    df_view.rename(columns=rename_map, inplace=True)
-
-                    # Garante colunas esperadas
-                    for c in EXPECTED_COLS:
-                        if c not in df_view.columns:
-                            df_view[c] = "-"
-
-                    # Datas -> date/None
-                    for dc in DATE_COLS:
-                        if dc in df_view.columns:
-                            s = pd.to_datetime(df_view[dc].apply(_fmt_date), format="%d/%m/%Y", errors="coerce")
-                            df_view[dc] = s.dt.date
-                            df_view.loc[s.isna(), dc] = None
-
-                    # Status
-                    df_view["STATUS"] = df_view.apply(
-                        lambda r: _calc_status_like_excel(
-                            r.get("DATA_ASSINATURA"), r.get("INICIO_RENOV"), r.get("VIGENCIA")
-                        ), axis=1
-                    )
+    with st.sidebar:
+        st.subheader("🔐 Acesso")
+        if not st.session_state.auth["is_auth"]:
+            with st.form("login_form"):
+                username = st.text_input("Usuário", placeholder="ex: spdo_nome")
+                password = st.text_input("Senha", type="password")
+                ok = st.form_submit_button("Entrar", use_container_width=True)
+                if ok:
+                    u = USERS.get(username)
+                    if u and password == u["password"]:
+                        st.session_state.auth = {"is_auth": True, "user": {"username": username, **u}}
+                        st.success(f"Bem-vindo, {u['name']}!")
+                        st.rerun()
+                    else:
+                        st.error("Usuário ou senha inválidos.")
+        else:
+            user = st.session_state.auth["user"]
+            st.success(f"Logado como **{user['name']}** ({user['role']})")
+            if st.button("Sair", use_container_width=True):
+                st.session_state.clear()
+                ensure_state()
+                st.rerun()
 
-                    # Limpeza apenas nas NÃO-data
-                    non_date_cols = [c for c in EXPECTED_COLS if c not in DATE_COLS]
-                    for c in non_date_cols:
-                        df_view[c] = df_view[c].apply(
-                            lambda v: "-" if (v is None or str(v).strip() in {"", "nan", "NaN", "NaT"}) else str(v).strip()
-                        )
+        if st.session_state.auth["is_auth"]:
+            st.markdown("---")
+            st.markdown("### 📄 Importar Dados")
 
-                    # Segmento canônico
-                    df_view["SEGMENTO"] = df_view["SEGMENTO"].apply(lambda v: segments_to_str(normalize_segments(v)))
+            # usar key dinâmica para resetar o componente após importação
+            uploader_key = f"uploader_xlsx_sidebar_{st.session_state.upload_key}"
+            uploaded = st.file_uploader("Selecione um .xlsx", type=["xlsx"], key=uploader_key)
 
-                    # APPEND sempre
-                    n = import_to_sf_append(df_view)
+            if uploaded is not None:
+                # hash do conteúdo p/ idempotência (lido em blocos)
+                digest = _hash_upload(uploaded)
+                go = False
 
-                    # marca como processado e reseta o uploader
+                if digest in st.session_state.processed_hashes:
+                    st.info("Este arquivo já foi importado nesta sessão. Selecione outro arquivo.")
+                elif (prev := _ledger_file(digest)) is not None:
                     st.session_state.processed_hashes.add(digest)
-                    st.session_state.upload_key += 1   # força recriar o componente (limpa o arquivo)
-                    st.session_state.upload_info = {"file_name": uploaded.name, "sheet": chosen_sheet, "rows": n}
+                    st.info(
+                        f"Este arquivo já foi importado por **{_s(prev.get('USERNAME'))}** "
+                        f"em {_fmt_date(prev.get('CREATED_AT'))} ({_s(prev.get('ROW_COUNT'))} linha(s)). "
+                        "Selecione outro arquivo."
+                    )
+                else:
+                    try:
+                        sheet_names = _xlsx_sheet_names(uploaded)
+                        chosen_sheet = "Dados" if "Dados" in sheet_names else sheet_names[0]
+
+                        # relatório de duplicatas antes de gravar (uma vez por arquivo)
+                        if st.session_state.dedup.get("digest") != digest:
+                            with st.spinner("Procurando duplicatas…"):
+                                report, stats = dedup_report(uploaded, chosen_sheet)
+                            st.session_state.dedup = {"digest": digest, "report": report, "stats": stats}
+                        report, stats = st.session_state.dedup["report"], st.session_state.dedup["stats"]
+                        msg = f"{stats['rows']} linha(s) na aba '{chosen_sheet}' — {stats['matches']} possível(is) duplicata(s)"
+                        if stats["cnpj_invalid"]:
+                            msg += f", {stats['cnpj_invalid']} CNPJ(s) inválido(s)"
+                        st.caption(msg + ".")
+                        merge_into = {}
+                        if not report.empty:
+                            st.caption("Marque **Mesclar** para atualizar o registro existente em vez de criar outro.")
+                            edited = st.data_editor(
+                                report[["MESCLAR", "NOME", "NOME_EXISTENTE", "MOTIVO", "SIMILARIDADE", "CNPJ", "CNPJ_EXISTENTE"]],
+                                column_config={
+                                    "MESCLAR": st.column_config.CheckboxColumn("Mesclar"),
+                                    "NOME": "Planilha", "NOME_EXISTENTE": "Existente", "MOTIVO": "Motivo",
+                                    "SIMILARIDADE": "Similaridade", "CNPJ": "CNPJ (planilha)", "CNPJ_EXISTENTE": "CNPJ (existente)",
+                                },
+                                disabled=["NOME", "NOME_EXISTENTE", "MOTIVO", "SIMILARIDADE", "CNPJ", "CNPJ_EXISTENTE"],
+                                hide_index=True, key=f"dedup-{digest}",
+                            )
+                            chosen = report[edited["MESCLAR"]]
+                            merge_into = dict(zip(chosen["POS"], chosen["ID_EXISTENTE"]))
+                        go = st.button(f"Importar ({len(merge_into)} mescla(s))", type="primary",
+                                       use_container_width=True, key="btn-import")
+                    except Exception as e:
+                        st.error(f"Não foi possível ler o XLSX. Detalhes: {e}")
+
+                if go:
+                    try:
+                        t0 = time.perf_counter()
+                        resume_from = _import_checkpoints().get(digest, 0)
+                        if resume_from:
+                            st.info(f"Retomando importação após a linha {resume_from}.")
+                        bar = st.progress(0.0, text="Importando…")
+
+                        def _progress(done, total):
+                            bar.progress(min(done / total, 1.0), text=f"Importando… {done}/{total} linha(s)")
+
+                        # lê, normaliza e grava lote a lote
+                        res = import_xlsx_streaming(uploaded, chosen_sheet, digest, on_progress=_progress,
+                                                    merge_into=merge_into)
+                        n = res["rows"]
+                        _ledger_add_file(digest, uploaded.name, chosen_sheet, res,
+                                         st.session_state.auth["user"]["username"], time.perf_counter() - t0)
+
+                        # marca como processado e reseta o uploader
+                        st.session_state.processed_hashes.add(digest)
+                        st.session_state.upload_key += 1   # força recriar o componente (limpa o arquivo)
+                        st.session_state.upload_info = {"file_name": uploaded.name, "sheet": chosen_sheet, "rows": n}
+                        st.session_state.dedup = {}
+
+                        st.success(
+                            f"Importação concluída: {n} linha(s) na aba '{chosen_sheet}' — "
+                            f"{res['inserted']} nova(s), {res['updated']} atualizada(s), {res['unchanged']} sem alteração."
+                        )
+                        st.rerun()
 
-                    st.success(f"Importação concluída: {n} linha(s) na aba '{chosen_sheet}'.")
+                    except Exception as e:
+                        done = _import_checkpoints().get(digest, 0)
+                        if done:
+                            st.error(f"Importação interrompida após {done} linha(s); reenvie o arquivo para continuar. Detalhes: {e}")
+                        else:
+                            st.error(f"Não foi possível ler o XLSX. Detalhes: {e}")
+
+            if st.session_state.auth["user"]["role"] == "admin":
+                st.markdown("### ✏️ Alterações pendentes")
+                st.toggle("Acumular edições e comentários", value=WRITE_BEHIND, key="write_behind",
+                          help="Salvar só enfileira; as alterações vão ao banco juntas ao clicar em Aplicar.")
+                n_pend = _pending_count()
+                if n_pend:
+                    c1, c2 = st.columns(2)
+                    with c1:
+                        if st.button(f"Aplicar {n_pend} alteração(ões)", type="primary", use_container_width=True):
+                            try:
+                                _flush_pending()
+                                st.success("Alterações gravadas.")
+                                st.rerun()
+                            except Exception as e:
+                                st.error(f"Erro ao gravar: {e} ({_pending_count()} alteração(ões) ainda pendente(s))")
+                    with c2:
+                        if st.button("Descartar", use_container_width=True):
+                            st.session_state.pending_writes = {"updates": {}, "comments": []}
+                            st.rerun()
+                    st.caption("Sair da conta descarta o que não foi aplicado.")
+                elif _write_behind_on():
+                    st.caption("Nenhuma alteração na fila.")
+
+            st.markdown("### ⬇️ Exportar Dados")
+            # arquivo só é gerado no clique; depois fica em cache para todos até a próxima escrita
+            seg_atual = st.session_state.filter_segmento  # respeita filtro atual
+            today_str = pd.Timestamp.today().strftime("%Y-%m-%d")
+            for col, (fmt, (label, mime)) in zip(st.columns(len(EXPORT_FORMATS)), EXPORT_FORMATS.items()):
+                with col:
+                    data = _export_artifact(seg_atual, fmt, build=False)
+                    if data is None and st.button(label, key=f"btn-export-{fmt}", use_container_width=True):
+                        with st.spinner("Gerando arquivo..."):
+                            data = _export_artifact(seg_atual, fmt)
+                    if data:
+                        st.download_button(
+                            f"⬇️ {label}",
+                            data=data,
+                            file_name=f"prospeccao_empresas_{today_str}.{fmt}",
+                            mime=mime,
+                            key=f"dl-export-{fmt}",
+                            use_container_width=True,
+                        )
+                    elif data is not None:
+                        st.caption("Nada para exportar no filtro atual.")
+
+            if st.session_state.auth["user"]["role"] == "admin" and PERF_MODE != "off":
+                with st.expander("⏱️ Desempenho"):
+                    runs = _perf_runs()[1:]  # a primeira é esta execução, ainda em andamento
+                    if not runs:
+                        st.caption("Nenhuma execução medida ainda.")
+                    else:
+                        def _run_ms(r):
+                            # execuções encerradas por st.stop/st.rerun: até o fim da última etapa
+                            return r["ms"] if r["ms"] is not None else max(
+                                (e.get("at_ms", 0) + e["ms"] for e in r["events"]), default=None)
+
+                        st.dataframe(pd.DataFrame(
+                            [(r["run"], r["started_at"][11:], _run_ms(r), len(r["events"]),
+                              sum(e["stage"] in ("sql", "sql.fetch") for e in r["events"])) for r in runs],
+                            columns=["execução", "início", "ms", "etapas", "consultas"],
+                        ), hide_index=True, width="stretch", height=160)
+                        # número (e não lista de opções): cada rerun cria uma execução nova e zeraria a escolha
+                        run_no = st.number_input("Detalhar execução nº (vazio = a última)", min_value=1, step=1,
+                                                 value=None, key="perf_run")
+                        run = next((r for r in runs if r["run"] == run_no), runs[0])
+                        ev = pd.DataFrame(run["events"], columns=["stage", "depth", "ms", "at_ms", "rows", "bytes",
+                                                                  "backend", "query_id", "sql", "thread", "ok"])
+                        n_sql = int(ev["stage"].isin(["sql", "sql.fetch"]).sum())
+                        total = _run_ms(run)
+                        st.caption(f"Execução #{run['run']}: **{'—' if total is None else f'{total:.0f} ms'}** • "
+                                   f"{len(ev)} etapa(s) • {n_sql} consulta(s)")
+                        if not ev.empty:
+                            agg = ev.groupby("stage").agg(
+                                n=("ms", "size"), total_ms=("ms", "sum"), max_ms=("ms", "max"),
+                                linhas=("rows", "sum"), bytes=("bytes", "sum"),
+                            ).sort_values("total_ms", ascending=False).reset_index()
+                            agg["bytes"] = agg["bytes"].map(_fmt_size)
+                            st.dataframe(agg.rename(columns={"stage": "etapa"}), hide_index=True, width="stretch")
+                            with st.popover("Etapas em ordem", use_container_width=True):
+                                st.dataframe(ev.sort_values("at_ms", kind="stable").drop(columns=["ok"]),
+                                             hide_index=True, width="stretch")
+                    # eventos de todas as sessões (últimos PERF_EVENTS_MAX), gerados só no clique
+                    if st.button("Gerar JSON de medições", key="btn-perf-json", use_container_width=True):
+                        st.download_button(
+                            "⬇️ Medições (JSON)", data=_perf_export(),
+                            file_name=f"prospec_perf_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.json",
+                            mime="application/json", key="dl-perf-json", on_click="ignore", use_container_width=True,
+                        )
+    # Somente login
+    if not st.session_state.auth["is_auth"]:
+        render_public_home()
+        st.stop()
+
+    # =========================
+    # CONTEÚDO PRINCIPAL
+    # =========================
+    user = st.session_state.auth["user"]
+    is_admin = (user["role"] == "admin")
+
+    st.title("🏗️ Atuação de Prospecção de Dados")
+
+    # ====== Filtros por Segmento (com modo seleção/lista) ======
+    if st.session_state.segment_view == "select":
+        st.subheader("Filtros por Segmento")
+        bt_cols = st.columns(len(SEGMENT_FILTERS))
+        for i, seg in enumerate(SEGMENT_FILTERS):
+            with bt_cols[i]:
+                if st.button(seg, use_container_width=True, key=f"seg-{seg}"):
+                    st.session_state.filter_segmento = seg
+                    st.session_state.segment_view = "list"
+                    st.session_state.card_page = 0
                     st.rerun()
+        st.caption("Escolha um segmento para visualizar os resultados.")
+        st.stop()
+
+    # Modo LISTA (mostra resultados do filtro + botão Voltar)
+    st.subheader(f"Resultados — Segmento: {st.session_state.filter_segmento}")
+    c_voltar, c_novo = st.columns(2)
+    with c_voltar:
+        if st.button("⬅️ Voltar aos filtros", use_container_width=True, key="btn-voltar-segmentos"):
+            st.session_state.segment_view = "select"
+            st.session_state.filter_segmento = "Todos"
+            st.session_state.card_page = 0
+            st.session_state.search_q = ""
+            st.rerun()
 
-                except Exception as e:
-                    st.error(f"Não foi possível ler o XLSX. Detalhes: {e}")
+    def open_create_dialog(default_segmento: str | None, current_user: dict):
+        @st.dialog("✚ Nova empresa", width="large")
+        def _dialog():
+            st.caption("Preencha os campos e clique em **Salvar**.")
+            with st.form("form_nova_empresa"):
+                tab_geral, tab_datas, tab_prod, tab_contatos, tab_obs = st.tabs(
+                    ["📌 Geral", "📅 Datas", "🧪 Produto/Cobertura", "🔗 Contatos & Docs", "🧭 Observações & Mercado"]
+                )
 
-        st.markdown("### ⬇️ Exportar Dados")
-        df_current = _fetch_df(st.session_state.filter_segmento)  # respeita filtro atual
-        exp_df = _build_export_df(df_current)
+                with tab_geral:
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        nome = st.text_input(LABEL["NOME_EMPRESA"], value="")
+                        cnpj = st.text_input(LABEL["CNPJ"], value="")
+                        segmento_ms_default = [default_segmento] if default_segmento in SEGMENT_OPTIONS else []
+                        segmentos_ms = st.multiselect(LABEL["SEGMENTO"], options=SEGMENT_OPTIONS, default=segmento_ms_default)
+                        prioridade = st.select_slider("Prioridade (0 = sem prioridade, 3 = alta)", options=[0, 1, 2, 3], value=0)
+                        situacao = st.text_input(LABEL["SITUACAO"], value="-")
+                        status_atual = st.text_area(LABEL["STATUS_ATUAL"], value="-", height=80)
+                    with col2:
+                        nda_ass = st.text_input(LABEL["NDA_ASSINADO"], value="-")
+                        aprov = st.text_input(LABEL["APROVACAO"], value="-")
+                        relac = st.text_input(LABEL["RELACIONAMENTO"], value="-")
+                        auto = st.text_input(LABEL["AUTOMACAO"], value="-")
+                        doc = st.text_input(LABEL["DOCUMENTO"], value="-")
 
-        if exp_df.empty:
-            st.caption("Nada para exportar no filtro atual.")
-        else:
-            xlsx_bytes = _df_to_xlsx_bytes(exp_df)
-            csv_bytes  = exp_df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig")
-            today_str = pd.Timestamp.today().strftime("%Y-%m-%d")
+                with tab_datas:
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        data_ass = st.text_input(f"{LABEL['DATA_ASSINATURA']} (DD/MM/AAAA)", value="-")
+                    with col2:
+                        inicio_renov = st.text_input(f"{LABEL['INICIO_RENOV']} (DD/MM/AAAA)", value="-")
+                    with col3:
+                        vigencia = st.text_input(f"{LABEL['VIGENCIA']} (DD/MM/AAAA)", value="-")
+                    col4, col5, col6 = st.columns(3)
+                    with col4:
+                        val_anos = st.text_input(LABEL["VAL_ANOS"], value="-")
+                    with col5:
+                        val_meses = st.text_input(LABEL["VAL_MESES"], value="-")
+                    with col6:
+                        val_dias = st.text_input(LABEL["VAL_DIAS"], value="-")
 
-            c1, c2 = st.columns(2)
-            with c1:
-                st.download_button(
-                    "Planilha (XLSX)",
-                    data=xlsx_bytes,
-                    file_name=f"prospeccao_empresas_{today_str}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                )
-            with c2:
-                st.download_button(
-                    "CSV",
-                    data=csv_bytes,
-                    file_name=f"prospeccao_empresas_{today_str}.csv",
-                    mime="text/csv",
-                    use_container_width=True,
-                )
-# Somente login
-if not st.session_state.auth["is_auth"]:
-    render_public_home()
-    st.stop()
+                with tab_prod:
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        metodologia = st.text_area(LABEL["METODOLOGIA"], value="-", height=100)
+                        cobertura = st.text_area(LABEL["COBERTURA"], value="-", height=100)
+                        resumo = st.text_area(LABEL["RESUMO"], value="-", height=100)
+                    with col2:
+                        descricao = st.text_area(LABEL["DESCRICAO"], value="-", height=160)
 
-# =========================
-# CONTEÚDO PRINCIPAL
-# =========================
-user = st.session_state.auth["user"]
-is_admin = (user["role"] == "admin")
+                with tab_contatos:
+                    site = st.text_input(LABEL["SITE"], value="-")
+                    contatos = st.text_area(LABEL["CONTATOS"], value="-", height=80)
+                    analise_tec = st.text_input(LABEL["ANALISE_TECNICA"], value="-")
 
-st.title("🏗️ Atuação de Prospecção de Dados")
+                with tab_obs:
+                    obs = st.text_area(LABEL["OBS"], value="-", height=100)
+                    pts_fortes = st.text_area(LABEL["PONTOS_FORTES"], value="-", height=80)
+                    pts_fracos = st.text_area(LABEL["PONTOS_FRACOS"], value="-", height=80)
+                    conc = st.text_area(LABEL["CONCORRENTES"], value="-", height=80)
+
+                save = st.form_submit_button("💾 Salvar empresa", type="primary", use_container_width=True)
+                if not segmentos_ms:
+                    st.error("Selecione pelo menos **um Segmento**.")
+                    return
+                if save:
+                    if not nome.strip():
+                        st.error("O campo **Nome da Empresa** é obrigatório.")
+                        return
 
-# ====== Filtros por Segmento (com modo seleção/lista) ======
-if st.session_state.segment_view == "select":
-    st.subheader("Filtros por Segmento")
-    bt_cols = st.columns(len(SEGMENT_FILTERS))
-    for i, seg in enumerate(SEGMENT_FILTERS):
-        with bt_cols[i]:
-            if st.button(seg, use_container_width=True, key=f"seg-{seg}"):
-                st.session_state.filter_segmento = seg
-                st.session_state.segment_view = "list"
-                st.rerun()
-    st.caption("Escolha um segmento para visualizar os resultados.")
-    st.stop()
-
-# Modo LISTA (mostra resultados do filtro + botão Voltar)
-st.subheader(f"Resultados — Segmento: {st.session_state.filter_segmento}")
-c_voltar, c_novo = st.columns(2)
-with c_voltar:
-    if st.button("⬅️ Voltar aos filtros", use_container_width=True, key="btn-voltar-segmentos"):
-        st.session_state.segment_view = "select"
-        st.session_state.filter_segmento = "Todos"
-        st.rerun()
+                    record = {
+                        "PRIORIDADE": str(prioridade),
+                        "SITUACAO": _s(situacao),
+                        "CNPJ": _s(cnpj),
+                        "NOME_EMPRESA": _s(nome),
+                        "SEGMENTO": segments_to_str(segmentos_ms),
+                        "DESCRICAO": _s(descricao),
+                        "RESUMO": _s(resumo),
+                        "METODOLOGIA": _s(metodologia),
+                        "COBERTURA": _s(cobertura),
+                        "SITE": _s(site),
+                        "CONTATOS": _s(contatos),
+                        "DATA_ASSINATURA": _s(data_ass),
+                        "VAL_ANOS": _s(val_anos),
+                        "VAL_MESES": _s(val_meses),
+                        "VAL_DIAS": _s(val_dias),
+                        "INICIO_RENOV": _s(inicio_renov),
+                        "VIGENCIA": _s(vigencia),
+                        "STATUS": "-",
+                        "NDA_ASSINADO": _s(nda_ass),
+                        "DOCUMENTO": _s(doc),
+                        "APROVACAO": _s(aprov),
+                        "ANALISE_TECNICA": _s(analise_tec),
+                        "RELACIONAMENTO": _s(relac),
+                        "AUTOMACAO": _s(auto),
+                        "OBS": _s(obs),
+                        "PONTOS_FORTES": _s(pts_fortes),
+                        "PONTOS_FRACOS": _s(pts_fracos),
+                        "CONCORRENTES": _s(conc),
+                        "STATUS_ATUAL": _s(status_atual),
+                    }
 
-def open_create_dialog(default_segmento: str | None, current_user: dict):
-    @st.dialog("✚ Nova empresa", width="large")
-    def _dialog():
-        st.caption("Preencha os campos e clique em **Salvar**.")
-        with st.form("form_nova_empresa"):
-            tab_geral, tab_datas, tab_prod, tab_contatos, tab_obs = st.tabs(
-                ["📌 Geral", "📅 Datas", "🧪 Produto/Cobertura", "🔗 Contatos & Docs", "🧭 Observações & Mercado"]
-            )
+                    try:
+                        _insert_record_main(record)
+                        st.success("Empresa criada com sucesso!")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erro ao criar empresa: {e}")
+        _dialog()
 
-            with tab_geral:
-                col1, col2 = st.columns(2)
-                with col1:
-                    nome = st.text_input(LABEL["NOME_EMPRESA"], value="")
-                    cnpj = st.text_input(LABEL["CNPJ"], value="")
-                    segmento_ms_default = [default_segmento] if default_segmento in SEGMENT_OPTIONS else []
-                    segmentos_ms = st.multiselect(LABEL["SEGMENTO"], options=SEGMENT_OPTIONS, default=segmento_ms_default)
-                    prioridade = st.select_slider("Prioridade (0 = sem prioridade, 3 = alta)", options=[0, 1, 2, 3], value=0)
-                    situacao = st.text_input(LABEL["SITUACAO"], value="-")
-                    status_atual = st.text_area(LABEL["STATUS_ATUAL"], value="-", height=80)
-                with col2:
-                    nda_ass = st.text_input(LABEL["NDA_ASSINADO"], value="-")
-                    aprov = st.text_input(LABEL["APROVACAO"], value="-")
-                    relac = st.text_input(LABEL["RELACIONAMENTO"], value="-")
-                    auto = st.text_input(LABEL["AUTOMACAO"], value="-")
-                    doc = st.text_input(LABEL["DOCUMENTO"], value="-")
+    with c_novo:
+        if is_admin and st.button("✚ Criar empresa", use_container_width=True, key="btn-criar-empresa"):
+            default_seg = st.session_state.filter_segmento if st.session_state.filter_segmento != "Todos" else None
+            open_create_dialog(default_segmento=default_seg, current_user=user)
 
-            with tab_datas:
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    data_ass = st.text_input(f"{LABEL['DATA_ASSINATURA']} (DD/MM/AAAA)", value="-")
-                with col2:
-                    inicio_renov = st.text_input(f"{LABEL['INICIO_RENOV']} (DD/MM/AAAA)", value="-")
-                with col3:
-                    vigencia = st.text_input(f"{LABEL['VIGENCIA']} (DD/MM/AAAA)", value="-")
-                col4, col5, col6 = st.columns(3)
-                with col4:
-                    val_anos = st.text_input(LABEL["VAL_ANOS"], value="-")
-                with col5:
-                    val_meses = st.text_input(LABEL["VAL_MESES"], value="-")
-                with col6:
-                    val_dias = st.text_input(LABEL["VAL_DIAS"], value="-")
+    st.divider()
 
-            with tab_prod:
-                col1, col2 = st.columns(2)
-                with col1:
-                    metodologia = st.text_area(LABEL["METODOLOGIA"], value="-", height=100)
-                    cobertura = st.text_area(LABEL["COBERTURA"], value="-", height=100)
-                    resumo = st.text_area(LABEL["RESUMO"], value="-", height=100)
-                with col2:
-                    descricao = st.text_area(LABEL["DESCRICAO"], value="-", height=160)
+    # Carrega do DB só a página visível (consulta já disparada em segundo plano no início da página;
+    # os comentários dos cards seguem carregando sem travar a tela)
+    def _goto_page(p: int):
+        st.session_state.card_page = max(0, p)
 
-            with tab_contatos:
-                site = st.text_input(LABEL["SITE"], value="-")
-                contatos = st.text_area(LABEL["CONTATOS"], value="-", height=80)
-                analise_tec = st.text_input(LABEL["ANALISE_TECNICA"], value="-")
+    def _set_page_size():
+        st.session_state.page_size = st.session_state.page_size_sel
+        st.session_state.card_page = 0
 
-            with tab_obs:
-                obs = st.text_area(LABEL["OBS"], value="-", height=100)
-                pts_fortes = st.text_area(LABEL["PONTOS_FORTES"], value="-", height=80)
-                pts_fracos = st.text_area(LABEL["PONTOS_FRACOS"], value="-", height=80)
-                conc = st.text_area(LABEL["CONCORRENTES"], value="-", height=80)
-
-            save = st.form_submit_button("💾 Salvar empresa", type="primary", use_container_width=True)
-            if not segmentos_ms:
-                st.error("Selecione pelo menos **um Segmento**.")
-                return
-            if save:
-                if not nome.strip():
-                    st.error("O campo **Nome da Empresa** é obrigatório.")
-                    return
+    def _open_details(rec_id: str):
+        rec = _overlay_record(_fetch_record(rec_id))
+        if rec is None:
+            st.warning("Registro não encontrado (pode ter sido removido).")
+        else:
+            open_company_dialog(rec, is_admin=is_admin, current_user=user)
 
-                record = {
-                    "PRIORIDADE": str(prioridade),
-                    "SITUACAO": _s(situacao),
-                    "CNPJ": _s(cnpj),
-                    "NOME_EMPRESA": _s(nome),
-                    "SEGMENTO": segments_to_str(segmentos_ms),
-                    "DESCRICAO": _s(descricao),
-                    "RESUMO": _s(resumo),
-                    "METODOLOGIA": _s(metodologia),
-                    "COBERTURA": _s(cobertura),
-                    "SITE": _s(site),
-                    "CONTATOS": _s(contatos),
-                    "DATA_ASSINATURA": _s(data_ass),
-                    "VAL_ANOS": _s(val_anos),
-                    "VAL_MESES": _s(val_meses),
-                    "VAL_DIAS": _s(val_dias),
-                    "INICIO_RENOV": _s(inicio_renov),
-                    "VIGENCIA": _s(vigencia),
-                    "STATUS": "-",
-                    "NDA_ASSINADO": _s(nda_ass),
-                    "DOCUMENTO": _s(doc),
-                    "APROVACAO": _s(aprov),
-                    "ANALISE_TECNICA": _s(analise_tec),
-                    "RELACIONAMENTO": _s(relac),
-                    "AUTOMACAO": _s(auto),
-                    "OBS": _s(obs),
-                    "PONTOS_FORTES": _s(pts_fortes),
-                    "PONTOS_FRACOS": _s(pts_fracos),
-                    "CONCORRENTES": _s(conc),
-                    "STATUS_ATUAL": _s(status_atual),
-                }
+    st.text_input("🔎 Buscar", key="search_q", on_change=_goto_page, args=(0,),
+                  placeholder="Nome, descrição, cobertura, concorrentes, comentários…")
 
-                try:
-                    _insert_record_main(record)
-                    st.success("Empresa criada com sucesso!")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Erro ao criar empresa: {e}")
-    _dialog()
+    (df_cards, total), fresh = _await(*page_jobs["cards"])
+    df_all = _overlay_pending(df_cards)
+    if not fresh:
+        st.caption("⏳ A consulta está demorando; mostrando a última versão carregada.")
+
+    page, page_size = st.session_state.card_page, st.session_state.page_size
+    n_pages = max(1, -(-total // page_size))
+    if page >= n_pages:  # o filtro/tabela encolheu desde a última página vista
+        _goto_page(n_pages - 1)
+        st.rerun()
 
-with c_novo:
-    if is_admin and st.button("✚ Criar empresa", use_container_width=True, key="btn-criar-empresa"):
-        default_seg = st.session_state.filter_segmento if st.session_state.filter_segmento != "Todos" else None
-        open_create_dialog(default_segmento=default_seg, current_user=user)
-
-st.divider()
-
-# Carrega do DB conforme filtro atual
-df_all = _fetch_df(st.session_state.filter_segmento)
-
-if df_all.empty:
-    st.info("Nenhum registro encontrado. Importe um Excel na barra lateral.")
-else:
-    st.caption(f"{len(df_all)} registro(s). Clique em um card para ver detalhes.")
-    cols = st.columns(3)
-    for i, (_, row) in enumerate(df_all.iterrows()):
-        with cols[i % 3]:
-            with st.container(border=True):
-                nome = _s(row.get("NOME_EMPRESA"))
-                seg  = segments_to_str(normalize_segments(row.get("SEGMENTO")))
-                stat = _s(row.get("STATUS"))
-                vig  = _s(row.get("VIGENCIA"))
-                prio = _s(row.get("PRIORIDADE"))
-                st.markdown(f"### {nome}")
-                st.caption(f"Segmento: **{seg}** • Status: **{stat}**")
-                st.caption(f"Vigência: **{vig}** • Prioridade: **{prio}**")
-                if st.button("Ver detalhes", key=f"btn-det-{row['ID']}", use_container_width=True):
-                    open_company_dialog(row.to_dict(), is_admin=is_admin, current_user=user)
-# Carrega do DB conforme filtro atual
-df_all = _fetch_df(st.session_state.filter_segmento)
-
-# === Botões de download (XLSX/CSV) ===
+    if df_all.empty and st.session_state.search_q.strip():
+        st.info("Nenhuma empresa encontrada para a busca.")
+    elif df_all.empty:
+        st.info("Nenhum registro encontrado. Importe um Excel na barra lateral.")
+    else:
+        c_info, c_modo, c_tam = st.columns([3, 1, 1], vertical_alignment="center")
+        with c_info:
+            st.caption(f"{total} registro(s) — página {page + 1} de {n_pages}. Clique em um card para ver detalhes.")
+        with c_modo:
+            compact = st.toggle("Tabela compacta", key="compact_view")
+        with c_tam:
+            st.selectbox("Por página", PAGE_SIZE_OPTIONS, index=PAGE_SIZE_OPTIONS.index(page_size),
+                         key="page_size_sel", on_change=_set_page_size, label_visibility="collapsed")
+
+        if compact:
+            tbl = df_all.assign(SEGMENTO=df_all["SEGMENTO"].map(lambda v: segments_to_str(normalize_segments(v))))
+            tbl = tbl[["NOME_EMPRESA", "SEGMENTO", "STATUS", "VIGENCIA", "PRIORIDADE"]].rename(columns=LABEL)
+            tbl_key = f"tbl-{st.session_state.filter_segmento}-{st.session_state.search_q}-{page}-{page_size}"
+            ev = st.dataframe(tbl, hide_index=True, width="stretch", key=tbl_key,
+                              on_select="rerun", selection_mode="single-row")
+            sel = (tbl_key, df_all["ID"].iloc[ev.selection.rows[0]]) if ev.selection.rows else None
+            # a seleção persiste entre reruns: abre o modal só quando ela muda
+            if sel is not None and sel != st.session_state.get("tbl_opened"):
+                st.session_state.tbl_opened = sel
+                _open_details(sel[1])
+            elif sel is None:
+                st.session_state.tbl_opened = None
+        else:
+            cols = st.columns(3)
+            for i, (_, row) in enumerate(df_all.iterrows()):
+                with cols[i % 3]:
+                    with st.container(border=True):
+                        nome = _s(row.get("NOME_EMPRESA"))
+                        seg  = segments_to_str(normalize_segments(row.get("SEGMENTO")))
+                        stat = _s(row.get("STATUS"))
+                        vig  = _s(row.get("VIGENCIA"))
+                        prio = _s(row.get("PRIORIDADE"))
+                        st.markdown(f"### {nome}")
+                        st.caption(f"Segmento: **{seg}** • Status: **{stat}**")
+                        st.caption(f"Vigência: **{vig}** • Prioridade: **{prio}**")
+                        if st.button("Ver detalhes", key=f"btn-det-{row['ID']}", use_container_width=True):
+                            _open_details(row["ID"])
+
+        if n_pages > 1:
+            c_prev, c_pg, c_next = st.columns([1, 2, 1], vertical_alignment="center")
+            with c_prev:
+                st.button("◀ Anterior", key="pg-prev", disabled=page == 0,
+                          on_click=_goto_page, args=(page - 1,), use_container_width=True)
+            with c_pg:
+                st.caption(f"Página {page + 1} de {n_pages}")
+            with c_next:
+                st.button("Próxima ▶", key="pg-next", disabled=page >= n_pages - 1,
+                          on_click=_goto_page, args=(page + 1,), use_container_width=True)
+
+    _perf_end_run()
+
+if __name__ == "__main__":
+    main()
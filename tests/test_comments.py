@@ -0,0 +1,29 @@
+"""Comentários: leitura em lote por empresa, com cache que não guarda leitura feita durante uma gravação."""
+
+
+def test_bulk_fetch_groups_by_company_and_caches(app, add_companies):
+    add_companies([{"ID": "a"}, {"ID": "b"}])
+    app._insert_comment("a", "u", "U", "primeiro")
+    app._insert_comment("a", "u", "U", "segundo")
+
+    out = app._fetch_comments_bulk(["a", "b"])
+
+    assert sorted(out["a"]["MESSAGE"]) == ["primeiro", "segundo"]
+    assert out["b"].empty
+    assert set(app._table_state()["comments"]) == {"a", "b"}
+
+
+def test_comment_written_during_fetch_is_not_lost(app, add_companies, monkeypatch):
+    add_companies([{"ID": "a"}])
+    read = app._read_df
+
+    def racing_read(q, params=None):
+        df = read(q, params)
+        app._insert_comment("a", "u", "U", "no meio")
+        return df
+    monkeypatch.setattr(app, "_read_df", racing_read)
+    assert app._fetch_comments_bulk(["a"])["a"].empty
+    monkeypatch.setattr(app, "_read_df", read)
+
+    assert "a" not in app._table_state()["comments"]
+    assert list(app._fetch_comments_bulk(["a"])["a"]["MESSAGE"]) == ["no meio"]
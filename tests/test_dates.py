@@ -0,0 +1,20 @@
+"""Datas: DD/MM/AAAA explícito, ISO e série do Excel, valor solto ou coluna inteira."""
+from datetime import date
+
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("05/03/2024", date(2024, 3, 5)),     # dia primeiro, nunca mês
+    ("5-3-2024", date(2024, 3, 5)),
+    ("2024-03-05", date(2024, 3, 5)),
+    ("2024-03-05 10:00:00", date(2024, 3, 5)),
+    (45356, date(2024, 3, 5)),             # série do Excel
+    ("1999", None),                        # fora da faixa de série: não vira data
+    ("-", None),
+    (None, None),
+])
+def test_parse_date(app, raw, expected):
+    assert app._parse_date(raw) == expected
+    assert app._parse_date_col(pd.Series([raw, raw], dtype=object)).tolist() == [expected, expected]
@@ -0,0 +1,55 @@
+"""Duplicatas: CNPJ com dígitos verificadores conferidos, nome canônico e nome parecido (MinHash)."""
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize("raw, want", [
+    ("11.222.333/0001-81", "11222333000181"),
+    ("11222333000181", "11222333000181"),
+    (123456000149.0, "00123456000149"),   # o Excel perde os zeros à esquerda
+    ("123456000149", "00123456000149"),
+    ("11222333000180", None),             # verificador errado
+    ("00000000000000", None),
+    ("123", None),
+    ("-", None),
+    (None, None),
+])
+def test_cnpj_canon(app, raw, want):
+    assert app._cnpj_canon(raw) == want
+
+
+def test_matches_pick_the_reason_and_what_can_be_merged(app):
+    existing = pd.DataFrame({
+        "ID": ["e1", "e2", "e3", "e4"],
+        "NOME_EMPRESA": ["Alfa Dados Ltda", "EMPRESA BETA S.A.", "Consultoria Gamaestatística",
+                         "Delta Sistemas Integrados"],
+        "CNPJ": ["11.222.333/0001-81", "-", "-", "44555666000181"],
+    })
+    incoming = pd.DataFrame({
+        "NOME_EMPRESA": ["Outro Nome", "Empresa Beta Ltda.", "Consultoria Gamaestatisticas",
+                         "Delta Sistemas Integrados", "Delta Sistema Integrados", "Zeta"],
+        "CNPJ": ["11222333000181", "-", "-", "00123456000149", "44555666000262", "-"],
+    })
+
+    got = app._dedup_matches(incoming, existing).set_index("POS")
+
+    assert got["ID_EXISTENTE"].to_dict() == {0: "e1", 1: "e2", 2: "e3", 4: "e4"}
+    assert got["MOTIVO"].to_dict() == {0: "CNPJ igual", 1: "nome igual", 2: "nome parecido",
+                                       4: "mesma raiz de CNPJ (filial?)"}
+    assert got["MESCLAR"].to_dict() == {0: True, 1: True, 2: False, 4: False}
+    assert (got["SIMILARIDADE"] >= app.DEDUP_THRESHOLD).all()
+
+
+def test_report_reads_the_sheet_against_the_table(app, add_companies):
+    add_companies([{"ID": "e1", "NOME_EMPRESA": "Alfa Dados Ltda", "CNPJ": "11.222.333/0001-81"}])
+    buf = BytesIO()
+    pd.DataFrame({"Nome da Empresa": ["ALFA DADOS", "Beta"], "CNPJ": ["-", "11.222.333/0001-80"]}) \
+        .to_excel(buf, index=False, sheet_name="Dados")
+    buf.seek(0)
+
+    report, stats = app.dedup_report(buf, "Dados")
+
+    assert report[["POS", "ID_EXISTENTE", "MOTIVO"]].values.tolist() == [[0, "e1", "nome igual"]]
+    assert stats == {"rows": 2, "matches": 1, "cnpj_invalid": 1}
@@ -0,0 +1,48 @@
+"""Sincronização delta: o snapshot em memória recebe só as linhas alteradas desde a marca d'água."""
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def delta(app, monkeypatch, add_companies):
+    monkeypatch.setattr(app, "SYNC_MODE", "delta")
+    monkeypatch.setattr(app, "SYNC_INTERVAL_S", 0)
+    add_companies([{"ID": "a", "NOME_EMPRESA": "A"}, {"ID": "b", "NOME_EMPRESA": "B"},
+                   {"ID": "c", "NOME_EMPRESA": "C"}])
+    app._main_snapshot()
+    queries = []
+    read = app._read_df
+    monkeypatch.setattr(app, "_read_df", lambda q, params=None: (queries.append(q), read(q, params))[1])
+    return queries
+
+
+def test_delta_patches_changed_rows_into_the_snapshot(app, delta):
+    stt = app._table_state()
+    version = stt["version"]
+    app._write("UPDATE TB_EMPRESAS SET NOME_EMPRESA = 'A2', UPDATED_AT = TIMESTAMP '2024-02-01' WHERE ID = 'a'")
+    app._write("INSERT INTO TB_EMPRESAS (ID, NOME_EMPRESA, CREATED_AT, UPDATED_AT) "
+               "VALUES ('d', 'D', TIMESTAMP '2024-02-01', TIMESTAMP '2024-02-01')")
+
+    snap = app._main_snapshot()
+
+    assert len(delta) == 1 and "WHERE UPDATED_AT >=" in delta[0]
+    assert dict(zip(snap["ID"], snap["NOME_EMPRESA"])) == {"a": "A2", "b": "B", "c": "C", "d": "D"}
+    assert stt["version"] == version + 1
+    assert stt["watermark"] == pd.Timestamp("2024-02-01")
+
+
+def test_delta_without_changes_keeps_the_version(app, delta):
+    stt = app._table_state()
+    version = stt["version"]
+    app._main_snapshot()
+    assert len(delta) == 1 and stt["version"] == version
+
+
+def test_reconcile_drops_deleted_rows(app, delta, monkeypatch):
+    monkeypatch.setattr(app, "SYNC_RECONCILE_S", 0)
+    app._write("DELETE FROM TB_EMPRESAS WHERE ID = 'b'")
+
+    snap = app._main_snapshot()
+
+    assert sorted(snap["ID"]) == ["a", "c"]
+    assert not any(q.strip() == f"SELECT * FROM {app.FQN_MAIN}" for q in delta)
@@ -0,0 +1,76 @@
+"""Documentos: armazenamento por conteúdo, prévia em disco e remoção com contagem de vínculos."""
+import os
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+
+def _png() -> BytesIO:
+    buf = BytesIO()
+    Image.new("RGB", (40, 40), "red").save(buf, format="PNG")
+    buf.seek(0)
+    return buf
+
+
+def test_same_content_is_stored_once(app):
+    assert app.attach_document("r1", _png(), "a.png", "u")
+    assert not app.attach_document("r1", _png(), "b.png", "u")   # mesmo conteúdo na mesma empresa
+    assert app.attach_document("r2", _png(), "c.png", "u")
+    sha = app._fetch_documents("r1")["SHA256"].iloc[0]
+    blobs = [f for _, _, fs in os.walk(app.DOCS_DIR) for f in fs if not f.endswith((".part", ".png", ".txt"))]
+    assert blobs == [sha]
+
+
+def test_detach_removes_file_only_when_unused(app):
+    app.attach_document("r1", _png(), "a.png", "u")
+    app.attach_document("r2", _png(), "a.png", "u")
+    d1, d2 = app._fetch_documents("r1").iloc[0], app._fetch_documents("r2").iloc[0]
+    app._doc_derive(d1["SHA256"], "image/png")
+
+    app.detach_document("r1", d1["ID"], d1["SHA256"])
+    assert os.path.exists(app._doc_path(d1["SHA256"]))
+    app.detach_document("r2", d2["ID"], d2["SHA256"])
+    assert not os.path.exists(app._doc_path(d1["SHA256"]))
+    assert not os.path.exists(app._doc_path(d1["SHA256"], ".thumb.png"))
+
+
+def test_preview_is_derived_once(app):
+    app.attach_document("r1", _png(), "a.png", "u")
+    sha = app._fetch_documents("r1")["SHA256"].iloc[0]
+    app._doc_derive(sha, "image/png")
+    prev = app._doc_preview(sha, "image/png")
+    assert prev["thumb"] and prev["text"] == "" and not prev["missing"]
+
+
+def test_missing_file_is_not_resubmitted(app, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app, "_submit", lambda *a: submitted.append(a))
+    sha = "ab" * 32
+    app._doc_derive(sha, "application/pdf")   # sem o arquivo: não cria diretório nem derivados
+    assert not os.path.exists(os.path.dirname(app._doc_path(sha)))
+    assert app._doc_preview(sha, "application/pdf") == {"thumb": None, "text": "", "missing": True}
+    assert submitted == []
+
+
+def test_derive_does_not_recreate_files_of_a_detached_document(app, monkeypatch):
+    app.attach_document("r1", _png(), "a.png", "u")
+    d = app._fetch_documents("r1").iloc[0]
+    reading, detached = threading.Event(), threading.Event()
+    thumbnail = app._thumbnail_png
+
+    def slow_thumbnail(img):
+        out = thumbnail(img)
+        reading.set()
+        detached.wait(2)
+        return out
+
+    monkeypatch.setattr(app, "_thumbnail_png", slow_thumbnail)
+    t = threading.Thread(target=app._doc_derive, args=(d["SHA256"], "image/png"))
+    t.start()
+    reading.wait(2)
+    app.detach_document("r1", d["ID"], d["SHA256"])
+    detached.set()
+    t.join(2)
+    assert not os.path.exists(app._doc_path(d["SHA256"], ".thumb.png"))
+    assert not os.path.exists(app._doc_path(d["SHA256"], ".txt"))
@@ -0,0 +1,61 @@
+"""Exportação: gerada no clique, escrita lote a lote e guardada por filtro, versão da tabela e formato."""
+from datetime import date
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+SEG = "Fornecedor de Dados"
+
+
+@pytest.fixture
+def companies(add_companies):
+    return add_companies([
+        {"ID": "a", "NOME_EMPRESA": "Alfa", "SEGMENTO": "fornecedor de dados", "DATA_ASSINATURA": date(2024, 3, 5)},
+        {"ID": "b", "NOME_EMPRESA": "Beta", "SEGMENTO": "Fornecedor de Soluções"},
+        {"ID": "c", "NOME_EMPRESA": "Gama", "SEGMENTO": "Fornecedor de Dados; Potenciais Novos Negócios"},
+    ])
+
+
+def test_export_is_built_once_per_table_version(app, companies, monkeypatch):
+    builds = []
+    writer = app._EXPORT_WRITERS["csv"]
+    monkeypatch.setitem(app._EXPORT_WRITERS, "csv", lambda b: (builds.append(1), writer(b))[1])
+
+    assert app._export_artifact(SEG, "csv", build=False) is None
+    data = app._export_artifact(SEG, "csv")
+    assert app._export_artifact(SEG, "csv", build=False) == data
+    assert app._export_artifact(SEG, "csv") == data and len(builds) == 1
+
+    app._invalidate_snapshot()
+    assert app._export_artifact(SEG, "csv", build=False) is None
+
+
+def test_export_cache_keeps_the_newest_entries(app, companies, monkeypatch):
+    monkeypatch.setattr(app, "EXPORT_CACHE_MAX", 2)
+    for fmt in app.EXPORT_FORMATS:
+        app._export_artifact(SEG, fmt)
+    assert [k[2] for k in app._export_cache()["items"]] == list(app.EXPORT_FORMATS)[-2:]
+
+
+def test_empty_filter_exports_nothing(app, companies):
+    assert all(app._export_artifact("Sem Segmento", fmt) == b"" for fmt in app.EXPORT_FORMATS)
+
+
+READERS = {
+    "xlsx": lambda b: pd.read_excel(b, dtype=str),
+    "csv": lambda b: pd.read_csv(b, dtype=str, encoding="utf-8-sig"),
+    "parquet": pd.read_parquet,
+}
+
+
+@pytest.mark.parametrize("fmt", list(READERS))
+def test_batched_writers_keep_every_row_and_the_header_once(app, companies, monkeypatch, fmt):
+    want = app._build_export_df(app._fetch_df(SEG, cols=app.EXPECTED_COLS))
+    monkeypatch.setattr(app, "EXPORT_BATCH_ROWS", 1)
+
+    got = READERS[fmt](BytesIO(app._export_artifact(SEG, fmt)))
+
+    assert list(got.columns) == list(want.columns)
+    assert got["Nome da Empresa"].tolist() == ["Alfa", "Gama"]
+    assert got["Data de Assinatura"].tolist()[0] == "05/03/2024"
@@ -0,0 +1,55 @@
+"""Ledger de importações: arquivo já importado e linhas já vistas não voltam ao banco."""
+from io import BytesIO
+
+import pandas as pd
+
+
+def _xlsx(df: pd.DataFrame) -> BytesIO:
+    buf = BytesIO()
+    df.to_excel(buf, index=False, sheet_name="Dados")
+    buf.seek(0)
+    return buf
+
+
+def test_ledger_file_is_looked_up_once_per_session(app, monkeypatch):
+    calls = []
+    store = app._source_store()
+    query = store.query
+    monkeypatch.setattr(store, "query", lambda q, params=None: (calls.append(params), query(q, params))[1])
+
+    assert app._ledger_file("abc") is None
+    assert app._ledger_file("abc") is None   # rerun com o mesmo arquivo no uploader: sem consulta
+    assert len(calls) == 1
+
+    res = {"rows": 3, "sent": 3, "inserted": 3, "updated": 0, "unchanged": 0}
+    app._ledger_add_file("abc", "a.xlsx", "Dados", res, "ana", 0.5)
+    prev = app._ledger_file("abc")
+    assert (prev["USERNAME"], prev["ROW_COUNT"]) == ("ana", 3)
+    assert len(calls) == 2
+
+
+def test_known_rows_are_not_sent_again(app):
+    first = pd.DataFrame({"Nome da Empresa": ["A", "B"], "CNPJ": ["11.222.333/0001-81", "-"]})
+    buf = _xlsx(first)
+    res = app.import_xlsx_streaming(buf, "Dados", app._hash_upload(buf))
+    assert (res["sent"], res["inserted"]) == (2, 2)
+
+    # outro arquivo com uma linha repetida (mesmo conteúdo) e uma nova
+    second = pd.DataFrame({"Nome da Empresa": ["B", "C"], "CNPJ": ["-", "-"]})
+    buf = _xlsx(second)
+    res = app.import_xlsx_streaming(buf, "Dados", app._hash_upload(buf))
+    assert (res["rows"], res["sent"], res["unchanged"], res["inserted"]) == (2, 1, 1, 1)
+    assert app._duck()["con"].execute("SELECT COUNT(*) FROM TB_EMPRESAS").fetchone() == (3,)
+
+
+def test_resumed_import_records_the_whole_file(app):
+    df = pd.DataFrame({"Nome da Empresa": ["A", "B", "C"], "CNPJ": ["-", "-", "-"]})
+    buf = _xlsx(df)
+    digest = app._hash_upload(buf)
+    app._import_checkpoints()[digest] = 1   # a execução anterior caiu depois da 1ª linha
+
+    res = app.import_xlsx_streaming(buf, "Dados", digest)
+    assert (res["rows"], res["resumed"]) == (2, 1)
+    app._ledger_add_file(digest, "a.xlsx", "Dados", res, "ana", 0.1)
+    assert app._ledger_file(digest)["ROW_COUNT"] == 3
+    assert digest not in app._import_checkpoints()
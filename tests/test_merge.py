@@ -0,0 +1,48 @@
+"""Importação por MERGE: chaves de casamento (iguais no SQL e no Python) e resolução por ID."""
+import pandas as pd
+
+
+def _rows(app, q, params=None):
+    return app._duck()["con"].execute(app._local_sql(q), params).fetchall()
+
+
+def test_match_keys_sql_matches_python(app):
+    df = pd.DataFrame({
+        "CNPJ": ["11.222.333/0001-81", "11222333000181", "1122233300018X", "123", None, "-"],
+        "NOME_EMPRESA": ["A", "B", "Gama Ltda", "  Beta  ", "Ácme", "-"],
+    })
+    con = app._duck()["con"]
+    con.register("_keys", df)
+    try:
+        sql = [r[0] for r in con.execute(f"SELECT {app._match_key_sql('t')} FROM _keys t").fetchall()]
+    finally:
+        con.unregister("_keys")
+    py = app._match_keys(df).tolist()
+    assert sql == [None if pd.isna(k) else k for k in py]
+    assert py[0] == py[1] == "cnpj:11222333000181"
+
+
+def test_merge_resolves_by_cnpj_then_name(app):
+    first = pd.DataFrame({"Nome da Empresa": ["Ácme Ltda", "Beta", "Gama"],
+                          "CNPJ": ["11.222.333/0001-81", "-", "1122233300018X"]})
+    assert app.import_to_sf_merge(first)["inserted"] == 3
+    again = app.import_to_sf_merge(first)
+    assert (again["inserted"], again["updated"], again["unchanged"]) == (0, 0, 3)
+
+    second = pd.DataFrame({"Nome da Empresa": ["Outro nome", "  beta ", "Gama"],
+                           "CNPJ": ["11222333000181", None, "1122233300018X"], "OBS": ["o1", "o2", "o3"]})
+    res = app.import_to_sf_merge(second)
+    assert (res["inserted"], res["updated"]) == (0, 3)
+    assert len(res["ids"]) == 3
+    assert _rows(app, f"SELECT NOME_EMPRESA, OBS FROM {app.FQN_MAIN} ORDER BY 1") == [
+        ("Gama", "o3"), ("Outro nome", "o1"), ("beta", "o2")]
+
+
+def test_merge_keeps_last_row_per_target(app):
+    app.import_to_sf_merge(pd.DataFrame({"Nome da Empresa": ["A"], "CNPJ": ["11.222.333/0001-81"]}))
+    (rec_id,), = _rows(app, f"SELECT ID FROM {app.FQN_MAIN}")
+    dup = pd.DataFrame({"ID": [rec_id, None], "Nome da Empresa": ["X1", "X2"],
+                        "CNPJ": ["-", "11222333000181"]})
+    res = app.import_to_sf_merge(dup)
+    assert res["ids"] == [rec_id]
+    assert _rows(app, f"SELECT NOME_EMPRESA FROM {app.FQN_MAIN}") == [("X2",)]
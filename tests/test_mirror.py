@@ -0,0 +1,54 @@
+"""Réplica DuckDB: só o delta desde a marca d'água vem do Snowflake; caches caem só no que mudou."""
+import duckdb
+import pytest
+
+
+class _FakeSnowflake:
+    """Outro DuckDB com o mesmo banco/schema do Snowflake: o SQL com nomes completos roda igual."""
+
+    def __init__(self, app):
+        self.con = duckdb.connect()
+        self.con.execute("ATTACH ':memory:' AS BASES_SPDO; CREATE SCHEMA BASES_SPDO.DB_APP_PROSPEC_DATA")
+        local = app._duck()["con"]
+        for fqn in app.MIRROR_TABLES:
+            cols = local.execute(f"DESCRIBE {app._local_sql(fqn)}").fetchall()
+            self.con.execute(f"CREATE TABLE {fqn} ({', '.join(f'{c[0]} {c[1]}' for c in cols)})")
+        self.queries = []
+
+    def query(self, q, params=None):
+        self.queries.append(q)
+        return self.con.execute(q, params).df()
+
+
+@pytest.fixture
+def mirror(app, monkeypatch):
+    monkeypatch.setattr(app, "DATA_MODE", "mirror")
+    monkeypatch.setattr(app, "SYNC_MODE", "delta")
+    sf = _FakeSnowflake(app)
+    monkeypatch.setitem(app._STORES, "snowflake", sf)
+    return sf
+
+
+def test_mirror_copies_only_the_delta(app, mirror):
+    duck, stt = app._duck(), app._table_state()
+    mirror.con.execute(f"INSERT INTO {app.FQN_MAIN} (ID, NOME_EMPRESA, UPDATED_AT) "
+                       "VALUES ('a', 'A', now()::TIMESTAMP), ('b', 'B', now()::TIMESTAMP)")
+    app._refresh_mirror(duck, stt)
+    version = stt["version"]
+    assert duck["con"].execute("SELECT COUNT(*) FROM TB_EMPRESAS").fetchone() == (2,)
+
+    mirror.queries.clear()
+    app._refresh_mirror(duck, stt)
+    assert stt["version"] == version  # nada mudou: caches intactos
+    assert any(app.FQN_MAIN + " WHERE UPDATED_AT >=" in q for q in mirror.queries)
+
+    mirror.con.execute(f"UPDATE {app.FQN_MAIN} SET NOME_EMPRESA = 'A2', "
+                       "UPDATED_AT = now()::TIMESTAMP + INTERVAL 1 SECOND WHERE ID = 'a'")
+    mirror.con.execute(f"INSERT INTO {app.FQN_COMMENTS} VALUES ('c1', 'b', 'u', 'n', 'oi', now()::TIMESTAMP)")
+    stt["comments"]["b"] = ("antigo", 0.0)
+    stt["comments"]["a"] = ("antigo", 0.0)
+    app._refresh_mirror(duck, stt)
+    assert stt["version"] == version + 1
+    assert "b" not in stt["comments"] and "a" in stt["comments"]
+    assert duck["con"].execute("SELECT ID, NOME_EMPRESA FROM TB_EMPRESAS ORDER BY 1").fetchall() == [
+        ("a", "A2"), ("b", "B")]
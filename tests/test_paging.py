@@ -0,0 +1,31 @@
+"""Paginação: só a página pedida sai da leitura, na ordem do nome, com o total do filtro."""
+import pytest
+
+SEG = "Fornecedor de Dados"
+COLS = ["ID", "NOME_EMPRESA", "SEGMENTO"]
+NAMES = ["Eta", "Alfa", "Zeta", "Delta", "Beta", "Gama", "Teta"]
+
+
+@pytest.fixture(params=["full", "query"])
+def companies(app, add_companies, monkeypatch, request):
+    monkeypatch.setattr(app, "SYNC_MODE", request.param)
+    add_companies([{"ID": f"d{i}", "NOME_EMPRESA": n, "SEGMENTO": SEG} for i, n in enumerate(NAMES)]
+                  + [{"ID": "s", "NOME_EMPRESA": "Sigma", "SEGMENTO": "Fornecedor de Soluções"}])
+
+
+def test_pages_slice_the_sorted_filter(app, companies):
+    pages = [app._fetch_page(SEG, COLS, p, 3) for p in range(3)]
+
+    assert [total for _, total in pages] == [len(NAMES)] * 3
+    assert [page["NOME_EMPRESA"].tolist() for page, _ in pages] == [
+        ["Alfa", "Beta", "Delta"], ["Eta", "Gama", "Teta"], ["Zeta"]]
+    assert list(pages[0][0].columns[:len(COLS)]) == COLS
+
+
+def test_page_past_the_end_is_empty(app, companies):
+    page, total = app._fetch_page(SEG, COLS, 5, 3)
+    assert page.empty and total == len(NAMES)
+
+
+def test_no_filter_counts_everything(app, companies):
+    assert app._fetch_page(None, COLS, 0, 100)[1] == len(NAMES) + 1
@@ -0,0 +1,47 @@
+"""Medição: só sessões de administrador por padrão e número de sessões guardadas limitado."""
+import pytest
+
+
+@pytest.fixture
+def session(app, monkeypatch):
+    current = {"sid": None}
+    monkeypatch.setattr(app, "_perf_session", lambda: current["sid"])
+    return current
+
+
+def test_runs_are_kept_for_the_most_recent_sessions(app, session, monkeypatch):
+    monkeypatch.setattr(app, "PERF_SESSIONS_KEPT", 3)
+    for i in range(5):
+        session["sid"] = f"s{i}"
+        app._perf_begin_run(admin=True)
+    session["sid"] = "s2"
+    app._perf_begin_run(admin=True)   # usada de novo: vai para o fim da fila
+    session["sid"] = "s5"
+    app._perf_begin_run(admin=True)
+    assert list(app._perf_state()["runs"]) == ["s4", "s2", "s5"]
+
+
+def test_admin_mode_measures_only_admin_sessions(app, session):
+    assert app.PERF_MODE == "admin"
+    session["sid"] = "visitante"
+    app._perf_begin_run(admin=False)
+    with app._timed("etapa") as ev:
+        pass
+    assert ev == {} and not app._perf_state()["events"]
+
+    session["sid"] = "admin"
+    app._perf_begin_run(admin=True)
+    with app._timed("etapa") as ev:
+        pass
+    assert ev["stage"] == "etapa" and len(app._perf_state()["events"]) == 1
+
+    app._perf_begin_run(admin=False)   # saiu da conta de administrador
+    assert "admin" not in app._perf_state()["runs"]
+
+
+def test_off_mode_records_nothing(app, session, monkeypatch):
+    monkeypatch.setattr(app, "PERF_MODE", "off")
+    session["sid"] = "admin"
+    app._perf_begin_run(admin=True)
+    list(app._timed_iter("lotes", iter([])))
+    assert not app._perf_state()["runs"] and not app._perf_state()["events"]
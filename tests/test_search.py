@@ -0,0 +1,25 @@
+"""Índice de busca: mudanças feitas durante a reconstrução entram uma vez só."""
+
+
+def test_comment_written_during_build_is_counted_once(app, add_companies):
+    add_companies([{"ID": "r1", "NOME_EMPRESA": "Acme Dados"}])
+    idx = app._search_index()
+    idx["building"] = True  # como _search_warmup antes de disparar a montagem
+    app._insert_comment("r1", "u", "U", "contrato zebra")  # gravado e enfileirado para reaplicar
+    app._search_build()
+
+    assert idx["docs"]["r1"]["_comments"]["zebra"] == 1
+    app._insert_comment("r1", "u", "U", "zebra de novo")
+    assert idx["docs"]["r1"]["_comments"]["zebra"] == 2
+    assert app._search("zebra") == ["r1"]
+
+
+def test_record_edit_during_build_is_replayed(app, add_companies):
+    add_companies([{"ID": "r1", "NOME_EMPRESA": "Acme Dados"}])
+    idx = app._search_index()
+    idx["building"] = True
+    ops_before = len(idx["replay"])
+    app._search_record("r1", {"NOME_EMPRESA": "Beta Consultoria"})
+    assert len(idx["replay"]) == ops_before + 1
+    app._search_build()
+    assert app._search("beta") == ["r1"]
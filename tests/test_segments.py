@@ -0,0 +1,44 @@
+"""Segmentos: grafias livres da planilha viram os segmentos canônicos (e a máscara de bits)."""
+import pytest
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("fornecedor de solucoes", ["Fornecedor de Soluções"]),
+    ("Potenciais Novos Negócios, fornecedor de dados",
+     ["Fornecedor de Dados", "Potenciais Novos Negócios"]),
+    ("  ", ["Sem Segmento"]),
+    ("-", ["Sem Segmento"]),
+    ("desconhecido", ["Sem Segmento"]),
+    (None, ["Sem Segmento"]),
+])
+def test_normalize_segments(app, raw, expected):
+    assert app.normalize_segments(raw) == expected
+
+
+def test_segments_mask_matches_normalization(app):
+    raw = "fornecedor de dados, Fornecedor de Soluções"
+    assert app.segments_mask(raw) == sum(app.SEG_BITS[s] for s in app.normalize_segments(raw))
+    assert app.segments_mask(raw) & app.SEG_BITS["Fornecedor de Dados"]
+    assert not app.segments_mask(raw) & app.SEG_BITS["Sem Segmento"]
+
+
+MESSY = [
+    "Fornecedor de Dados  ,Sem Segmento",
+    "fornecedor de dados ,  Fornecedor de Soluções",
+    "Fornecedor de Dados\t",
+    "\tfornecedor de solucoes ;potenciais novos negocios  ",
+    "Fornecedor de Dados; Fornecedor de Soluções",
+    "FORNECEDOR DE SOLUÇÕES",
+    " , ", "-", "", None, "nan", "desconhecido", "fornecedor de dados, desconhecido",
+]
+
+
+@pytest.mark.parametrize("segmento", ["Fornecedor de Dados", "Fornecedor de Soluções",
+                                      "Potenciais Novos Negócios", "Sem Segmento"])
+def test_sql_predicate_matches_normalize_segments(app, segmento):
+    con = app._duck()["con"]
+    rows = [(i, v) for i, v in enumerate(MESSY)]
+    con.execute("CREATE TEMP TABLE seg_cases (I INTEGER, SEGMENTO VARCHAR)")
+    con.executemany("INSERT INTO seg_cases VALUES (?, ?)", rows)
+    hit = {r[0] for r in con.execute(f"SELECT I FROM seg_cases WHERE {app._segment_predicate_sql(segmento)}").fetchall()}
+    assert hit == {i for i, v in rows if segmento in app.normalize_segments(v)}
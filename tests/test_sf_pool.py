@@ -0,0 +1,67 @@
+"""Pool de sessões do Snowflake: retry só do que pode rodar duas vezes e keepalive dentro do semáforo."""
+import threading
+import time
+
+import pytest
+
+
+@pytest.mark.parametrize("q, safe", [
+    ("SELECT 1", True),
+    ("\n  with x as (select 1) select * from x", True),
+    ("MERGE INTO t USING s ON t.ID = s.ID", False),
+    ("INSERT INTO t VALUES (1)", False),
+    ("update t set a = 1", False),
+    ("DELETE FROM t", False),
+])
+def test_retry_only_idempotent_statements(app, q, safe):
+    assert app._retry_safe(q) is safe
+
+
+class _Session:
+    def close(self):
+        pass
+
+
+def test_sf_run_retries_only_when_asked(app, monkeypatch):
+    monkeypatch.setattr(app, "get_session", _Session)
+    calls = []
+
+    def flaky(sess):
+        calls.append(sess)
+        if len(calls) == 1:
+            raise RuntimeError("390112 Session no longer exists")
+        return "ok"
+
+    with pytest.raises(RuntimeError):
+        app._sf_run(flaky)
+    assert len(calls) == 1
+    calls.clear()
+    assert app._sf_run(flaky, retry=True) == "ok"
+    assert len(calls) == 2
+
+
+def test_keepalive_waits_for_a_free_slot(app, monkeypatch):
+    monkeypatch.setattr(app, "SF_KEEPALIVE_S", 0.02)
+    monkeypatch.setattr(app, "SF_POOL_WAIT_S", 0.01)
+    pinged, lock = [], threading.Lock()
+
+    def ping(sess):
+        with lock:
+            pinged.append(sess)
+        return True
+
+    monkeypatch.setattr(app, "_ping", ping)
+    pool = app._sf_pool()
+    for _ in range(app.SF_POOL_SIZE):
+        pool["slots"].acquire()
+    pool["idle"].extend((_Session(), time.time()) for _ in range(3))
+    app._sf_keepalive(pool)
+    time.sleep(0.2)
+    assert pinged == []  # pool todo emprestado: nenhuma sessão extra em uso
+
+    for _ in range(app.SF_POOL_SIZE):
+        pool["slots"].release()
+    deadline = time.monotonic() + 2
+    while len(pinged) < 3 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert len(pinged) >= 3 and len(pool["idle"]) == 3
@@ -0,0 +1,65 @@
+"""STATUS: regra em pandas igual à do SQL e recálculo restrito aos IDs informados (edições e importações)."""
+from datetime import date, timedelta
+from io import BytesIO
+
+import pandas as pd
+
+
+def _dates():
+    today = date.today()
+    d = lambda n: today + timedelta(days=n)  # noqa: E731
+    return [
+        {"ID": "neg", "DATA_ASSINATURA": None, "INICIO_RENOV": None, "VIGENCIA": None},
+        {"ID": "vig", "DATA_ASSINATURA": d(-100), "INICIO_RENOV": d(30), "VIGENCIA": d(60)},
+        {"ID": "ren", "DATA_ASSINATURA": d(-100), "INICIO_RENOV": d(-1), "VIGENCIA": d(10)},
+        {"ID": "atr", "DATA_ASSINATURA": d(-100), "INICIO_RENOV": None, "VIGENCIA": d(-5)},
+        {"ID": "hoje", "DATA_ASSINATURA": d(-100), "INICIO_RENOV": d(0), "VIGENCIA": d(0)},
+    ]
+
+
+def test_sql_status_matches_vectorized_rule(app, add_companies):
+    df = add_companies(_dates())
+    app._refresh_statuses()
+    con = app._duck()["con"]
+    got = dict(con.execute("SELECT ID, STATUS FROM TB_EMPRESAS").fetchall())
+    want = app._calc_status_vec(df["DATA_ASSINATURA"], df["INICIO_RENOV"], df["VIGENCIA"])
+    assert got == dict(zip(df["ID"], want))
+    assert got["vig"] == "EM VIGÊNCIA" and got["atr"] == "ATRASADO" and got["hoje"] == "-"
+
+    nxt = dict(con.execute("SELECT ID, STATUS_PROX_MUDANCA FROM TB_EMPRESAS").fetchall())
+    vec = app._next_status_change_vec(df["DATA_ASSINATURA"], df["INICIO_RENOV"], df["VIGENCIA"])
+    assert {k: None if pd.isna(v) else pd.Timestamp(v) for k, v in nxt.items()} == {
+        i: None if pd.isna(v) else v for i, v in zip(df["ID"], vec)}
+
+
+def test_refresh_by_ids_touches_only_those_rows(app, add_companies):
+    add_companies(_dates())
+    app._refresh_statuses(["vig", "atr"])
+    got = dict(app._duck()["con"].execute("SELECT ID, STATUS FROM TB_EMPRESAS").fetchall())
+    assert got == {"neg": "-", "vig": "EM VIGÊNCIA", "ren": "-", "atr": "ATRASADO", "hoje": "-"}
+
+
+def test_streaming_import_refreshes_only_written_ids(app, monkeypatch):
+    df = pd.DataFrame({"Nome da Empresa": ["A", "B"], "CNPJ": ["11.222.333/0001-81", "-"],
+                       "Data de Assinatura": ["01/01/2020", None]})
+    buf = BytesIO()
+    df.to_excel(buf, index=False, sheet_name="Dados")
+    buf.seek(0)
+    calls = []
+    refresh = app._refresh_statuses
+    monkeypatch.setattr(app, "_refresh_statuses", lambda ids=None: (calls.append(ids), refresh(ids))[1])
+
+    res = app.import_xlsx_streaming(buf, "Dados", app._hash_upload(buf))
+
+    assert res["inserted"] == 2
+    assert len(calls) == 1 and calls[0] is not None
+    assert sorted(calls[0]) == sorted(r[0] for r in app._duck()["con"].execute("SELECT ID FROM TB_EMPRESAS").fetchall())
+    assert dict(app._duck()["con"].execute("SELECT NOME_EMPRESA, STATUS FROM TB_EMPRESAS").fetchall())["B"] == "EM NEGOCIAÇÃO"
+
+
+def test_refresh_keeps_updated_at(app, add_companies):
+    add_companies(_dates())
+    app._refresh_statuses()
+    app._refresh_statuses(["vig", "atr"])
+    got = {r[0] for r in app._duck()["con"].execute("SELECT DISTINCT UPDATED_AT FROM TB_EMPRESAS").fetchall()}
+    assert got == {pd.Timestamp("2024-01-01").to_pydatetime()}
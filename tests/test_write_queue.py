@@ -0,0 +1,61 @@
+"""Fila de gravação: edições e comentários ficam na sessão e "Aplicar" grava tudo em lote."""
+from datetime import date, timedelta
+
+import pytest
+import streamlit as st
+
+
+@pytest.fixture
+def queue(app, add_companies):
+    add_companies([{"ID": "a", "NOME_EMPRESA": "A"}, {"ID": "b", "NOME_EMPRESA": "B"},
+                   {"ID": "c", "NOME_EMPRESA": "C"}])
+    st.session_state.pending_writes = {"updates": {}, "comments": []}
+    return st.session_state.pending_writes
+
+
+def test_queued_edits_accumulate_and_overlay(app, queue):
+    app._queue_update("a", {"OBS": "x"})
+    app._queue_update("a", {"PRIORIDADE": "Alta", "NAO_EXISTE": 1})
+    app._queue_comment("a", "u", "U", "  oi  ")
+    app._queue_comment("a", "u", "U", "   ")
+
+    assert queue["updates"] == {"a": {"OBS": "x", "PRIORIDADE": "Alta"}}
+    assert [c["MESSAGE"] for c in app._pending_comments("a")] == ["oi"]
+    assert app._pending_count() == 2
+    snap = app._overlay_pending(app._main_snapshot())
+    assert snap.set_index("ID").loc["a", "OBS"] == "x"
+
+
+def test_flush_writes_everything_and_refreshes_dated_statuses(app, queue, monkeypatch):
+    writes = []
+    write = app._write
+    monkeypatch.setattr(app, "_write", lambda q, params=None: (writes.append(q), write(q, params))[1])
+    ass = date.today() - timedelta(days=10)
+    app._queue_update("a", {"OBS": "x"})
+    app._queue_update("b", {"OBS": "y"})
+    app._queue_update("c", {"DATA_ASSINATURA": ass, "INICIO_RENOV": date.today() + timedelta(days=30)})
+    app._queue_comment("a", "u", "U", "oi")
+
+    assert app._flush_pending() == 4
+
+    assert queue == {"updates": {}, "comments": []}
+    assert sum(q.startswith(f"UPDATE {app.FQN_MAIN} AS t") for q in writes) == 2
+    con = app._duck()["con"]
+    got = {r[0]: r[1:] for r in con.execute("SELECT ID, OBS, DATA_ASSINATURA, STATUS FROM TB_EMPRESAS").fetchall()}
+    assert got["a"][0] == "x" and got["b"][0] == "y"
+    assert got["c"][1:] == (ass, "EM VIGÊNCIA")
+    assert con.execute("SELECT EMPRESA_ID, MESSAGE FROM TB_EMPRESAS_COMENTARIOS").fetchall() == [("a", "oi")]
+
+
+def test_failed_flush_keeps_only_what_was_not_written(app, queue, monkeypatch):
+    app._queue_update("a", {"OBS": "x"})
+    app._queue_comment("a", "u", "U", "oi")
+
+    def boom(rows):
+        raise RuntimeError("caiu")
+    monkeypatch.setattr(app, "_insert_comments_many", boom)
+    with pytest.raises(RuntimeError):
+        app._flush_pending()
+
+    assert queue["updates"] == {} and len(queue["comments"]) == 1
+    assert app._duck()["con"].execute("SELECT OBS FROM TB_EMPRESAS WHERE ID = 'a'").fetchone() == ("x",)